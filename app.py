@@ -8,7 +8,7 @@ import csv
 import io
 from datetime import datetime
 from werkzeug.utils import secure_filename
-from flask import make_response
+from flask import make_response, Response
 import shutil  # For file operations
 
 from database import (
@@ -17,28 +17,147 @@ from database import (
     IMAGE_DIR,
     get_processed_videos,
     delete_fish_entry,
+    delete_fish_bulk,
+    get_pending_fish,
+    get_detection_checkpoint,
+    delete_detection_checkpoint,
+    delete_video_fish,
+    register_video,
+    link_video_alias,
+    resolve_video_alias,
+    get_upload,
+    find_unfinished_upload,
+    get_identities,
+    get_identity_sightings,
+    get_video_summary,
+    get_taxonomy_counts,
+    TAXONOMY_RANKS,
+    set_upload_status,
+    get_reprocess_job,
+    get_reprocess_jobs,
+    search_fish,
+)
+from detector import (
+    detect_and_extract_fish,
+    rederive_video,
+    get_video_dirname,
+    warm_up as warm_up_detector,
+    MODEL_PATH,
+)
+from detection_cache import (
+    DETECTION_CACHE_ENABLED,
+    model_id_for,
+    adopt_partial_cache,
+    discard_partial_cache,
+)
+from live_stream import detect_stream, stream_name_for, STREAM_SEGMENT_SECONDS
+from llm_handler import (
+    get_fish_taxonomy,
+    get_model as get_llm_model,
+    CharacterizationQueue,
+)
+from crop_store import (
+    read_packed_crop,
+    delete_crop,
+    delete_crops_async,
+    pack_filename_for,
+)
+from fingerprint import (
+    save_stream_with_fingerprint,
+    fingerprint_file,
+    frame_signature,
+    find_duplicate_video,
+    VIDEO_FRAME_SIGNATURE,
+)
+import metrics
+from job_state import (
+    PROCESS_ID,
+    JOB_STALE_SECONDS,
+    get_progress,
+    edit_progress,
+    edit_own_progress,
+    is_busy,
+    owns_job,
+    claim_job,
+    JobBusyError,
+    finish_job,
+    finish_characterization,
+    heartbeat,
+    get_selected_video,
+    cached_selected_video,
+    set_selected_video,
+    publish_queue,
+    get_queue_snapshot,
+    live_fish_waiting,
+    send_command,
+    take_commands,
+)
+from reprocess import create_job as create_reprocess_job, pause_job, run_job as run_reprocess_job
+from profiler import (
+    PROFILING_ENABLED,
+    PROFILE_DIR,
+    PROFILE_MAX_SECONDS,
+    FORMATS as PROFILE_FORMATS,
+    capture as capture_profile,
+    list_profiles,
+    profile_filename,
+)
+from uploads import (
+    UploadOffsetError,
+    partial_upload_path,
+    received_bytes,
+    start_upload,
+    append_chunk,
+    discard_partial_upload,
+    is_streamable,
+    UPLOAD_CHUNK_SIZE,
+    EARLY_DETECTION,
+    EARLY_DETECTION_MIN_BYTES,
+    EARLY_DETECTION_STEP_BYTES,
+    EARLY_DETECTION_IDLE_SECONDS,
 )
-from detector import detect_and_extract_fish
-from llm_handler import get_fish_taxonomy
 
 # --- Flask App Setup ---
 app = Flask(__name__)
 app.config["UPLOAD_FOLDER"] = "uploads/"
-app.config["MAX_CONTENT_LENGTH"] = 200 * 1024 * 1024  # 200 MB upload limit
+# 200 MB limit per request: a whole file for /upload, one chunk for /uploads
+app.config["MAX_CONTENT_LENGTH"] = 200 * 1024 * 1024
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 os.makedirs(IMAGE_DIR, exist_ok=True)  # Ensure image dir exists too
 
-# --- Global Variables for Progress Tracking ---
-# Using dictionaries to manage state for potentially multiple uploads (though simple example assumes one at a time)
-progress_status = {
-    "detection": {"current": 0, "total": 1, "error": False, "message": "Idle"},
-    "characterization": {"current": 0, "total": 0, "error": False, "message": "Idle"},
-    "processing_active": False,
-}
-progress_lock = threading.Lock()  # To safely update progress from threads
-characterization_queue = queue.Queue()
+# --- Job State ---
+# Progress, the selected video and the queue order are shared by every app
+# process (see job_state.py). The queue and the worker threads below belong
+# to the process that runs the current job; other processes reach them by
+# sending commands (see job_watcher).
+# Prioritizes the fish of the video shown in the results view
+# The queue reads the selected video under its lock, so it gets the in-memory
+# copy, which set_selected_video() and the job watcher keep current
+characterization_queue = CharacterizationQueue(
+    selected_video=lambda: cached_selected_video()
+)
 llm_worker_stop_event = threading.Event()
-current_video = None  # Track currently selected video
+current_job_metrics = None  # Metrics token of the running job (see metrics.begin_job)
+upload_jobs = {}  # upload_id -> Event set when a chunk arrives, while detection runs early
+upload_jobs_lock = threading.Lock()
+job_watcher_thread = None
+job_watcher_lock = threading.Lock()
+upload_streamable = {}  # upload_id -> result of is_streamable() once it is known
+cancelled_fish_ids = set()  # Deleted fish the LLM worker should skip if still queued
+cancelled_fish_lock = threading.Lock()
+reprocess_threads = {}  # Reprocessing job ID -> thread running it in this process
+reprocess_threads_lock = threading.Lock()
+
+metrics.register_gauge(
+    "fish_characterization_queue_depth",
+    characterization_queue.qsize,
+    help_text="Fish waiting for characterization",
+)
+metrics.register_gauge(
+    "fish_processing_active",
+    lambda: int(is_busy()),
+    help_text="1 while a job is detecting or characterizing fish",
+)
 
 
 # --- Background Worker for LLM ---
@@ -53,16 +172,38 @@ def llm_worker():
             fish_id = task["id"]
             image_filename = task["filename"]
 
+            with cancelled_fish_lock:
+                cancelled = fish_id in cancelled_fish_ids
+                cancelled_fish_ids.discard(fish_id)
+            if cancelled:
+                print(f"LLM Worker skipping deleted fish ID: {fish_id}")
+                with edit_own_progress() as progress_status:
+                    characterization = progress_status["characterization"]
+                    characterization["total"] = max(
+                        characterization["total"] - 1, total_characterized
+                    )
+                characterization_queue.task_done()
+                continue
+
             print(f"LLM Worker processing task for fish ID: {fish_id}")
             get_fish_taxonomy(
                 fish_id, image_filename
             )  # This function handles DB updates and rate limits
 
             total_characterized += 1
-            with progress_lock:
+            with edit_own_progress() as progress_status:
                 # Update characterization progress *after* successful processing
                 # Note: 'total' might still be increasing if detection is ongoing
                 progress_status["characterization"]["current"] = total_characterized
+                if (
+                    "rate" in progress_status["detection"]
+                    or "uploaded" in progress_status["detection"]
+                ):
+                    # Live streams and videos that are still uploading keep
+                    # adding fish, so the total is a running count
+                    progress_status["characterization"]["total"] = max(
+                        progress_status["characterization"]["total"], total_characterized
+                    )
                 progress_status["characterization"]["message"] = (
                     f"Characterized {total_characterized}/{progress_status['characterization']['total']}..."
                 )
@@ -70,27 +211,36 @@ def llm_worker():
             characterization_queue.task_done()  # Signal task completion
 
         except queue.Empty:
-            # Queue is empty, check if processing is still active
-            with progress_lock:
-                if (
-                    not progress_status["processing_active"]
-                    and characterization_queue.empty()
-                ):
-                    print("LLM Worker: Queue empty and processing inactive. Exiting.")
-                    break  # Exit loop if main processing is done and queue is empty
+            # Queue is empty, check if processing is still active (in this process)
+            progress_status = get_progress()
+            if characterization_queue.empty() and not (
+                progress_status["processing_active"] and owns_job(progress_status)
+            ):
+                print("LLM Worker: Queue empty and processing inactive. Exiting.")
+                break  # Exit loop if main processing is done and queue is empty
             continue  # Go back to waiting if processing might still add items
         except Exception as e:
             print(f"Error in LLM worker: {e}")
             # Optionally mark the specific task as error in DB if possible
             characterization_queue.task_done()  # Still need to mark task done
 
+    # The job is over once the queue has drained; record its metrics summary
+    metrics.write_job_summary(
+        current_job_metrics, {"characterized": total_characterized}
+    )
     print("LLM Worker thread finished.")
 
 
+def warm_up_models():
+    """Loads the detection and LLM models ahead of the first upload."""
+    get_llm_model()
+    warm_up_detector()
+
+
 # --- Progress Update Callback ---
 def update_detection_progress(current_frame, total_frames, error_occurred):
     """Callback function for the detector thread to update progress."""
-    with progress_lock:
+    with edit_own_progress() as progress_status:
         progress_status["detection"]["current"] = current_frame
         progress_status["detection"]["total"] = total_frames
         progress_status["detection"]["error"] = error_occurred
@@ -119,6 +269,26 @@ def update_detection_progress(current_frame, total_frames, error_occurred):
             )
 
 
+def update_stream_progress(stats):
+    """Callback for live streams: progress is a rate, as there is no total."""
+    with edit_own_progress() as progress_status:
+        progress_status["detection"]["current"] = stats["frames_processed"]
+        progress_status["detection"]["total"] = 0
+        progress_status["detection"]["rate"] = stats
+        progress_status["detection"]["message"] = (
+            f"Live {stats['segment']}: {stats['frames_per_minute']} frames/min, "
+            f"{stats['fish_per_minute']} fish/min, {stats['frames_dropped']} frames dropped"
+        )
+        progress_status["characterization"]["total"] = (
+            progress_status["characterization"]["current"]
+            + characterization_queue.qsize()
+        )
+        progress_status["characterization"]["message"] = (
+            f"Characterized {progress_status['characterization']['current']}/"
+            f"{progress_status['characterization']['total']}..."
+        )
+
+
 # --- Flask Routes ---
 @app.route("/")
 def index():
@@ -128,13 +298,172 @@ def index():
     return render_template("index.html", videos=videos)
 
 
+def start_processing(filepath, resume=False, rederive_options=None):
+    """
+    Resets progress and starts the detection and LLM worker threads for a video.
+    With `rederive_options`, fish are rebuilt from cached detections instead.
+    Raises JobBusyError if another job is running.
+    """
+    global current_job_metrics
+    filename = os.path.basename(filepath)
+
+    if not reset_progress(filename):
+        raise JobBusyError("Processing already in progress.")
+    try:
+        # Show the video that is being processed
+        set_selected_video(filename)
+        current_job_metrics = metrics.begin_job(filename)
+
+        if resume:
+            # Fish detected before the interruption never made it through the
+            # in-memory queue, so queue them again
+            pending = get_pending_fish(filename)
+            for fish in pending:
+                characterization_queue.put(
+                    {
+                        "id": fish["id"],
+                        "filename": fish["image_filename"],
+                        "video": fish["video_filename"],
+                    }
+                )
+            print(f"Re-queued {len(pending)} pending fish from {filename}")
+
+        # Start detection in a background thread
+        detection_thread = threading.Thread(
+            target=run_detection_and_wait,
+            args=(filepath, resume, rederive_options),
+            name="detection",
+            daemon=True,
+        )
+        detection_thread.start()
+        ensure_llm_worker()
+    except Exception:
+        finish_job()  # Only the request that claimed the job releases it
+        raise
+
+
+def reset_progress(video_filename=None, upload_id=None):
+    """
+    Claims a new job for this process: resets the shared progress and marks
+    processing as active. Returns False if a job is running (in any process).
+    """
+    if not claim_job(video_filename, upload_id):
+        return False
+    llm_worker_stop_event.clear()  # Ensure stop event is clear for new run
+    ensure_job_watcher()
+    return True
+
+
+def stop_local_job():
+    """Stops the job threads of this process and drops its queued fish."""
+    llm_worker_stop_event.set()
+    characterization_queue.clear()
+    with upload_jobs_lock:
+        # Wake early detection so it notices the stop
+        for new_data in upload_jobs.values():
+            new_data.set()
+
+
+def job_watcher():
+    """
+    Runs in the process that owns a job: carries out the commands other
+    processes send (stop, bump, cancel, new upload data, profile), keeps the job's
+    heartbeat fresh, picks up the selected video the queue orders by and
+    publishes the queue order for GET /queue. After
+    detection the job stays claimed until the LLM worker has drained the
+    queue, so commands keep reaching this process meanwhile.
+    """
+    last_heartbeat = 0.0
+    published_empty = False
+    while True:
+        try:
+            for command, args in take_commands():
+                if command == "stop":
+                    stop_local_job()
+                elif command == "bump":
+                    characterization_queue.bump(
+                        args.get("fish_ids"), args.get("video_filename")
+                    )
+                elif command == "cancel":
+                    cancel_queued_fish(args["fish_ids"], forward=False)
+                elif command == "upload_data":
+                    with upload_jobs_lock:
+                        new_data = upload_jobs.get(args["upload_id"])
+                    if new_data:
+                        new_data.set()
+                elif command == "profile":
+                    try:
+                        capture_profile(**args)
+                    except (RuntimeError, ValueError) as e:
+                        print(f"Could not capture profile: {e}")
+
+            progress_status = get_progress()
+            if not owns_job(progress_status):
+                time.sleep(1)
+                continue
+            # Another process may have selected a video for the results view
+            get_selected_video()
+            now = time.time()
+            if (
+                progress_status.get("characterizing")
+                and not progress_status["processing_active"]
+                and not llm_worker_running()
+            ):
+                # The queue has drained; other processes may start a job now
+                finish_characterization()
+            elif (
+                progress_status["processing_active"] or progress_status.get("characterizing")
+            ) and now - last_heartbeat >= JOB_STALE_SECONDS / 4:
+                heartbeat()
+                last_heartbeat = now
+            if not characterization_queue.empty():
+                publish_queue(characterization_queue.snapshot())
+                published_empty = False
+            elif not published_empty:
+                publish_queue(characterization_queue.snapshot())
+                published_empty = True
+        except Exception as e:
+            print(f"Error in job watcher: {e}")
+        time.sleep(1)
+
+
+def ensure_job_watcher():
+    """Starts the job watcher thread of this process unless it is running."""
+    global job_watcher_thread
+    with job_watcher_lock:
+        if job_watcher_thread is None or not job_watcher_thread.is_alive():
+            job_watcher_thread = threading.Thread(target=job_watcher, daemon=True)
+            job_watcher_thread.start()
+
+
+def llm_worker_running():
+    """Whether the LLM worker thread of this process is characterizing fish."""
+    return "llm_worker_thread" in globals() and llm_worker_thread.is_alive()
+
+
+def ensure_llm_worker():
+    """Starts the LLM worker thread unless it is already running."""
+    global llm_worker_thread  # Make sure we can potentially manage the thread later
+    # Start LLM worker thread if not already running (or restart if needed)
+    # Simple check: if thread is dead or not initialized
+    if "llm_worker_thread" not in globals() or not llm_worker_thread.is_alive():
+        llm_worker_thread = threading.Thread(
+            target=llm_worker, name="llm-worker", daemon=True
+        )
+        llm_worker_thread.start()
+    else:
+        print("LLM worker thread already running.")
+
+
+def _is_truthy(value):
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
 @app.route("/upload", methods=["POST"])
 def upload_video():
     """Handles video upload, starts background processing."""
-    global llm_worker_thread, current_video  # Make sure we can potentially manage the thread later
-    with progress_lock:
-        if progress_status["processing_active"]:
-            return jsonify({"error": "Processing already in progress."}), 400
+    if is_busy():
+        return jsonify({"error": "Processing already in progress."}), 400
 
     if "videoFile" not in request.files:
         return jsonify({"error": "No video file part"}), 400
@@ -143,71 +472,540 @@ def upload_video():
     if file.filename == "":
         return jsonify({"error": "No selected file"}), 400
 
+    # resume=1 continues from the video's last detection checkpoint,
+    # force=1 reprocesses a video even if identical content was processed before
+    resume = _is_truthy(request.form.get("resume", "0"))
+    force = _is_truthy(request.form.get("force", "0"))
+
     if file:
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+        partial_path = filepath + ".part"
         try:
-            file.save(filepath)
-            print(f"Video saved to {filepath}")
-
-            # Set as current video
-            current_video = filename
-
-            # Reset progress and start processing
-            with progress_lock:
-                progress_status["detection"] = {
-                    "current": 0,
-                    "total": 1,
-                    "error": False,
-                    "message": "Initializing...",
-                }
-                progress_status["characterization"] = {
-                    "current": 0,
-                    "total": 0,
-                    "error": False,
-                    "message": "Waiting for detection...",
-                }
-                progress_status["processing_active"] = True
-                llm_worker_stop_event.clear()  # Ensure stop event is clear for new run
-
-            # Start detection in a background thread
-            detection_thread = threading.Thread(
-                target=run_detection_and_wait, args=(filepath,), daemon=True
+            # Fingerprint the video while it streams to disk
+            fingerprint, size_bytes = save_stream_with_fingerprint(
+                file.stream, partial_path
             )
-            detection_thread.start()
+            duplicate_of = finalize_upload(
+                filename, partial_path, fingerprint, size_bytes, not (resume or force)
+            )
+            if duplicate_of:
+                set_selected_video(duplicate_of)
+                return jsonify(
+                    {
+                        "message": f"This video was already processed as {duplicate_of}.",
+                        "duplicate_of": duplicate_of,
+                        "video_filename": duplicate_of,
+                    }
+                )
 
-            # Start LLM worker thread if not already running (or restart if needed)
-            # Simple check: if thread is dead or not initialized
-            if "llm_worker_thread" not in globals() or not llm_worker_thread.is_alive():
-                llm_worker_thread = threading.Thread(target=llm_worker, daemon=True)
-                llm_worker_thread.start()
-            else:
-                print("LLM worker thread already running.")
+            start_processing(filepath, resume)
 
             return jsonify({"message": "Upload successful, processing started."})
 
+        except JobBusyError as e:
+            # Another request claimed the job first; it is not ours to finish
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             print(f"Error during file save or processing start: {e}")
-            with progress_lock:
-                progress_status["processing_active"] = (
-                    False  # Ensure processing stops on error
-                )
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
             return jsonify({"error": f"Failed to process video: {e}"}), 500
 
     return jsonify({"error": "Invalid file."}), 400
 
 
-def run_detection_and_wait(filepath):
-    """Wrapper function to run detection and then signal completion."""
+def finalize_upload(filename, received_path, fingerprint, size_bytes, check_duplicates):
+    """
+    Moves a fully received video into the upload folder and registers it.
+
+    Args:
+        filename: Final (secure) filename of the video
+        received_path: Where the upload was received
+        fingerprint: Content fingerprint of the file
+        size_bytes: Size of the file
+        check_duplicates: Look for identical content that was processed before
+
+    Returns:
+        The filename of the earlier video if the content is a duplicate (the
+        received file is removed and the name linked to it), otherwise None
+    """
+    signature = frame_signature(received_path) if VIDEO_FRAME_SIGNATURE else None
+    duplicate_of = None
+    if check_duplicates:
+        duplicate_of = find_duplicate_video(fingerprint, signature)
+    if duplicate_of:
+        os.remove(received_path)
+        if duplicate_of != filename:
+            link_video_alias(filename, duplicate_of)
+        print(f"Upload {filename} is a duplicate of {duplicate_of}; skipping processing.")
+        return duplicate_of
+
+    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    os.replace(received_path, filepath)
+    register_video(filename, fingerprint, size_bytes, signature)
+    print(f"Video saved to {filepath}")
+    return None
+
+
+def complete_chunked_upload(upload):
+    """
+    Finalizes a chunked upload whose data has fully arrived. Results of early
+    detection are filed under the final fingerprint, or dropped if the video
+    turns out to be a duplicate. Returns the duplicate's original or None.
+    """
+    filename = upload["video_filename"]
+    options = upload["options"]
+    path = partial_upload_path(app.config["UPLOAD_FOLDER"], upload)
+    fingerprint, size_bytes = fingerprint_file(path)
+    duplicate_of = finalize_upload(
+        filename,
+        path,
+        fingerprint,
+        size_bytes,
+        not (options.get("resume") or options.get("force")),
+    )
+    discard_partial_upload(app.config["UPLOAD_FOLDER"], upload)
+    upload_streamable.pop(upload["upload_id"], None)
+
+    if upload["status"] == "detecting":
+        if duplicate_of and duplicate_of != filename:
+            discard_early_detection(filename)
+        elif not duplicate_of and DETECTION_CACHE_ENABLED:
+            adopt_partial_cache(filename, fingerprint, model_id_for(MODEL_PATH))
+    set_upload_status(upload["upload_id"], "complete")
+    return duplicate_of
+
+
+def discard_early_detection(filename):
+    """Removes the fish, checkpoint and cache that early detection produced."""
+    removed = delete_video_fish(filename)
+    for image_filename in removed:
+        delete_crop(image_filename)
+    delete_detection_checkpoint(filename)
+    if DETECTION_CACHE_ENABLED:
+        discard_partial_cache(filename, model_id_for(MODEL_PATH))
+    print(f"Discarded {len(removed)} fish detected early in {filename}.")
+
+
+@app.route("/uploads", methods=["POST"])
+def create_chunked_upload():
+    """
+    Starts a chunked upload (or returns the unfinished upload of the same file
+    so the client can continue it from the returned offset).
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get("filename", "")))
+    if not filename:
+        return jsonify({"error": "No filename given."}), 400
+    try:
+        size_bytes = int(data.get("size"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid file size."}), 400
+    if size_bytes <= 0:
+        return jsonify({"error": "The file is empty."}), 400
+
+    # The upload whose early detection is the running job may continue
+    unfinished = find_unfinished_upload(filename, size_bytes)
+    progress_status = get_progress()
+    continuing = (
+        unfinished is not None
+        and progress_status.get("upload_id") == unfinished["upload_id"]
+    )
+    if is_busy(progress_status) and not continuing:
+        return jsonify({"error": "Processing already in progress."}), 400
+
+    # Same options as /upload
+    options = {
+        "resume": _is_truthy(data.get("resume", "0")),
+        "force": _is_truthy(data.get("force", "0")),
+    }
+    upload = start_upload(app.config["UPLOAD_FOLDER"], filename, size_bytes, options)
+    return jsonify(
+        {
+            "upload_id": upload["upload_id"],
+            "offset": received_bytes(
+                partial_upload_path(app.config["UPLOAD_FOLDER"], upload)
+            ),
+            "chunk_size": UPLOAD_CHUNK_SIZE,
+        }
+    )
+
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def get_chunked_upload(upload_id):
+    """Returns how much of an upload has arrived, e.g. to resume after an error."""
+    upload = get_upload(upload_id)
+    if not upload:
+        return jsonify({"error": "Upload not found."}), 404
+    if upload["status"] == "complete":
+        offset = upload["size_bytes"]
+    else:
+        offset = received_bytes(partial_upload_path(app.config["UPLOAD_FOLDER"], upload))
+    return jsonify(
+        {
+            "upload_id": upload_id,
+            "video_filename": upload["video_filename"],
+            "size": upload["size_bytes"],
+            "offset": offset,
+            "status": upload["status"],
+        }
+    )
+
+
+@app.route("/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    """Appends the request body to an upload at ?offset=N."""
+    upload = get_upload(upload_id)
+    if not upload:
+        return jsonify({"error": "Upload not found."}), 404
+    if upload["status"] == "complete":
+        return jsonify({"error": "Upload already completed."}), 409
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        return jsonify({"error": "No offset given."}), 400
+
+    path = partial_upload_path(app.config["UPLOAD_FOLDER"], upload)
+    try:
+        received = append_chunk(upload, path, offset, request.stream)
+    except UploadOffsetError as e:
+        return jsonify({"error": str(e), "offset": e.expected_offset}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({"error": "Upload data not found, start the upload again."}), 404
+
+    response = {"upload_id": upload_id, "offset": received, "size": upload["size_bytes"]}
+    # The early detection thread finalizes the upload once all data is there
+    progress_status = get_progress()
+    new_data = (
+        is_busy(progress_status) and progress_status.get("upload_id") == upload_id
+    )
+    if new_data:
+        if owns_job(progress_status):
+            with upload_jobs_lock:
+                if upload_id in upload_jobs:
+                    upload_jobs[upload_id].set()
+        else:
+            send_command("upload_data", upload_id=upload_id)
+    if not new_data and received < upload["size_bytes"]:
+        new_data = start_early_detection(upload, path, received)
+    if new_data:
+        response["early_detection"] = True
+        if received == upload["size_bytes"]:
+            response["complete"] = True
+            response["message"] = "Upload complete, detection continues."
+        return jsonify(response)
+    if received < upload["size_bytes"]:
+        return jsonify(response)
+
+    response["complete"] = True
+    try:
+        duplicate_of = complete_chunked_upload(upload)
+    except Exception as e:
+        print(f"Error finalizing upload {upload_id}: {e}")
+        return jsonify({"error": f"Failed to process video: {e}"}), 500
+    if duplicate_of:
+        set_selected_video(duplicate_of)
+        response.update(
+            {
+                "message": f"This video was already processed as {duplicate_of}.",
+                "duplicate_of": duplicate_of,
+                "video_filename": duplicate_of,
+            }
+        )
+        return jsonify(response)
+
+    filepath = os.path.join(app.config["UPLOAD_FOLDER"], upload["video_filename"])
+    # Continue after early detection that was stopped or timed out
+    resume = upload["options"].get("resume") or upload["status"] == "detecting"
+    if is_busy():
+        response["message"] = "Upload complete. Processing is busy; resume this video later."
+        return jsonify(response)
+    try:
+        start_processing(filepath, resume)
+    except JobBusyError:
+        response["message"] = "Upload complete. Processing is busy; resume this video later."
+        return jsonify(response)
+    except Exception as e:
+        print(f"Error starting processing: {e}")
+        return jsonify({"error": f"Failed to process video: {e}"}), 500
+    response["message"] = "Upload successful, processing started."
+    return jsonify(response)
+
+
+def start_early_detection(upload, path, received):
+    """
+    Starts detecting on the received part of an upload if possible. Returns
+    True if detection was started.
+    """
+    global current_job_metrics
+    upload_id = upload["upload_id"]
+    if not EARLY_DETECTION or received < EARLY_DETECTION_MIN_BYTES:
+        return None
+    if upload_id not in upload_streamable:
+        streamable = is_streamable(path)
+        if streamable is None:
+            return None  # Not known yet, check again with the next chunk
+        upload_streamable[upload_id] = streamable
+    if not upload_streamable[upload_id]:
+        return None
+
+    # Never mix with an earlier processing of a video of the same name, apart
+    # from early detection of this upload that was stopped or timed out
+    checkpoint = get_detection_checkpoint(upload["video_filename"])
+    if checkpoint and (checkpoint["completed"] or upload["status"] != "detecting"):
+        return None
+
+    if not reset_progress(upload["video_filename"], upload_id):
+        return None
+    set_selected_video(upload["video_filename"])
+    current_job_metrics = metrics.begin_job(upload["video_filename"])
+    set_upload_status(upload_id, "detecting")
+    upload["status"] = "detecting"
+
+    new_data = threading.Event()
+    with upload_jobs_lock:
+        upload_jobs[upload_id] = new_data
+    threading.Thread(
+        target=run_early_detection,
+        args=(upload, new_data, checkpoint is not None),
+        name="detection-upload",
+        daemon=True,
+    ).start()
+    ensure_llm_worker()
+    print(f"Started detection on the first {received} bytes of {upload['video_filename']}.")
+    return True
+
+
+def run_early_detection(upload, new_data, resume):
+    """
+    Detects on an upload while it is arriving: one pass over the received data
+    every EARLY_DETECTION_STEP_BYTES, each continuing from the checkpoint of
+    the previous one. Once all data is there, the upload is finalized and a
+    last pass covers the rest of the video.
+    """
+    upload_id = upload["upload_id"]
+    filename = upload["video_filename"]
+    path = partial_upload_path(app.config["UPLOAD_FOLDER"], upload)
+
+    def progress(current_frame, total_frames, error_occurred):
+        update_detection_progress(current_frame, total_frames, error_occurred)
+        with edit_own_progress() as progress_status:
+            uploaded = progress_status["detection"]["uploaded"]
+            if uploaded < 1 and not error_occurred:
+                progress_status["detection"]["message"] = (
+                    f"Detecting while uploading ({uploaded:.0%} received)... frame {current_frame}"
+                )
+            progress_status["characterization"]["total"] = (
+                progress_status["characterization"]["current"]
+                + characterization_queue.qsize()
+            )
+
+    detected_bytes = 0
+    try:
+        while True:
+            received = received_bytes(path)
+            with edit_own_progress() as progress_status:
+                progress_status["detection"]["uploaded"] = received / upload["size_bytes"]
+            if received >= upload["size_bytes"]:
+                break
+            if not detected_bytes or received - detected_bytes >= EARLY_DETECTION_STEP_BYTES:
+                detected_bytes = received
+                detect_and_extract_fish(
+                    path,
+                    characterization_queue,
+                    progress,
+                    llm_worker_stop_event,
+                    resume=resume,
+                    growing=True,
+                )
+                resume = True
+                continue
+            if llm_worker_stop_event.is_set() or not new_data.wait(
+                EARLY_DETECTION_IDLE_SECONDS
+            ):
+                with upload_jobs_lock:
+                    if received_bytes(path) < upload["size_bytes"]:
+                        # Completing the upload later resumes from the checkpoint
+                        upload_jobs.pop(upload_id, None)
+                        print(f"Paused early detection of {filename}.")
+                        return
+                continue
+            new_data.clear()
+
+        duplicate_of = complete_chunked_upload(upload)
+        if duplicate_of:
+            set_selected_video(duplicate_of)
+            with edit_own_progress() as progress_status:
+                progress_status["detection"]["message"] = (
+                    f"This video was already processed as {duplicate_of}."
+                )
+        elif not llm_worker_stop_event.is_set():
+            detect_and_extract_fish(
+                os.path.join(app.config["UPLOAD_FOLDER"], filename),
+                characterization_queue,
+                progress,
+                llm_worker_stop_event,
+                resume=True,
+            )
+    except Exception as e:
+        print(f"Error in early detection thread: {e}")
+        with edit_own_progress() as progress_status:
+            progress_status["detection"]["error"] = True
+            progress_status["detection"]["message"] = "Error during detection."
+    finally:
+        with upload_jobs_lock:
+            upload_jobs.pop(upload_id, None)
+        finish_job()
+        print("Early detection thread finished.")
+
+
+@app.route("/resume-processing", methods=["POST"])
+def resume_processing():
+    """Resumes detection of a previously uploaded video from its last checkpoint."""
+    if is_busy():
+        return jsonify({"error": "Processing already in progress."}), 400
+
+    video_filename = request.json.get("video_filename")
+    if not video_filename:
+        return jsonify({"error": "No video filename provided"}), 400
+
+    filepath = os.path.join(
+        app.config["UPLOAD_FOLDER"], secure_filename(video_filename)
+    )
+    if not os.path.exists(filepath):
+        return jsonify({"error": "Uploaded video not found, upload it again"}), 404
+
+    try:
+        start_processing(filepath, resume=True)
+        checkpoint = get_detection_checkpoint(os.path.basename(filepath))
+        return jsonify(
+            {
+                "message": "Processing resumed.",
+                "checkpoint": checkpoint,
+            }
+        )
+    except JobBusyError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error resuming processing: {e}")
+        return jsonify({"error": f"Failed to resume processing: {e}"}), 500
+
+
+@app.route("/rederive", methods=["POST"])
+def rederive():
+    """Rebuilds a video's fish from its cached raw detections with new parameters."""
+    if is_busy():
+        return jsonify({"error": "Processing already in progress."}), 400
+
+    video_filename = request.json.get("video_filename")
+    if not video_filename:
+        return jsonify({"error": "No video filename provided"}), 400
+
+    filepath = os.path.join(
+        app.config["UPLOAD_FOLDER"], secure_filename(resolve_video_alias(video_filename))
+    )
+    if not os.path.exists(filepath):
+        return jsonify({"error": "Uploaded video not found, upload it again"}), 404
+
+    try:
+        options = {}
+        if request.json.get("confidence_threshold") is not None:
+            options["confidence_threshold"] = float(request.json["confidence_threshold"])
+        if request.json.get("hash_size") is not None:
+            options["hash_size"] = int(request.json["hash_size"])
+        if request.json.get("similarity_threshold") is not None:
+            options["similarity_threshold"] = int(request.json["similarity_threshold"])
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+
+    try:
+        start_processing(filepath, rederive_options=options)
+        return jsonify({"message": "Re-derivation started.", "options": options})
+    except JobBusyError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error starting re-derivation: {e}")
+        return jsonify({"error": f"Failed to start re-derivation: {e}"}), 500
+
+
+@app.route("/start-stream", methods=["POST"])
+def start_stream():
+    """Starts detecting fish in a live stream (URL, camera index or looped file)."""
+    global current_job_metrics
+    if is_busy():
+        return jsonify({"error": "Processing already in progress."}), 400
+
+    data = request.get_json(silent=True) or {}
+    source = str(data.get("source", "")).strip()
+    if not source:
+        return jsonify({"error": "No stream source given."}), 400
+    name = data.get("name") or stream_name_for(source)
+
     try:
-        detect_and_extract_fish(
-            filepath,
+        segment_seconds = float(data.get("segment_seconds", STREAM_SEGMENT_SECONDS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid segment_seconds."}), 400
+
+    if not reset_progress():
+        return jsonify({"error": "Processing already in progress."}), 400
+    set_selected_video(None)  # Segments appear as videos once they have fish
+    current_job_metrics = metrics.begin_job(name)
+    threading.Thread(
+        target=run_stream_and_wait,
+        args=(source, name, _is_truthy(data.get("loop", "0")), segment_seconds),
+        name="detection-stream",
+        daemon=True,
+    ).start()
+    ensure_llm_worker()
+    return jsonify({"message": f"Streaming from {source} started.", "stream_name": name})
+
+
+def run_stream_and_wait(source, name, loop, segment_seconds):
+    """Runs live-stream detection until it is stopped or the stream ends."""
+    try:
+        detect_stream(
+            source,
             characterization_queue,
-            update_detection_progress,
+            update_stream_progress,
             llm_worker_stop_event,
+            name,
+            loop,
+            segment_seconds,
         )
+    except Exception as e:
+        print(f"Error in stream detection thread: {e}")
+        with edit_own_progress() as progress_status:
+            progress_status["detection"]["error"] = True
+            progress_status["detection"]["message"] = "Error during stream detection."
+    finally:
+        finish_job()
+        print("Stream detection thread finished.")
+
+
+def run_detection_and_wait(filepath, resume=False, rederive_options=None):
+    """Wrapper function to run detection and then signal completion."""
+    try:
+        if rederive_options is not None:
+            rederive_video(
+                filepath,
+                characterization_queue,
+                update_detection_progress,
+                llm_worker_stop_event,
+                **rederive_options,
+            )
+        else:
+            detect_and_extract_fish(
+                filepath,
+                characterization_queue,
+                update_detection_progress,
+                llm_worker_stop_event,
+                resume=resume,
+            )
     except Exception as e:
         print(f"Error in detection thread: {e}")
+        progress_status = get_progress()
         update_detection_progress(
             progress_status["detection"]["current"],
             progress_status["detection"]["total"],
@@ -215,8 +1013,7 @@ def run_detection_and_wait(filepath):
         )  # Signal error
     finally:
         # Signal that the main processing (detection) phase is no longer adding items
-        with progress_lock:
-            progress_status["processing_active"] = False
+        finish_job()
         print("Detection thread finished.")
         # The LLM worker will eventually stop itself when the queue is empty and processing_active is False
 
@@ -224,44 +1021,62 @@ def run_detection_and_wait(filepath):
 @app.route("/progress")
 def progress():
     """Endpoint for the frontend to poll for progress updates."""
-    with progress_lock:
-        # Check if LLM worker finished naturally
-        char_total = progress_status["characterization"]["total"]
-        char_current = progress_status["characterization"]["current"]
-        if (
-            not progress_status["processing_active"]
-            and characterization_queue.empty()
-            and char_total > 0
-            and char_current == char_total
-        ):
-            progress_status["characterization"]["message"] = (
-                f"Characterization complete ({char_current}/{char_total})."
-            )
+    # Any app process can answer: the progress is shared (see job_state.py)
+    progress_status = get_progress()
+    if owns_job(progress_status):
+        queue_empty = characterization_queue.empty()
+    else:
+        queue_empty = get_queue_snapshot()["size"] == 0
+    # Check if LLM worker finished naturally
+    char_total = progress_status["characterization"]["total"]
+    char_current = progress_status["characterization"]["current"]
+    if (
+        not progress_status["processing_active"]
+        and queue_empty
+        and char_total > 0
+        and char_current == char_total
+    ):
+        progress_status["characterization"]["message"] = (
+            f"Characterization complete ({char_current}/{char_total})."
+        )
+
+    return jsonify(progress_status)
 
-        return jsonify(progress_status)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Exposes pipeline timings and counters in Prometheus text format."""
+    response = make_response(metrics.render_prometheus())
+    response.headers["Content-type"] = "text/plain; version=0.0.4"
+    return response
+
+
+def add_frontend_fields(item):
+    """Adds the image URL and parsed JSON fields to a fish row for the frontend."""
+    # Add full URL for images
+    item["image_url"] = url_for(
+        "serve_fish_image",
+        filename=item["image_filename"],
+        _external=False,
+    )
+    # Parse timestamps string back to list for easier frontend handling
+    item["timestamps"] = json.loads(item["timestamps"])
+    # Parse taxonomy JSON string if it exists
+    if item["taxonomy_json"]:
+        item["taxonomy_data"] = json.loads(item["taxonomy_json"])
+    else:
+        item["taxonomy_data"] = None  # Or an empty dict {}
 
 
 @app.route("/results")
 def results():
     """Endpoint for the frontend to poll for the latest database results."""
-    video_filter = request.args.get("video")
+    video_filter = resolve_video_alias(request.args.get("video"))
 
     try:
         data = get_all_fish_data(video_filter)
-        # Add full URL for images
         for item in data:
-            item["image_url"] = url_for(
-                "serve_fish_image",
-                filename=item["image_filename"],
-                _external=False,
-            )
-            # Parse timestamps string back to list for easier frontend handling
-            item["timestamps"] = json.loads(item["timestamps"])
-            # Parse taxonomy JSON string if it exists
-            if item["taxonomy_json"]:
-                item["taxonomy_data"] = json.loads(item["taxonomy_json"])
-            else:
-                item["taxonomy_data"] = None  # Or an empty dict {}
+            add_frontend_fields(item)
 
         return jsonify(data)
     except Exception as e:
@@ -280,17 +1095,216 @@ def get_videos():
         return jsonify({"error": "Could not fetch video list"}), 500
 
 
+@app.route("/videos/<path:video_filename>")
+def video_summary(video_filename):
+    """Fish counts by status, video metadata and processing timings of one video."""
+    try:
+        summary = get_video_summary(resolve_video_alias(video_filename))
+    except Exception as e:
+        print(f"Error fetching summary of {video_filename}: {e}")
+        return jsonify({"error": "Could not fetch video summary"}), 500
+    if not summary:
+        return jsonify({"error": "Video not found"}), 404
+    return jsonify(summary)
+
+
+@app.route("/taxonomy")
+def taxonomy_counts():
+    """
+    Fish per taxon of a rank (?rank=Species by default), overall or per video
+    (?video_filename=... for one video, ?by_video=1 for every video).
+    """
+    taxon_rank = request.args.get("rank", "Species").capitalize()
+    if taxon_rank not in TAXONOMY_RANKS:
+        return jsonify({"error": f"Unknown rank, use one of {', '.join(TAXONOMY_RANKS)}"}), 400
+    video_filename = request.args.get("video_filename")
+    if video_filename:
+        video_filename = resolve_video_alias(video_filename)
+    try:
+        counts = get_taxonomy_counts(
+            taxon_rank, video_filename, _is_truthy(request.args.get("by_video", "0"))
+        )
+    except Exception as e:
+        print(f"Error fetching taxonomy counts: {e}")
+        return jsonify({"error": "Could not fetch taxonomy counts"}), 500
+    return jsonify({"rank": taxon_rank, "counts": counts})
+
+
+@app.route("/search")
+def search():
+    """
+    Characterized fish matching a taxonomy search, newest first:
+
+    - ?q=amphi ocel: every word starts a word of some rank
+    - ?Family=Labridae (any rank, case-insensitive): exact matches
+    - ?video_filename=...: only fish of this video
+    - ?facets=Genus,Species: fish counts per taxon of these ranks
+    - ?limit=50 (at most 500) and ?before_id=<next_before_id of the previous page>
+    """
+    taxa = {}
+    for rank in TAXONOMY_RANKS:
+        taxon = request.args.get(rank) or request.args.get(rank.lower())
+        if taxon:
+            taxa[rank] = taxon
+    facets = [
+        rank.strip().capitalize()
+        for rank in request.args.get("facets", "").split(",")
+        if rank.strip()
+    ]
+    video_filename = request.args.get("video_filename")
+    if video_filename:
+        video_filename = resolve_video_alias(video_filename)
+    limit = min(max(1, request.args.get("limit", default=50, type=int)), 500)
+    try:
+        result = search_fish(
+            request.args.get("q"),
+            taxa,
+            video_filename,
+            facets,
+            limit,
+            request.args.get("before_id", type=int),
+        )
+    except ValueError as e:
+        return jsonify({"error": f"{e}, use one of {', '.join(TAXONOMY_RANKS)}"}), 400
+    except Exception as e:
+        print(f"Error searching fish: {e}")
+        return jsonify({"error": "Could not search fish"}), 500
+    for item in result["fish"]:
+        add_frontend_fields(item)
+    return jsonify(result)
+
+
+@app.route("/identities")
+def identities():
+    """Global fish identities (see identity_index.py) with their sighting counts."""
+    try:
+        return jsonify(get_identities())
+    except Exception as e:
+        print(f"Error fetching identities: {e}")
+        return jsonify({"error": "Could not fetch identities"}), 500
+
+
+@app.route("/identities/<int:identity_id>")
+def identity_sightings(identity_id):
+    """The per-video sightings of a global fish identity."""
+    try:
+        return jsonify(get_identity_sightings(identity_id))
+    except Exception as e:
+        print(f"Error fetching sightings of identity {identity_id}: {e}")
+        return jsonify({"error": "Could not fetch sightings"}), 500
+
+
+# --- Reprocessing Jobs ---
+def busy_video():
+    """The video of the running job, if any; recluster jobs leave it alone."""
+    progress_status = get_progress()
+    return progress_status.get("video") if is_busy(progress_status) else None
+
+
+def start_reprocess_thread(job_id):
+    """Runs a reprocessing job (see reprocess.py) in a background thread of this process."""
+
+    def run():
+        try:
+            run_reprocess_job(
+                job_id, skip_video=busy_video, on_merged=cancel_queued_fish
+            )
+        except RuntimeError as e:
+            print(e)
+        finally:
+            with reprocess_threads_lock:
+                reprocess_threads.pop(job_id, None)
+
+    with reprocess_threads_lock:
+        if job_id in reprocess_threads:
+            return
+        thread = threading.Thread(target=run, name=f"reprocess-{job_id}", daemon=True)
+        reprocess_threads[job_id] = thread
+    thread.start()
+
+
+@app.route("/reprocess", methods=["POST"])
+def create_reprocess():
+    """
+    Starts a job that re-characterizes ("kind": "characterize") or re-clusters
+    ("kind": "recluster") fish that were already detected. The JSON body
+    selects them by "video_filename", "statuses", "taxon" ({rank: taxon})
+    and/or "min_unknown_ranks"; recluster jobs also take "hash_threshold"
+    and "dry_run".
+    """
+    data = request.get_json(silent=True) or {}
+    video_filename = data.get("video_filename") or None
+    statuses = data.get("statuses")
+    if isinstance(statuses, str):
+        statuses = [statuses]
+    if video_filename is not None:
+        video_filename = resolve_video_alias(video_filename)
+    if data.get("kind") == "recluster" and video_filename and video_filename == busy_video():
+        return jsonify({"error": f"{video_filename} is still being processed"}), 409
+
+    try:
+        job_id = create_reprocess_job(
+            data.get("kind"),
+            video_filename=video_filename,
+            statuses=statuses,
+            taxon=data.get("taxon"),
+            min_unknown_ranks=data.get("min_unknown_ranks"),
+            hash_threshold=data.get("hash_threshold"),
+            dry_run=_is_truthy(data.get("dry_run", False)),
+        )
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"error": f"Invalid reprocess job: {e}"}), 400
+    start_reprocess_thread(job_id)
+    return jsonify({"success": True, "job": get_reprocess_job(job_id)})
+
+
+@app.route("/reprocess")
+def list_reprocess():
+    """The most recent reprocessing jobs with their progress."""
+    return jsonify(get_reprocess_jobs())
+
+
+@app.route("/reprocess/<int:job_id>")
+def get_reprocess(job_id):
+    job = get_reprocess_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/reprocess/<int:job_id>/pause", methods=["POST"])
+def pause_reprocess(job_id):
+    """Pauses a job; the process running it stops after the fish in flight."""
+    if not pause_job(job_id):
+        return jsonify({"error": "Job is not queued or running"}), 409
+    return jsonify({"success": True, "job": get_reprocess_job(job_id)})
+
+
+@app.route("/reprocess/<int:job_id>/resume", methods=["POST"])
+def resume_reprocess(job_id):
+    """Continues a paused (or interrupted) job from its checkpoint in this process."""
+    job = get_reprocess_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "finished":
+        return jsonify({"error": "Job is already finished"}), 409
+    if job["status"] == "running" and time.time() - (job["heartbeat"] or 0) < JOB_STALE_SECONDS:
+        return jsonify({"error": "Job is already running"}), 409
+    start_reprocess_thread(job_id)
+    return jsonify({"success": True, "job": get_reprocess_job(job_id)})
+
+
 @app.route("/select-video", methods=["POST"])
 def select_video():
     """Select a video to display in the results table."""
-    global current_video
     video_filename = request.json.get("video_filename")
 
     if not video_filename:
         return jsonify({"error": "No video filename provided"}), 400
 
-    current_video = video_filename
-    return jsonify({"success": True, "selected_video": video_filename})
+    selected_video = resolve_video_alias(video_filename)
+    set_selected_video(selected_video)
+    return jsonify({"success": True, "selected_video": selected_video})
 
 
 # Serve static files (like the cropped fish images)
@@ -303,6 +1317,11 @@ def serve_fish_image(filename):
     basename = os.path.basename(filename)
 
     try:
+        # Crops stored in a per-video pack file are served straight from the mmap
+        packed_bytes = read_packed_crop(filename)
+        if packed_bytes is not None:
+            return Response(packed_bytes, mimetype="image/png")
+
         if directory:
             # Check if the path exists in the video-specific directory
             full_path = os.path.join(IMAGE_DIR, directory, basename)
@@ -325,7 +1344,7 @@ def serve_fish_image(filename):
 @app.route("/download-csv")
 def download_csv():
     """Endpoint to download all fish detection data as a CSV file."""
-    video_filter = request.args.get("video")
+    video_filter = resolve_video_alias(request.args.get("video"))
 
     try:
         # Get data filtered by video if specified
@@ -404,15 +1423,11 @@ def delete_entry(fish_id):
 
         if not image_filename:
             return jsonify({"error": "Entry not found"}), 404
+        cancel_queued_fish([fish_id])
 
-        # Delete the image file
+        # Delete the image file (or flag it in its pack file)
         try:
-            image_path = os.path.join(IMAGE_DIR, image_filename)
-            if os.path.exists(image_path):
-                os.remove(image_path)
-                print(f"Deleted image file: {image_path}")
-            else:
-                print(f"Image file not found: {image_path}")
+            delete_crop(image_filename)
         except Exception as e:
             print(f"Error deleting image file: {e}")
             # Continue with success response even if file deletion fails
@@ -426,30 +1441,146 @@ def delete_entry(fish_id):
         return jsonify({"error": f"Failed to delete entry: {e}"}), 500
 
 
+def cancel_queued_fish(fish_ids, forward=True):
+    """
+    Makes the LLM worker skip deleted fish that are still queued. Unless
+    `forward` is False, the process running the job is told as well.
+    """
+    if forward and not owns_job():
+        send_command("cancel", fish_ids=list(fish_ids))
+        return
+    with characterization_queue.mutex:
+        queued_ids = {task["id"] for task in characterization_queue.queue}
+    with cancelled_fish_lock:
+        cancelled_fish_ids.update(queued_ids.intersection(fish_ids))
+
+
+@app.route("/delete-entries", methods=["POST"])
+def delete_entries():
+    """
+    Deletes many fish entries in one transaction. The JSON body selects them
+    by "video_filename", "statuses" and/or "ids" (all given filters must
+    match). With "purge": true and only a video_filename, the video's crop
+    directory (or pack file) and detection checkpoint are removed as well.
+    Crop files are removed in the background.
+    """
+    data = request.get_json(silent=True) or {}
+    video_filename = data.get("video_filename") or None
+    statuses = data.get("statuses")
+    fish_ids = data.get("ids")
+    purge = _is_truthy(data.get("purge"))
+
+    if isinstance(statuses, str):
+        statuses = [statuses]
+    if video_filename is None and not statuses and fish_ids is None:
+        return jsonify(
+            {"error": "Give a video_filename, statuses or ids to delete"}
+        ), 400
+    if fish_ids is not None and (
+        not isinstance(fish_ids, list)
+        or not all(isinstance(fish_id, int) for fish_id in fish_ids)
+    ):
+        return jsonify({"error": "ids must be a list of integers"}), 400
+    if purge and (video_filename is None or statuses or fish_ids is not None):
+        return jsonify({"error": "purge only works with a video_filename alone"}), 400
+
+    if video_filename is not None:
+        video_filename = resolve_video_alias(video_filename)
+    if purge:
+        progress_status = get_progress()
+        if is_busy(progress_status) and progress_status.get("video") == video_filename:
+            return jsonify(
+                {"error": f"{video_filename} is still being processed"}
+            ), 409
+
+    try:
+        video_dirname = None
+        if purge:
+            video_dirname = get_video_dirname(video_filename)
+            if any(
+                other != video_filename and get_video_dirname(other) == video_dirname
+                for other in get_processed_videos()
+            ):
+                # Another video shares the crop directory; remove files one by one
+                print(f"Crop directory {video_dirname} is shared, not purging it.")
+                video_dirname = None
+        deleted_ids, image_filenames = delete_fish_bulk(
+            video_filename=video_filename,
+            statuses=statuses,
+            fish_ids=fish_ids,
+            purge_pack_filename=pack_filename_for(video_dirname)
+            if video_dirname
+            else None,
+        )
+        cancel_queued_fish(deleted_ids)
+        if purge:
+            delete_detection_checkpoint(video_filename)
+        delete_crops_async(image_filenames, purge_video_dirname=video_dirname)
+    except Exception as e:
+        print(f"Error deleting entries: {e}")
+        return jsonify({"error": f"Failed to delete entries: {e}"}), 500
+
+    print(f"Deleted {len(deleted_ids)} fish entries in bulk.")
+    return jsonify({"success": True, "deleted": len(deleted_ids), "purged": purge})
+
+
+@app.route("/queue")
+def get_queue():
+    """The characterization queue in the order it will be processed, with waiting times."""
+    limit = max(0, request.args.get("limit", default=100, type=int))
+    if owns_job():
+        return jsonify(characterization_queue.snapshot(limit))
+    # Published by the process running the job, at most a second old
+    snapshot = get_queue_snapshot()
+    snapshot["tasks"] = snapshot["tasks"][:limit]
+    return jsonify(snapshot)
+
+
+@app.route("/queue/bump", methods=["POST"])
+def bump_queue():
+    """Moves the queued fish given by "ids" and/or "video_filename" to the front."""
+    data = request.get_json(silent=True) or {}
+    fish_ids = data.get("ids") or []
+    video_filename = data.get("video_filename") or None
+    if not fish_ids and video_filename is None:
+        return jsonify({"error": "Give ids or a video_filename to bump"}), 400
+    if not isinstance(fish_ids, list) or not all(
+        isinstance(fish_id, int) for fish_id in fish_ids
+    ):
+        return jsonify({"error": "ids must be a list of integers"}), 400
+    if video_filename is not None:
+        video_filename = resolve_video_alias(video_filename)
+
+    if owns_job():
+        bumped = characterization_queue.bump(fish_ids, video_filename)
+        return jsonify({"success": True, "bumped": bumped})
+    # Another process runs the job; it applies the bump within a second
+    forwarded = send_command("bump", fish_ids=fish_ids, video_filename=video_filename)
+    return jsonify({"success": True, "forwarded": forwarded})
+
+
 @app.route("/stop-processing", methods=["POST"])
 def stop_processing():
     """Endpoint to stop ongoing processing."""
-    global llm_worker_thread
-
     try:
-        with progress_lock:
-            # Set the stop event to signal worker thread to exit
-            llm_worker_stop_event.set()
-
+        with edit_progress() as progress_status:
             # Update status flags
             progress_status["processing_active"] = False
+            # Busy until the owner's LLM worker has stopped (see job_watcher)
+            progress_status["characterizing"] = bool(progress_status.get("owner"))
+            progress_status["upload_id"] = None
             progress_status["detection"]["message"] = "Processing stopped by user."
             progress_status["characterization"]["message"] = (
                 "Processing stopped by user."
             )
+            owner = progress_status.get("owner")
 
-            # Optionally clear the queue to prevent further processing
-            while not characterization_queue.empty():
-                try:
-                    characterization_queue.get_nowait()
-                    characterization_queue.task_done()
-                except queue.Empty:
-                    break
+        # Signal the worker threads to exit and clear the queue, in whichever
+        # process runs the job
+        if owner == PROCESS_ID:
+            stop_local_job()
+        elif owner:
+            send_command("stop")
 
         # Wait a short time for thread cleanup
         time.sleep(0.5)
@@ -461,9 +1592,78 @@ def stop_processing():
         return jsonify({"success": False, "error": "Failed to stop processing"}), 500
 
 
+# --- Profiling ---
+@app.route("/profile", methods=["POST"])
+def start_profile():
+    """
+    Samples the detection and LLM worker threads of the running job for
+    "seconds" (default 30) and saves the profile, in "format" "collapsed"
+    (default) or "speedscope", for download from /profiles/<filename>.
+    Needs PROFILING_ENABLED=1.
+    """
+    if not PROFILING_ENABLED:
+        return jsonify({"error": "Profiling is disabled (set PROFILING_ENABLED=1)."}), 403
+    data = request.get_json(silent=True) or {}
+    fmt = data.get("format", "collapsed")
+    if fmt not in PROFILE_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(PROFILE_FORMATS)}"}), 400
+    try:
+        seconds = float(data.get("seconds", 30))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid seconds."}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}), 400
+    progress_status = get_progress()
+    # Characterization goes on after detection has finished
+    if not is_busy(progress_status) and not live_fish_waiting():
+        return jsonify({"error": "No job is running."}), 409
+
+    job_name = progress_status.get("video") or "stream"
+    args = {
+        "job_name": job_name,
+        "seconds": seconds,
+        "fmt": fmt,
+        "filename": profile_filename(job_name, fmt),
+    }
+    if owns_job(progress_status):
+        try:
+            capture_profile(**args)
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 409
+        forwarded = False
+    else:
+        # The process running the job captures it (see job_watcher)
+        send_command("profile", **args)
+        forwarded = True
+    return jsonify(
+        {
+            "success": True,
+            "filename": args["filename"],
+            "download_url": url_for("download_profile", filename=args["filename"]),
+            "ready_in_seconds": seconds,
+            "forwarded": forwarded,
+        }
+    )
+
+
+@app.route("/profiles")
+def profiles():
+    """The captured profiles, newest first."""
+    return jsonify(list_profiles())
+
+
+@app.route("/profiles/<path:filename>")
+def download_profile(filename):
+    """Downloads a captured profile."""
+    return send_from_directory(PROFILE_DIR, filename, as_attachment=True)
+
+
 # --- Main Execution ---
 if __name__ == "__main__":
     init_db()  # Ensure DB is initialized on startup
+    # Optionally load models in the background so the first upload doesn't wait for them
+    if os.getenv("WARMUP_MODELS", "0") == "1":
+        threading.Thread(target=warm_up_models, daemon=True).start()
     # Start LLM worker thread on app start (can be debated, alternative is starting on first upload)
     # llm_worker_thread = threading.Thread(target=llm_worker, daemon=True)
     # llm_worker_thread.start()
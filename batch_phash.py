@@ -0,0 +1,226 @@
+"""
+Batch perceptual hashing of fish crops.
+
+imagehash.phash() converts each crop to PIL, converts it to grayscale, resizes
+it with Lanczos, runs a 2D DCT and compares the low frequencies with their
+median, one image at a time. phash_batch() does the same for all crops of a
+frame at once:
+
+- the grayscale conversion applies Pillow's fixed-point RGB -> L formula
+  directly to the BGR arrays (no cvtColor / Image.fromarray round trip)
+- the resize replays Pillow's two-pass Lanczos resampling (including the
+  order Image.resize() picks for very tall images) with its 22-bit
+  fixed-point coefficients, as two matrix products per crop. Coefficient
+  matrices are cached per (input size, output size), and the products are
+  exact because every partial sum is an integer well below 2**53
+- the DCT, median and bit packing run once on the stacked (N, size, size) batch
+
+The result is identical to str(imagehash.phash(...)), so perceptual hashes
+already stored in the database stay valid. This is checked against imagehash
+the first time the module is used; if the installed Pillow/imagehash ever
+disagree, phash_batch() falls back to imagehash for every crop.
+"""
+
+import functools
+import math
+import threading
+
+import cv2
+import numpy as np
+import scipy.fftpack
+
+HIGHFREQ_FACTOR = 4  # Same as imagehash.phash: resize to hash_size * 4 before the DCT
+
+# Pillow's fixed-point resampling (libImaging/Resample.c)
+_PRECISION_BITS = 32 - 8 - 2
+_LANCZOS_SUPPORT = 3.0
+# Pillow's fixed-point RGB -> L weights in BGR order, plus the rounding offset
+_GRAY_WEIGHTS = np.array([[7471, 38470, 19595, 0x8000]], dtype=np.float32)
+
+_self_check_lock = threading.Lock()
+_matches_imagehash = None  # Set by the first call to _use_fast_path()
+
+
+def _sinc(x):
+    if x == 0.0:
+        return 1.0
+    x = x * math.pi
+    return math.sin(x) / x
+
+
+def _lanczos(x):
+    if -3.0 <= x < 3.0:
+        return _sinc(x) * _sinc(x / 3)
+    return 0.0
+
+
+@functools.lru_cache(maxsize=1024)
+def _resample_matrix(in_size, out_size):
+    """
+    Dense (out_size, in_size) matrix of Pillow's fixed-point Lanczos
+    coefficients, plus the first and last input index any output uses.
+
+    Mirrors precompute_coeffs() and normalize_coeffs_8bpc(); math.sin is used
+    rather than np.sin so the doubles match the C library exactly.
+    """
+    scale = filterscale = in_size / out_size
+    if filterscale < 1.0:
+        filterscale = 1.0
+    support = _LANCZOS_SUPPORT * filterscale
+
+    matrix = np.zeros((out_size, in_size), dtype=np.float64)
+    first, last = in_size, 0
+    for xx in range(out_size):
+        center = (xx + 0.5) * scale
+        ss = 1.0 / filterscale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size) - xmin
+
+        weights = []
+        ww = 0.0
+        for x in range(xmax):
+            w = _lanczos((x + xmin - center + 0.5) * ss)
+            weights.append(w)
+            ww += w
+        for x, w in enumerate(weights):
+            if ww != 0.0:
+                w /= ww
+            # C casts truncate towards zero, like int()
+            if w < 0:
+                matrix[xx, xmin + x] = int(-0.5 + w * (1 << _PRECISION_BITS))
+            else:
+                matrix[xx, xmin + x] = int(0.5 + w * (1 << _PRECISION_BITS))
+
+        first = min(first, xmin)
+        last = max(last, xmin + xmax)
+    matrix.setflags(write=False)
+    return matrix, first, last
+
+
+def _clip8(accumulated):
+    """Pillow's clip8(): round the fixed-point sums back to uint8."""
+    shifted = np.floor((accumulated + (1 << (_PRECISION_BITS - 1))) / (1 << _PRECISION_BITS))
+    return np.clip(shifted, 0, 255)
+
+
+def _to_gray(crop):
+    """Pillow's RGB -> L conversion applied to a BGR (or already gray) uint8 crop."""
+    if crop.ndim == 2:
+        return crop
+    # (b * 7471 + g * 38470 + r * 19595 + 0x8000) >> 16. Every product and sum
+    # stays below 2**24, so computing it in float32 is exact.
+    weighted = cv2.transform(crop.astype(np.float32), _GRAY_WEIGHTS)
+    return (weighted.astype(np.int32) >> 16).astype(np.uint8)
+
+
+def _resize_gray(gray, size):
+    """Lanczos resize of a 2D uint8 array to (size, size), as Image.resize() does it."""
+    height, width = gray.shape
+    if height > width * 100 and size < height:
+        # Image.resize() handles very tall images with two separate resizes
+        vertical, first_row, last_row = _resample_matrix(height, size)
+        rows = gray[first_row:last_row].astype(np.float64)
+        resized = _clip8(vertical[:, first_row:last_row] @ rows)
+        if width != size:
+            horizontal, _, _ = _resample_matrix(width, size)
+            resized = _clip8(resized @ horizontal.T)
+        return resized
+
+    need_horizontal = width != size
+    need_vertical = height != size
+
+    vertical, first_row, last_row = _resample_matrix(height, size)
+    if need_horizontal:
+        horizontal, _, _ = _resample_matrix(width, size)
+        # Only the rows the vertical pass reads, like ImagingResampleInner
+        rows = gray[first_row:last_row] if need_vertical else gray
+        resized = _clip8(rows.astype(np.float64) @ horizontal.T)
+    else:
+        resized = gray.astype(np.float64)
+    if need_vertical:
+        source = resized if need_horizontal else resized[first_row:last_row]
+        resized = _clip8(vertical[:, first_row:last_row] @ source)
+    return resized
+
+
+def _bits_to_hex(bits):
+    """Formats each row of booleans like str(imagehash.ImageHash)."""
+    bit_count = bits.shape[1]
+    width = (bit_count + 3) // 4
+    packed = np.packbits(bits, axis=1)
+    padding = packed.shape[1] * 8 - bit_count
+    if padding == 0 and bit_count % 4 == 0:
+        return [row.tobytes().hex() for row in packed]
+    return [
+        "{:0>{width}x}".format(int.from_bytes(row.tobytes(), "big") >> padding, width=width)
+        for row in packed
+    ]
+
+
+def _phash_fast(crops, hash_size):
+    img_size = hash_size * HIGHFREQ_FACTOR
+    pixels = np.empty((len(crops), img_size, img_size), dtype=np.float64)
+    for i, crop in enumerate(crops):
+        pixels[i] = _resize_gray(_to_gray(crop), img_size)
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+    low = dct[:, :hash_size, :hash_size].reshape(len(crops), -1)
+    medians = np.median(low, axis=1)
+    return _bits_to_hex(low > medians[:, None])
+
+
+def _phash_imagehash(crops, hash_size):
+    """Reference path: one PIL image and imagehash.phash() call per crop."""
+    import imagehash
+    from PIL import Image
+
+    hashes = []
+    for crop in crops:
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+        hashes.append(str(imagehash.phash(Image.fromarray(crop), hash_size=hash_size)))
+    return hashes
+
+
+def _use_fast_path():
+    """Compares the fast path with imagehash once on random crops."""
+    global _matches_imagehash
+    if _matches_imagehash is None:
+        with _self_check_lock:
+            if _matches_imagehash is None:
+                rng = np.random.default_rng(0)
+                # Smaller, equal to and larger than the resize target in each direction
+                shapes = [(17, 45), (32, 32), (32, 90), (120, 32), (233, 157), (640, 480), (404, 3)]
+                crops = [rng.integers(0, 256, (h, w, 3), dtype=np.uint8) for h, w in shapes]
+                crops.append(np.full((40, 60, 3), 127, dtype=np.uint8))  # Flat crop, ties at the median
+                matches = all(
+                    _phash_fast(crops, size) == _phash_imagehash(crops, size)
+                    for size in (8, 16)
+                )
+                if not matches:
+                    print(
+                        "Warning: batch pHash differs from imagehash with this Pillow version; "
+                        "falling back to imagehash."
+                    )
+                _matches_imagehash = matches
+    return _matches_imagehash
+
+
+def phash_batch(crops, hash_size=8):
+    """
+    Perceptual hashes of several crops at once.
+
+    Args:
+        crops: Non-empty BGR (or grayscale) uint8 arrays, of any sizes
+        hash_size: Hash size as in imagehash.phash
+
+    Returns:
+        List of hex strings, identical to str(imagehash.phash(...)) of each
+        crop converted to an RGB PIL image
+    """
+    if hash_size < 2:
+        raise ValueError("Hash size must be greater than or equal to 2")
+    if not crops:
+        return []
+    if _use_fast_path():
+        return _phash_fast(crops, hash_size)
+    return _phash_imagehash(crops, hash_size)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Measures the peak memory of detection on a long high-resolution video.
+
+A synthetic 4K fixture is generated once (and reused from --video), then
+detect_and_extract_fish() runs over it in a fresh interpreter per scenario
+with the stub detector, so the numbers are dominated by decoding and frame
+handling rather than by a model:
+
+- current:          this tree, once per --budgets value (FRAME_MEMORY_BUDGET_MB)
+- baseline:         with --baseline-ref, the same run on a temporary git
+                    worktree of that revision, for a before/after comparison
+
+Usage:
+    python bench/bench_memory.py [--seconds 120] [--budgets 32,128] [--baseline-ref HEAD~1]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHILD_CODE = """
+import json, queue, resource, sys, time
+import detector
+from stubs import StubDetector
+detector._model = StubDetector(latency=float(sys.argv[2]))
+frames = []
+start = time.perf_counter()
+detector.detect_and_extract_fish(
+    sys.argv[1], queue.Queue(), lambda current, total, error: frames.append(current)
+)
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "model_calls": detector._model.calls,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def run_child(tree, video, env, latency):
+    """Runs detection on `video` with the modules of `tree` in a fresh interpreter."""
+    workdir = tempfile.mkdtemp(prefix="fish_bench_memory_")
+    env = dict(env)
+    env["FISH_DATABASE"] = os.path.join(workdir, "bench.db")
+    env["FISH_IMAGE_DIR"] = os.path.join(workdir, "detected_fish")
+    env["DETECTION_CACHE_DIR"] = os.path.join(workdir, "detection_cache")
+    env["METRICS_DIR"] = os.path.join(workdir, "job_metrics")
+    # The tree under test first; the stubs always come from this checkout
+    env["PYTHONPATH"] = os.pathsep.join([tree, BENCH_DIR])
+    try:
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD_CODE, video, str(latency)],
+            cwd=workdir,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_scenario(name, tree, video, env, latency, repeat):
+    runs = [run_child(tree, video, env, latency) for _ in range(repeat)]
+    summary = {"scenario": name, "runs": runs}
+    for key in ("seconds", "peak_rss_mb"):
+        values = sorted(run[key] for run in runs)
+        summary[f"median_{key}"] = values[len(values) // 2]
+    print(
+        f"{name}: {summary['median_seconds']:.1f}s, "
+        f"peak RSS {summary['median_peak_rss_mb']:.1f} MB",
+        file=sys.stderr,
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--video", help="Use (or create) the fixture at this path")
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--seconds", type=float, default=120.0)
+    parser.add_argument("--fps", type=float, default=25.0)
+    parser.add_argument("--fish", type=int, default=8)
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="SECONDS_BETWEEN_FRAMES"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Stub detector seconds per frame"
+    )
+    parser.add_argument(
+        "--budgets", default="32,128", help="FRAME_MEMORY_BUDGET_MB values to compare"
+    )
+    parser.add_argument("--baseline-ref", help="Also measure this git revision")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BENCH_DIR)
+    from synthetic_video import generate_video
+
+    video = args.video or os.path.join(
+        tempfile.gettempdir(),
+        f"fish_bench_{args.width}x{args.height}_{args.seconds:g}s.mp4",
+    )
+    if not os.path.exists(video):
+        print(f"Generating {video}...", file=sys.stderr)
+        start = time.perf_counter()
+        generate_video(
+            video, args.width, args.height, args.seconds, args.fps, args.fish
+        )
+        print(f"Generated in {time.perf_counter() - start:.0f}s", file=sys.stderr)
+
+    env = dict(os.environ)
+    env["SECONDS_BETWEEN_FRAMES"] = str(args.interval)
+    env.pop("MODEL_SERVER_ADDRESS", None)
+
+    results = {
+        "video": video,
+        "video_mb": round(os.path.getsize(video) / 1024 / 1024, 1),
+        "resolution": f"{args.width}x{args.height}",
+        "interval": args.interval,
+        "latency": args.latency,
+        "scenarios": [],
+    }
+
+    if args.baseline_ref:
+        worktree = tempfile.mkdtemp(prefix="fish_bench_baseline_")
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", worktree, args.baseline_ref],
+            cwd=REPO_ROOT,
+            check=True,
+            capture_output=True,
+        )
+        try:
+            results["scenarios"].append(
+                run_scenario(
+                    f"baseline ({args.baseline_ref})",
+                    worktree,
+                    video,
+                    env,
+                    args.latency,
+                    args.repeat,
+                )
+            )
+        finally:
+            subprocess.run(
+                ["git", "worktree", "remove", "--force", worktree],
+                cwd=REPO_ROOT,
+                check=False,
+            )
+
+    for budget in args.budgets.split(","):
+        budget_env = dict(env)
+        budget_env["FRAME_MEMORY_BUDGET_MB"] = budget
+        results["scenarios"].append(
+            run_scenario(
+                f"current (budget {budget} MB)",
+                REPO_ROOT,
+                video,
+                budget_env,
+                args.latency,
+                args.repeat,
+            )
+        )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of perceptual hashing of fish crops.
+
+Compares the per-crop path (cv2.cvtColor -> Image.fromarray ->
+imagehash.phash) with batch_phash.phash_batch() on the same random crops,
+grouped into "frames" of --per-frame crops as the detector hashes them, and
+checks that both produce identical hashes.
+
+Usage:
+    python bench/bench_phash.py [--crops 2000] [--per-frame 8] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import batch_phash  # noqa: E402
+
+
+def make_crops(count, min_side, max_side, seed):
+    """Random BGR crops with some smooth texture, like cut-outs of a frame."""
+    rng = np.random.default_rng(seed)
+    crops = []
+    for _ in range(count):
+        height, width = rng.integers(min_side, max_side + 1, 2)
+        noise = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        crops.append(((noise * 0.3) + gradient * 0.7).astype(np.uint8))
+    return crops
+
+
+def time_path(name, hash_frames, frames, repeat):
+    best = None
+    hashes = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hashes = [h for frame in frames for h in hash_frames(frame)]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    crop_count = sum(len(frame) for frame in frames)
+    result = {
+        "seconds": round(best, 4),
+        "microseconds_per_crop": round(best / crop_count * 1e6, 1),
+        "crops_per_second": round(crop_count / best, 1),
+    }
+    print(f"{name}: {result['microseconds_per_crop']} us/crop", file=sys.stderr)
+    return result, hashes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--crops", type=int, default=2000)
+    parser.add_argument("--per-frame", type=int, default=8, help="Crops hashed together")
+    parser.add_argument("--min-side", type=int, default=24)
+    parser.add_argument("--max-side", type=int, default=320)
+    parser.add_argument("--hash-size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    crops = make_crops(args.crops, args.min_side, args.max_side, args.seed)
+    frames = [
+        crops[i : i + args.per_frame] for i in range(0, len(crops), args.per_frame)
+    ]
+    # Runs the one-time self-check outside the timed region
+    fast_path = batch_phash._use_fast_path()
+
+    imagehash_result, reference = time_path(
+        "imagehash",
+        lambda frame: batch_phash._phash_imagehash(frame, args.hash_size),
+        frames,
+        args.repeat,
+    )
+    batch_result, hashes = time_path(
+        "phash_batch",
+        lambda frame: batch_phash.phash_batch(frame, args.hash_size),
+        frames,
+        args.repeat,
+    )
+
+    results = {
+        "config": vars(args),
+        "fast_path": fast_path,
+        "imagehash": imagehash_result,
+        "phash_batch": batch_result,
+        "speedup": round(imagehash_result["seconds"] / batch_result["seconds"], 2),
+        "identical_hashes": hashes == reference,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    if not results["identical_hashes"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
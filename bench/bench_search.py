@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Measures /search queries (database.search_fish) on a large synthetic table.
+
+A throwaway database is filled with --rows characterized fish spread over
+--videos videos, with taxonomies drawn from a few real reef fish plus
+generated genera and species, through the normal triggers (so building it
+also measures the cost the search index adds to every write). Each query is
+then run --repeat times and its median and worst latency are reported, next
+to a baseline of what the endpoint replaces: loading every row with
+get_all_fish_data() and filtering in Python.
+
+Usage:
+    python bench/bench_search.py [--rows 1000000] [--videos 200] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+REEF_FISH = [
+    ("Perciformes", "Labridae", "Thalassoma", "Thalassoma lunare"),
+    ("Perciformes", "Labridae", "Labroides", "Labroides dimidiatus"),
+    ("Perciformes", "Labridae", "Cheilinus", "Cheilinus undulatus"),
+    ("Perciformes", "Pomacentridae", "Amphiprion", "Amphiprion ocellaris"),
+    ("Perciformes", "Pomacentridae", "Chromis", "Chromis viridis"),
+    ("Perciformes", "Acanthuridae", "Paracanthurus", "Paracanthurus hepatus"),
+    ("Perciformes", "Chaetodontidae", "Chaetodon", "Chaetodon auriga"),
+    ("Perciformes", "Serranidae", "Epinephelus", "Epinephelus lanceolatus"),
+    ("Tetraodontiformes", "Balistidae", "Rhinecanthus", "Rhinecanthus aculeatus"),
+    ("Tetraodontiformes", "Tetraodontidae", "Arothron", "Arothron hispidus"),
+    ("Syngnathiformes", "Syngnathidae", "Hippocampus", "Hippocampus kuda"),
+]
+
+QUERIES = [
+    ("prefix 'labr'", {"text": "labr"}),
+    ("prefix 'amphi ocel'", {"text": "amphi ocel"}),
+    ("Family=Labridae", {"taxa": {"Family": "Labridae"}}),
+    ("Family=Labridae, facets Genus+Species", {"taxa": {"Family": "Labridae"}, "facets": ["Genus", "Species"]}),
+    ("prefix 'perc' + facets Family", {"text": "perc", "facets": ["Family"]}),
+    ("rare species", {"taxa": {"Species": "Hippocampus kuda"}}),
+    ("rare genus 'Genus7'", {"text": "Genus7", "facets": ["Species"]}),
+    ("one video, Family=Labridae", {"taxa": {"Family": "Labridae"}, "video_filename": "video_0007.mp4"}),
+    ("everything, facets Family", {"facets": ["Family"]}),
+    ("one video, everything", {"video_filename": "video_0007.mp4"}),
+    ("page 100 of Perciformes", {"taxa": {"Order": "Perciformes"}, "pages": 100}),
+]
+
+
+def random_taxonomy(rng):
+    if rng.random() < 0.6:
+        order, family, genus, species = rng.choice(REEF_FISH)
+    else:
+        # A long tail of generated genera (each in one family) and species
+        genus_number = rng.randrange(500)
+        order, family = REEF_FISH[genus_number % len(REEF_FISH)][:2]
+        genus = f"Genus{genus_number}"
+        species = f"{genus} sp{rng.randrange(20)}"
+    return {
+        "Kingdom": "Animalia",
+        "Phylum": "Chordata",
+        "Class": "Actinopterygii",
+        "Order": order,
+        "Family": family,
+        "Genus": genus,
+        "Species": species,
+    }
+
+
+def build_database(rows, videos, seed):
+    import database
+
+    database.init_db()
+    rng = random.Random(seed)
+    conn = database.get_db()
+    batch = []
+    start = time.perf_counter()
+    for i in range(rows):
+        batch.append(
+            (
+                f"video_{i % videos:04d}/fish_{i}.png",
+                f"video_{i % videos:04d}.mp4",
+                json.dumps([f"00:{i % 60:02d}:00.000"]),
+                f"{rng.getrandbits(64):016x}",
+                "characterized",
+                json.dumps(random_taxonomy(rng)),
+            )
+        )
+        if len(batch) == 10000 or i == rows - 1:
+            conn.executemany(
+                "INSERT INTO detected_fish (image_filename, video_filename, timestamps, "
+                "perceptual_hash, status, taxonomy_json) VALUES (?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+            conn.commit()
+            batch = []
+    conn.close()
+    return time.perf_counter() - start
+
+
+def time_query(query, repeat):
+    import database
+
+    query = dict(query)
+    pages = query.pop("pages", 1)
+    # Deep pages are timed on their own, after paging to them once
+    before_id = None
+    for _ in range(pages - 1):
+        before_id = database.search_fish(before_id=before_id, **query)["next_before_id"]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = database.search_fish(before_id=before_id, **query)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "median_ms": round(timings[len(timings) // 2], 2),
+        "max_ms": round(timings[-1], 2),
+        "total": result["total"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--videos", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-baseline", action="store_true")
+    parser.add_argument("--output", help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="fish_bench_search_")
+    os.environ["FISH_DATABASE"] = os.path.join(workdir, "bench.db")
+    os.environ["FISH_IMAGE_DIR"] = os.path.join(workdir, "detected_fish")
+    try:
+        print(f"Inserting {args.rows} fish...", file=sys.stderr)
+        insert_seconds = build_database(args.rows, args.videos, args.seed)
+        results = {
+            "rows": args.rows,
+            "videos": args.videos,
+            "insert_seconds": round(insert_seconds, 1),
+            "database_mb": round(os.path.getsize(os.environ["FISH_DATABASE"]) / 1024 / 1024, 1),
+            "queries": {},
+        }
+        for name, query in QUERIES:
+            results["queries"][name] = time_query(query, args.repeat)
+            print(f"{name}: {results['queries'][name]}", file=sys.stderr)
+
+        if not args.skip_baseline:
+            import database
+
+            start = time.perf_counter()
+            matches = [
+                row
+                for row in database.get_all_fish_data()
+                if row["taxonomy_json"]
+                and json.loads(row["taxonomy_json"]).get("Family") == "Labridae"
+            ]
+            results["baseline_family_filter_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            print(
+                f"Baseline (get_all_fish_data + filter, {len(matches)} matches): "
+                f"{results['baseline_family_filter_ms']} ms",
+                file=sys.stderr,
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
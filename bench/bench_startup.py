@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Measures app startup time and per-worker memory.
+
+Each scenario runs in a fresh interpreter so import caches don't skew the
+numbers:
+
+- import:        `import app` only (models are loaded lazily)
+- warm_local:    import + warm_up_models() with the model loaded in the worker
+- warm_server:   import + warm_up_models() against a shared model_server.py
+
+Usage:
+    python bench/bench_startup.py [--repeat 3] [--skip-warm] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_CODE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+import_seconds = time.perf_counter() - start
+warm_seconds = None
+if sys.argv[1] == "warm":
+    start = time.perf_counter()
+    app.warm_up_models()
+    warm_seconds = time.perf_counter() - start
+print(json.dumps({
+    "import_seconds": import_seconds,
+    "warm_up_seconds": warm_seconds,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def run_child(mode, env):
+    """Runs one fresh interpreter and returns its measurements."""
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_CODE, mode],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["wall_seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_scenario(name, mode, env, repeat):
+    runs = [run_child(mode, env) for _ in range(repeat)]
+    summary = {"scenario": name, "runs": runs}
+    for key in ("import_seconds", "wall_seconds", "peak_rss_mb"):
+        values = sorted(run[key] for run in runs)
+        summary[f"median_{key}"] = values[len(values) // 2]
+    print(
+        f"{name}: import {summary['median_import_seconds']:.3f}s, "
+        f"wall {summary['median_wall_seconds']:.3f}s, "
+        f"peak RSS {summary['median_peak_rss_mb']:.1f} MB",
+        file=sys.stderr,
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--skip-warm", action="store_true", help="Only measure the plain import"
+    )
+    parser.add_argument("--port", type=int, default=6011)
+    parser.add_argument("--output", help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="fish_bench_startup_")
+    env = dict(os.environ)
+    env["FISH_DATABASE"] = os.path.join(workdir, "bench.db")
+    env["FISH_IMAGE_DIR"] = os.path.join(workdir, "detected_fish")
+    env.pop("MODEL_SERVER_ADDRESS", None)
+
+    results = {"python": sys.version.split()[0], "scenarios": []}
+    results["scenarios"].append(run_scenario("import", "import", env, args.repeat))
+    results["database_created_on_import"] = os.path.exists(env["FISH_DATABASE"])
+
+    if not args.skip_warm:
+        results["scenarios"].append(
+            run_scenario("warm_local", "warm", env, args.repeat)
+        )
+
+        server_env = dict(env)
+        server_env["MODEL_SERVER_ADDRESS"] = f"127.0.0.1:{args.port}"
+        server = subprocess.Popen(
+            [sys.executable, "model_server.py"],
+            cwd=REPO_ROOT,
+            env=server_env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        try:
+            # Wait until the server has loaded the model and is listening
+            for line in server.stdout:
+                if "listening" in line or "cannot start" in line:
+                    break
+            results["scenarios"].append(
+                run_scenario("warm_server", "warm", server_env, args.repeat)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
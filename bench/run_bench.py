@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark.
+
+Generates (or reuses) a synthetic video, runs detect_and_extract_fish on it with
+the stub detector or the real YOLO model, then characterizes every queued fish
+through get_fish_taxonomy against a fake Gemini model. Everything runs against
+a throwaway database and image directory.
+
+Results are printed as JSON so runs can be compared between commits:
+
+    python bench/run_bench.py --seconds 120 --fish 8 --output before.json
+    git checkout <other commit>
+    python bench/run_bench.py --seconds 120 --fish 8 --output after.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark.")
+    video = parser.add_argument_group("synthetic video")
+    video.add_argument("--video", help="Use this video instead of generating one")
+    video.add_argument("--width", type=int, default=1280)
+    video.add_argument("--height", type=int, default=720)
+    video.add_argument("--seconds", type=float, default=60.0)
+    video.add_argument("--fps", type=float, default=25.0)
+    video.add_argument("--fish", type=int, default=5, help="Sprites on screen")
+    video.add_argument("--seed", type=int, default=0)
+
+    pipeline = parser.add_argument_group("pipeline")
+    pipeline.add_argument("--detector", choices=("stub", "yolo"), default="stub")
+    pipeline.add_argument(
+        "--seconds-between-frames",
+        type=float,
+        default=1.0,
+        help="Overrides SECONDS_BETWEEN_FRAMES",
+    )
+    pipeline.add_argument(
+        "--skip-llm", action="store_true", help="Only benchmark detection"
+    )
+    pipeline.add_argument("--llm-latency", type=float, default=0.0)
+    pipeline.add_argument("--llm-429-rate", type=float, default=0.0)
+    pipeline.add_argument("--llm-accuracy", type=float, default=1.0)
+    pipeline.add_argument(
+        "--llm-first-pass-accuracy",
+        type=float,
+        help="Enables the model cascade with a fake first-pass model this accurate",
+    )
+    pipeline.add_argument("--llm-first-pass-latency", type=float, default=0.0)
+    pipeline.add_argument(
+        "--rpm", type=int, default=0, help="Gemini rate limit, 0 disables the sleep"
+    )
+
+    parser.add_argument("--workdir", help="Keep the database and crops here")
+    parser.add_argument("--output", help="Write JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="fish_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    # Configure the app modules before they are imported
+    os.environ["FISH_DATABASE"] = os.path.join(workdir, "bench.db")
+    os.environ["FISH_IMAGE_DIR"] = os.path.join(workdir, "detected_fish")
+    os.environ["SECONDS_BETWEEN_FRAMES"] = str(args.seconds_between_frames)
+    os.environ["METRICS_ENABLED"] = "1"
+    os.environ["METRICS_DIR"] = os.path.join(workdir, "job_metrics")
+    os.environ["DETECTION_CACHE_DIR"] = os.path.join(workdir, "detection_cache")
+
+    import database
+    import detector
+    import llm_handler
+    import metrics
+    from stubs import StubDetector, FakeGeminiModel
+    from synthetic_video import generate_video
+
+    video_path = args.video
+    generate_seconds = None
+    if not video_path:
+        video_path = os.path.join(
+            workdir,
+            f"synthetic_{args.width}x{args.height}_{int(args.seconds)}s_{args.fish}fish.mp4",
+        )
+        start = time.perf_counter()
+        generate_video(
+            video_path, args.width, args.height, args.seconds, args.fps, args.fish, args.seed
+        )
+        generate_seconds = time.perf_counter() - start
+
+    if args.detector == "stub":
+        detector._model = StubDetector()
+    fake_llm = FakeGeminiModel(
+        args.llm_latency, args.llm_429_rate, args.llm_accuracy, args.seed
+    )
+    llm_handler._model = fake_llm
+    first_pass_llm = None
+    if args.llm_first_pass_accuracy is not None:
+        first_pass_llm = FakeGeminiModel(
+            args.llm_first_pass_latency,
+            args.llm_429_rate,
+            args.llm_first_pass_accuracy,
+            args.seed + 1,
+        )
+        llm_handler._first_pass_model = first_pass_llm
+    llm_handler.REQUEST_INTERVAL = 60.0 / args.rpm if args.rpm > 0 else 0
+
+    database.init_db()
+    rss_before = peak_rss_mb()
+
+    # --- Detection ---
+    detection_queue = llm_handler.CharacterizationQueue()
+    frames = {"current": 0, "total": 0, "error": False}
+
+    def progress(current, total, error):
+        frames.update(current=current, total=total, error=error)
+
+    start = time.perf_counter()
+    detector.detect_and_extract_fish(video_path, detection_queue, progress)
+    detection_seconds = time.perf_counter() - start
+    queued = detection_queue.qsize()
+
+    # --- Characterization (same loop shape as app.llm_worker) ---
+    characterization_seconds = 0.0
+    if not args.skip_llm:
+        start = time.perf_counter()
+        while not detection_queue.empty():
+            task = detection_queue.get()
+            llm_handler.get_fish_taxonomy(task["id"], task["filename"])
+        characterization_seconds = time.perf_counter() - start
+
+    video_filename = os.path.basename(video_path)
+    rows = database.get_all_fish_data(video_filename)
+    status_counts = {}
+    for row in rows:
+        status_counts[row["status"]] = status_counts.get(row["status"], 0) + 1
+
+    counters = metrics.snapshot()["counters"]
+    db_writes = {
+        dict(labels).get("operation"): value
+        for (name, labels), value in counters.items()
+        if name == "fish_db_writes_total"
+    }
+    stage_totals = {
+        dict(labels)["stage"]: {"count": count, "total_seconds": round(total, 6)}
+        for (name, labels), (count, total) in metrics.snapshot()["histograms"].items()
+        if name == metrics.STAGE_HISTOGRAM
+    }
+
+    cost_usd = {
+        dict(labels)["tier"]: round(value, 6)
+        for (name, labels), value in counters.items()
+        if name == "fish_llm_cost_usd_total"
+    }
+    escalations = {
+        dict(labels)["reason"]: value
+        for (name, labels), value in counters.items()
+        if name == "fish_llm_escalations_total"
+    }
+
+    request_bytes = metrics.snapshot()["histograms"].get(("fish_llm_request_bytes", ()))
+    unique_fish = len(rows)
+    results = {
+        "revision": git_revision(),
+        "config": vars(args),
+        "video": {
+            "path": video_path,
+            "frames": frames["total"],
+            "generate_seconds": generate_seconds,
+        },
+        "detection": {
+            "seconds": round(detection_seconds, 4),
+            "frames_per_second": round(frames["total"] / detection_seconds, 2)
+            if detection_seconds
+            else None,
+            "model_calls": getattr(detector._model, "calls", None),
+            "unique_fish": unique_fish,
+            "queued": queued,
+            "fish_per_second": round(unique_fish / detection_seconds, 3)
+            if detection_seconds
+            else None,
+            "error": frames["error"],
+        },
+        "characterization": {
+            "seconds": round(characterization_seconds, 4),
+            "llm_calls": fake_llm.calls,
+            "llm_rate_limited": fake_llm.rate_limited,
+            "llm_calls_per_unique_fish": round(fake_llm.calls / unique_fish, 3)
+            if unique_fish
+            else None,
+            "status_counts": status_counts,
+            "llm_bytes_sent": round(request_bytes[1]) if request_bytes else None,
+            "first_pass_llm_calls": first_pass_llm.calls if first_pass_llm else None,
+            "escalations": escalations,
+            "cost_usd": cost_usd,
+        },
+        "db_writes": db_writes,
+        "db_writes_total": sum(db_writes.values()),
+        "stages": stage_totals,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_rss_mb_before_pipeline": round(rss_before, 1),
+    }
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
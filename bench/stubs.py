@@ -0,0 +1,120 @@
+"""
+Deterministic stand-ins for YOLO and Gemini used by the benchmarks.
+
+StubDetector finds the sprites drawn by synthetic_video.py with a colour
+threshold, so detection cost is small and results are reproducible.
+FakeGeminiModel answers generate_content() after a configurable latency and
+fails a configurable fraction of requests with a 429 error. Both are also
+used by the tests in tests/.
+"""
+
+import json
+import random
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from model_server import RemoteBoxes, RemoteResult
+
+# The taxonomy every fake response is built from
+FAKE_TAXONOMY = {
+    "Kingdom": "Animalia",
+    "Phylum": "Chordata",
+    "Class": "Actinopterygii",
+    "Order": "Perciformes",
+    "Family": "Labridae",
+    "Genus": "Thalassoma",
+    "Species": "Thalassoma lunare",
+}
+
+
+class StubDetector:
+    """Drop-in replacement for a YOLO model that boxes the synthetic sprites."""
+
+    def __init__(self, min_area=40, red_threshold=100, latency=0.0):
+        self.min_area = min_area
+        self.red_threshold = red_threshold
+        self.latency = latency  # Extra seconds per call, to stand in for inference time
+        self.calls = 0
+
+    def predict(self, frame, conf=0.25, verbose=False, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        mask = (frame[..., 2] > self.red_threshold).astype(np.uint8)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+        boxes = []
+        for x, y, w, h, area in stats[1:count]:
+            if area >= self.min_area:
+                boxes.append((x, y, x + w, y + h))
+
+        xyxy = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        # Sprites are always confident detections of class 0
+        confidences = np.full(len(xyxy), 0.9, dtype=np.float32)
+        classes = np.zeros(len(xyxy), dtype=np.float32)
+        return [RemoteResult(RemoteBoxes(xyxy, confidences, classes))]
+
+
+class RateLimitError(Exception):
+    """Raised by FakeGeminiModel to simulate an HTTP 429 response."""
+
+    code = 429
+
+
+class _FakePart:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [_FakePart(text)]
+
+
+class FakeGeminiModel:
+    """
+    Drop-in replacement for genai.GenerativeModel.
+
+    Args:
+        latency: Seconds each generate_content() call takes
+        rate_429: Fraction of calls that fail with a RateLimitError
+        accuracy: Fraction of calls that return a full taxonomy; the others
+            come back with most ranks set to "Unknown"
+        seed: Seed for the 429/accuracy decisions
+        confidence: Self-reported "Confidence" added to every answer (none if None)
+    """
+
+    def __init__(self, latency=0.0, rate_429=0.0, accuracy=1.0, seed=0, confidence=None):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.accuracy = accuracy
+        self.confidence = confidence
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rate_limited = 0
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            limited = self._random.random() < self.rate_429
+            accurate = self._random.random() < self.accuracy
+            if limited:
+                self.rate_limited += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+        if limited:
+            raise RateLimitError("429 Resource has been exhausted (fake)")
+
+        taxonomy = dict(FAKE_TAXONOMY)
+        if not accurate:
+            for rank in ("Order", "Family", "Genus", "Species"):
+                taxonomy[rank] = "Unknown"
+        if self.confidence is not None:
+            taxonomy["Confidence"] = self.confidence
+        return _FakeResponse(f"```json\n{json.dumps(taxonomy, indent=2)}\n```")
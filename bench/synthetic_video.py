@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Generates synthetic underwater videos with moving "fish" sprites.
+
+The background is a blue gradient and every sprite is a warm-coloured ellipse
+with a tail and a stripe pattern, so sprites are easy to find deterministically
+(see stubs.StubDetector) while still giving the perceptual hash some texture.
+
+Usage:
+    python bench/synthetic_video.py out.mp4 --width 1280 --height 720 --seconds 60 --fish 5
+"""
+
+import argparse
+import math
+
+import cv2
+import numpy as np
+
+
+def _make_sprites(rng, count, width, height):
+    sprites = []
+    for _ in range(count):
+        size = int(rng.integers(max(8, height // 16), max(12, height // 6)))
+        sprites.append(
+            {
+                "x": float(rng.uniform(0, width)),
+                "y": float(rng.uniform(size, height - size)),
+                "vx": float(rng.uniform(-0.02, 0.02) * width),
+                "vy": float(rng.uniform(-0.005, 0.005) * height),
+                "size": size,
+                # Warm colours (BGR) so the red channel separates sprites from the water
+                "color": (
+                    int(rng.integers(0, 90)),
+                    int(rng.integers(60, 220)),
+                    int(rng.integers(170, 256)),
+                ),
+                "stripes": int(rng.integers(1, 5)),
+                "phase": float(rng.uniform(0, 2 * math.pi)),
+            }
+        )
+    return sprites
+
+
+def _background(width, height):
+    gradient = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (200 - 80 * gradient).astype(np.uint8)  # Blue
+    frame[..., 1] = (120 - 60 * gradient).astype(np.uint8)  # Green
+    frame[..., 2] = 20  # Red stays low so sprites stand out
+    return frame
+
+
+def _draw_sprite(frame, sprite, t):
+    x, y, size = int(sprite["x"]), int(sprite["y"]), sprite["size"]
+    axes = (size, max(4, size // 2))
+    facing = 1 if sprite["vx"] >= 0 else -1
+    wiggle = int(math.sin(t * 4 + sprite["phase"]) * axes[1] * 0.3)
+
+    cv2.ellipse(frame, (x, y), axes, 0, 0, 360, sprite["color"], -1)
+    tail = np.array(
+        [
+            (x - facing * axes[0], y),
+            (x - facing * int(axes[0] * 1.6), y - axes[1] + wiggle),
+            (x - facing * int(axes[0] * 1.6), y + axes[1] + wiggle),
+        ],
+        dtype=np.int32,
+    )
+    cv2.fillPoly(frame, [tail], sprite["color"])
+    dark = tuple(max(0, c - 90) for c in sprite["color"])
+    for i in range(sprite["stripes"]):
+        sx = x + int((i + 1) * axes[0] / (sprite["stripes"] + 1) - axes[0] / 2)
+        cv2.line(frame, (sx, y - axes[1] + 2), (sx, y + axes[1] - 2), dark, 2)
+    cv2.circle(frame, (x + facing * int(axes[0] * 0.6), y - axes[1] // 4), 2, (0, 0, 0), -1)
+
+
+def generate_video(path, width=1280, height=720, seconds=30.0, fps=25.0, fish=5, seed=0):
+    """
+    Writes a synthetic video to `path` and returns its frame count.
+
+    Args:
+        path: Output path (.mp4 is written with the mp4v codec)
+        width, height: Frame size in pixels
+        seconds: Video length
+        fps: Frames per second
+        fish: Number of sprites swimming around at any time
+        seed: Random seed, the same arguments always produce the same video
+    """
+    rng = np.random.default_rng(seed)
+    sprites = _make_sprites(rng, fish, width, height)
+    background = _background(width, height)
+
+    writer = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height)
+    )
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not open video writer for {path}")
+
+    frame_total = int(seconds * fps)
+    frame = np.empty_like(background)
+    try:
+        for index in range(frame_total):
+            t = index / fps
+            np.copyto(frame, background)
+            for sprite in sprites:
+                sprite["x"] += sprite["vx"] / fps * 10
+                sprite["y"] += sprite["vy"] / fps * 10
+                margin = sprite["size"] * 2
+                # Wrap around horizontally, bounce vertically
+                if sprite["x"] > width + margin:
+                    sprite["x"] = -margin
+                elif sprite["x"] < -margin:
+                    sprite["x"] = width + margin
+                if not sprite["size"] < sprite["y"] < height - sprite["size"]:
+                    sprite["vy"] = -sprite["vy"]
+                _draw_sprite(frame, sprite, t)
+            writer.write(frame)
+    finally:
+        writer.release()
+
+    return frame_total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic fish video.")
+    parser.add_argument("path")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--fps", type=float, default=25.0)
+    parser.add_argument("--fish", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    frames = generate_video(
+        args.path, args.width, args.height, args.seconds, args.fps, args.fish, args.seed
+    )
+    print(f"Wrote {frames} frames to {args.path}")
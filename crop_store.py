@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Storage backends for cropped fish images.
+
+The default "files" backend writes every crop as its own PNG under
+detected_fish/<video_dirname>/. The optional "pack" backend (CROP_STORAGE=pack)
+appends the encoded crops to a single detected_fish/<video_dirname>.pack file
+per video and records each crop's byte range in the crop_pack_index table.
+Packed crops are read back through mmap, so serving one is a single slice of
+the mapped pack file.
+
+In both cases the crop keeps its usual "<video_dirname>/fish_<uuid>.png"
+name in the database, so the rest of the app does not need to know where the
+bytes live.
+
+Bulk deletes (delete_crops_async) hand the file work to a background thread,
+so a request that deletes thousands of fish returns as soon as the database
+transaction has committed. Purging a video renames its crop directory and
+pack file to "<name>.deleted-<id>" right away and removes them in the
+background.
+
+Deleting a packed crop only flags it in the index. Run
+    python crop_store.py compact [--video <video_dirname>]
+to rewrite the pack files without deleted or orphaned crops. Compaction is
+meant to run while no detection job is writing to the pack being compacted.
+"""
+
+import argparse
+import mmap
+import os
+import queue
+import shutil
+import threading
+import uuid
+
+import cv2
+
+from database import (
+    IMAGE_DIR,
+    add_pack_entry,
+    get_pack_entry,
+    mark_pack_entry_deleted,
+    get_pack_filenames,
+    get_packed_crops,
+    get_live_pack_entries,
+    replace_pack_entries,
+)
+
+# --- Configuration ---
+CROP_STORAGE = os.getenv("CROP_STORAGE", "files").lower()  # "files" or "pack"
+PACK_EXTENSION = ".pack"
+TOMBSTONE_SUFFIX = ".deleted-"  # Purged crops waiting for the background deleter
+
+# One lock per pack file so appends and compaction never interleave
+_pack_locks = {}
+_pack_locks_guard = threading.Lock()
+
+# Files and directories waiting to be removed by the background deleter
+_delete_queue = queue.Queue()
+_deleter_thread = None
+_deleter_lock = threading.Lock()
+
+# Cached read-only mappings: pack_filename -> (inode, size, mmap)
+_mmaps = {}
+_mmaps_lock = threading.Lock()
+
+
+def _get_pack_lock(pack_filename):
+    with _pack_locks_guard:
+        if pack_filename not in _pack_locks:
+            _pack_locks[pack_filename] = threading.Lock()
+        return _pack_locks[pack_filename]
+
+
+def pack_filename_for(video_dirname):
+    """Pack file name (relative to IMAGE_DIR) used for a video's crops."""
+    return f"{video_dirname}{PACK_EXTENSION}"
+
+
+def save_crop(video_dirname, image_filename, cropped_fish):
+    """
+    Stores a BGR crop and returns its path relative to IMAGE_DIR.
+
+    Args:
+        video_dirname: Sanitised video directory name
+        image_filename: Unique crop filename (e.g. fish_<uuid>.png)
+        cropped_fish: BGR numpy array of the crop
+    """
+    rel_image_path = os.path.join(video_dirname, image_filename)
+
+    if CROP_STORAGE != "pack":
+        cv2.imwrite(os.path.join(IMAGE_DIR, rel_image_path), cropped_fish)
+        return rel_image_path
+
+    ok, encoded = cv2.imencode(".png", cropped_fish)
+    if not ok:
+        raise ValueError(f"Could not encode crop {rel_image_path}")
+    data = encoded.tobytes()
+
+    pack_filename = pack_filename_for(video_dirname)
+    pack_path = os.path.join(IMAGE_DIR, pack_filename)
+    with _get_pack_lock(pack_filename):
+        with open(pack_path, "ab") as pack_file:
+            offset = pack_file.tell()
+            pack_file.write(data)
+        add_pack_entry(rel_image_path, pack_filename, offset, len(data))
+
+    return rel_image_path
+
+
+def _get_mapping(pack_filename, required_size):
+    """Returns an mmap of the pack covering at least `required_size` bytes."""
+    pack_path = os.path.join(IMAGE_DIR, pack_filename)
+    stat = os.stat(pack_path)
+
+    with _mmaps_lock:
+        cached = _mmaps.get(pack_filename)
+        # Reuse the mapping unless the pack was replaced (compaction) or has
+        # grown past the mapped size since it was mapped
+        if cached and cached[0] == stat.st_ino and cached[1] >= required_size:
+            return cached[2]
+
+        if stat.st_size < required_size:
+            raise ValueError(f"Pack file {pack_path} is shorter than its index")
+
+        # Superseded mappings are not closed explicitly because another
+        # thread may still be slicing them; they are released once unreferenced
+        with open(pack_path, "rb") as pack_file:
+            mapping = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        _mmaps[pack_filename] = (stat.st_ino, stat.st_size, mapping)
+        return mapping
+
+
+def _drop_mapping(pack_filename):
+    with _mmaps_lock:
+        _mmaps.pop(pack_filename, None)
+
+
+def read_packed_crop(image_filename):
+    """
+    Returns the encoded bytes of a packed crop, or None if the crop is not
+    stored in a pack (or has been deleted).
+    """
+    entry = get_pack_entry(image_filename)
+    if not entry or entry["deleted"]:
+        return None
+
+    offset = entry["offset"]
+    length = entry["length"]
+    try:
+        mapping = _get_mapping(entry["pack_filename"], offset + length)
+        return mapping[offset : offset + length]
+    except (OSError, ValueError) as e:
+        print(f"Error reading packed crop {image_filename}: {e}")
+        return None
+
+
+def delete_crop(image_filename):
+    """
+    Deletes a stored crop. Packed crops are only flagged as deleted; loose
+    files are removed. Returns True if something was deleted.
+    """
+    if mark_pack_entry_deleted(image_filename):
+        print(f"Marked packed crop as deleted: {image_filename}")
+        return True
+
+    image_path = os.path.join(IMAGE_DIR, image_filename)
+    if os.path.exists(image_path):
+        os.remove(image_path)
+        print(f"Deleted image file: {image_path}")
+        return True
+
+    print(f"Image file not found: {image_path}")
+    return False
+
+
+def _deleter():
+    while True:
+        paths = _delete_queue.get()
+        removed = 0
+        for path in paths:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error deleting {path}: {e}")
+        print(f"Background deleter removed {removed} of {len(paths)} paths.")
+        _delete_queue.task_done()
+
+
+def delete_crops_async(image_filenames, purge_video_dirname=None):
+    """
+    Removes the files of already deleted fish entries in the background.
+    Packed crops are skipped: their index rows were flagged (or dropped) in
+    the same transaction that deleted the entries.
+
+    Args:
+        image_filenames: Crop paths relative to IMAGE_DIR
+        purge_video_dirname: Remove this video's whole crop directory and
+            pack file instead (all of its fish must have been deleted)
+    """
+    global _deleter_thread
+
+    paths = []
+    if purge_video_dirname:
+        # Renamed before returning, so a job that starts on the same video
+        # right away writes to a fresh directory and pack file that the
+        # background deleter never touches
+        pack_filename = pack_filename_for(purge_video_dirname)
+        with _get_pack_lock(pack_filename):
+            _drop_mapping(pack_filename)
+            for name in (purge_video_dirname, pack_filename):
+                path = os.path.join(IMAGE_DIR, name)
+                tombstone = f"{path}{TOMBSTONE_SUFFIX}{uuid.uuid4().hex[:12]}"
+                try:
+                    os.rename(path, tombstone)
+                except FileNotFoundError:
+                    continue
+                paths.append(tombstone)
+    else:
+        packed = get_packed_crops(image_filenames)
+        paths.extend(
+            os.path.join(IMAGE_DIR, f) for f in image_filenames if f not in packed
+        )
+    if not paths:
+        return 0
+
+    with _deleter_lock:
+        if _deleter_thread is None or not _deleter_thread.is_alive():
+            _deleter_thread = threading.Thread(target=_deleter, daemon=True)
+            _deleter_thread.start()
+    _delete_queue.put(paths)
+    return len(paths)
+
+
+def compact_pack(pack_filename):
+    """
+    Rewrites a pack file keeping only live crops and updates the index.
+    Returns the number of bytes reclaimed.
+    """
+    pack_path = os.path.join(IMAGE_DIR, pack_filename)
+    if not os.path.exists(pack_path):
+        print(f"Pack file not found, skipping: {pack_path}")
+        return 0
+
+    tmp_path = pack_path + ".compact"
+    with _get_pack_lock(pack_filename):
+        old_size = os.path.getsize(pack_path)
+        entries = get_live_pack_entries(pack_filename)
+
+        new_entries = []
+        with open(pack_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for entry in entries:
+                src.seek(entry["offset"])
+                data = src.read(entry["length"])
+                new_entries.append((entry["image_filename"], dst.tell(), len(data)))
+                dst.write(data)
+            dst.flush()
+            os.fsync(dst.fileno())
+        new_size = os.path.getsize(tmp_path)
+
+        _drop_mapping(pack_filename)
+        try:
+            replace_pack_entries(
+                pack_filename,
+                new_entries,
+                before_commit=lambda: os.replace(tmp_path, pack_path),
+            )
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    reclaimed = old_size - new_size
+    print(
+        f"Compacted {pack_filename}: kept {len(new_entries)} crops, reclaimed {reclaimed} bytes"
+    )
+    return reclaimed
+
+
+def compact_all(video_dirname=None):
+    """Compacts every pack file, or only the pack of `video_dirname`."""
+    if video_dirname:
+        pack_filenames = [pack_filename_for(video_dirname)]
+    else:
+        pack_filenames = get_pack_filenames()
+
+    total_reclaimed = 0
+    for pack_filename in pack_filenames:
+        total_reclaimed += compact_pack(pack_filename)
+
+    print(f"Compaction finished. Reclaimed {total_reclaimed} bytes in total.")
+    return total_reclaimed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage packed crop storage.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser(
+        "compact", help="Reclaim space used by deleted crops"
+    )
+    compact_parser.add_argument(
+        "--video", help="Only compact the pack of this video directory name"
+    )
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        compact_all(args.video)
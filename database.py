@@ -1,23 +1,389 @@
 import sqlite3
 import json
 import os
+import re
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from dotenv import load_dotenv
+from metrics import span, increment
 
-DATABASE_NAME = "fish_database.db"
-IMAGE_DIR = "detected_fish"
+load_dotenv()
 
-# Ensure the directory for storing images exists
-os.makedirs(IMAGE_DIR, exist_ok=True)
+DATABASE_NAME = os.getenv("FISH_DATABASE", "fish_database.db")
+IMAGE_DIR = os.getenv("FISH_IMAGE_DIR", "detected_fish")
+SQLITE_TIMEOUT = float(os.getenv("SQLITE_TIMEOUT", "30"))  # Seconds to wait for a lock
 
+# The schema is created lazily on first use rather than at import time, so
+# importing this module (e.g. from CLI tools) does not touch the database
+_db_initialized = False
+_db_init_lock = threading.Lock()
 
-def get_db():
-    conn = sqlite3.connect(DATABASE_NAME)
+
+def _connect():
+    # Several processes may write at once (see ingest.py), so wait for locks
+    # rather than failing with "database is locked"
+    conn = sqlite3.connect(DATABASE_NAME, timeout=SQLITE_TIMEOUT)
     conn.row_factory = sqlite3.Row  # Return rows as dictionary-like objects
     return conn
 
 
+def get_db():
+    if not _db_initialized:
+        init_db()
+    return _connect()
+
+
 def init_db():
-    conn = get_db()
+    global _db_initialized
+    with _db_init_lock:
+        if _db_initialized:
+            return
+        _create_schema()
+        _db_initialized = True
+
+
+# Per-video statistics kept in the videos table
+_VIDEO_STATS_COLUMNS = [
+    ("duration_sec", "REAL"),
+    ("fps", "REAL"),
+    ("config_json", "TEXT"),  # JSON of the detection (sampling) settings of the last run
+    ("detection_started_at", "TIMESTAMP"),
+    ("detection_finished_at", "TIMESTAMP"),
+    ("detection_seconds", "REAL NOT NULL DEFAULT 0"),  # Summed over resumed runs
+    ("last_characterized_at", "TIMESTAMP"),
+    ("fish_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("pending_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("characterizing_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("characterized_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("error_count", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+# Keep the fish counts of the videos table in step with detected_fish
+_VIDEO_COUNT_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_detected_fish_insert AFTER INSERT ON detected_fish
+    BEGIN
+        INSERT OR IGNORE INTO videos (video_filename) VALUES (NEW.video_filename);
+        UPDATE videos SET
+            fish_count = fish_count + 1,
+            pending_count = pending_count + (NEW.status = 'pending_characterization'),
+            characterizing_count = characterizing_count + (NEW.status = 'characterizing'),
+            characterized_count = characterized_count + (NEW.status = 'characterized'),
+            error_count = error_count + (NEW.status = 'error')
+        WHERE video_filename = NEW.video_filename;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_detected_fish_delete AFTER DELETE ON detected_fish
+    BEGIN
+        UPDATE videos SET
+            fish_count = fish_count - 1,
+            pending_count = pending_count - (OLD.status = 'pending_characterization'),
+            characterizing_count = characterizing_count - (OLD.status = 'characterizing'),
+            characterized_count = characterized_count - (OLD.status = 'characterized'),
+            error_count = error_count - (OLD.status = 'error')
+        WHERE video_filename = OLD.video_filename;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_detected_fish_update
+    AFTER UPDATE OF status, video_filename ON detected_fish
+    WHEN OLD.status IS NOT NEW.status OR OLD.video_filename IS NOT NEW.video_filename
+    BEGIN
+        UPDATE videos SET
+            fish_count = fish_count - 1,
+            pending_count = pending_count - (OLD.status = 'pending_characterization'),
+            characterizing_count = characterizing_count - (OLD.status = 'characterizing'),
+            characterized_count = characterized_count - (OLD.status = 'characterized'),
+            error_count = error_count - (OLD.status = 'error')
+        WHERE video_filename = OLD.video_filename;
+        INSERT OR IGNORE INTO videos (video_filename) VALUES (NEW.video_filename);
+        UPDATE videos SET
+            fish_count = fish_count + 1,
+            pending_count = pending_count + (NEW.status = 'pending_characterization'),
+            characterizing_count = characterizing_count + (NEW.status = 'characterizing'),
+            characterized_count = characterized_count + (NEW.status = 'characterized'),
+            error_count = error_count + (NEW.status = 'error'),
+            last_characterized_at = CASE WHEN NEW.status = 'characterized'
+                THEN CURRENT_TIMESTAMP ELSE last_characterized_at END
+        WHERE video_filename = NEW.video_filename;
+    END
+    """,
+]
+
+
+# Ranks of the taxonomy JSON returned by the LLM that are rolled up per video
+TAXONOMY_RANKS = ("Kingdom", "Phylum", "Class", "Order", "Family", "Genus", "Species")
+_RANKS_SQL = ", ".join(f"'{rank}'" for rank in TAXONOMY_RANKS)
+
+
+def _taxa_of(row):
+    """SQL selecting (key, value) of every rolled-up rank in a row's taxonomy."""
+    return (
+        f"SELECT key, value FROM json_each(CASE WHEN json_valid({row}.taxonomy_json) "
+        f"THEN {row}.taxonomy_json ELSE '{{}}' END) "
+        f"WHERE key IN ({_RANKS_SQL}) AND type = 'text'"
+    )
+
+
+def _add_taxa(row):
+    return f"""
+        INSERT INTO taxonomy_counts
+            (video_filename, taxon_rank, taxon, fish_count, sighting_count, first_seen, last_seen)
+        SELECT {row}.video_filename, key, value, 1, json_array_length({row}.timestamps),
+            json_extract({row}.timestamps, '$[0]'), json_extract({row}.timestamps, '$[#-1]')
+        FROM ({_taxa_of(row)})
+        WHERE {row}.status = 'characterized'
+        ON CONFLICT (video_filename, taxon_rank, taxon) DO UPDATE SET
+            fish_count = fish_count + 1,
+            sighting_count = sighting_count + excluded.sighting_count,
+            first_seen = MIN(first_seen, excluded.first_seen),
+            last_seen = MAX(last_seen, excluded.last_seen);
+    """
+
+
+def _remove_taxa(row):
+    # Only counts are decremented here. A first or last sighting time that the
+    # removed fish may have held is cleared and recomputed from the video's
+    # remaining fish when next read (see _refresh_sighting_times), so bulk
+    # removals never rescan the video once per fish
+    groups = (
+        f"video_filename = {row}.video_filename "
+        f"AND (taxon_rank, taxon) IN ({_taxa_of(row)}) AND {row}.status = 'characterized'"
+    )
+    return f"""
+        UPDATE taxonomy_counts SET
+            fish_count = fish_count - 1,
+            sighting_count = sighting_count - json_array_length({row}.timestamps),
+            first_seen = CASE WHEN first_seen >= json_extract({row}.timestamps, '$[0]')
+                THEN NULL ELSE first_seen END,
+            last_seen = CASE WHEN last_seen <= json_extract({row}.timestamps, '$[#-1]')
+                THEN NULL ELSE last_seen END
+        WHERE {groups};
+        DELETE FROM taxonomy_counts WHERE fish_count <= 0 AND {groups};
+    """
+
+
+def _refresh_sighting_times(cursor, taxon_rank, video_filename=None):
+    """Recomputes the first/last sighting times cleared by _remove_taxa."""
+    same_taxon = (
+        "f.video_filename = taxonomy_counts.video_filename AND f.status = 'characterized' "
+        "AND json_valid(f.taxonomy_json) "
+        "AND json_extract(f.taxonomy_json, '$.' || taxonomy_counts.taxon_rank) = taxonomy_counts.taxon"
+    )
+    query = f"""
+        UPDATE taxonomy_counts SET
+            first_seen = (SELECT MIN(json_extract(f.timestamps, '$[0]'))
+                FROM detected_fish f WHERE {same_taxon}),
+            last_seen = (SELECT MAX(json_extract(f.timestamps, '$[#-1]'))
+                FROM detected_fish f WHERE {same_taxon})
+        WHERE taxon_rank = ? AND sighting_count > 0 AND (first_seen IS NULL OR last_seen IS NULL)
+    """
+    params = [taxon_rank]
+    if video_filename:
+        query += " AND video_filename = ?"
+        params.append(video_filename)
+    cursor.execute(query, params)
+
+
+# Keep taxonomy_counts in step with the characterized rows of detected_fish
+_TAXONOMY_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_taxonomy_insert AFTER INSERT ON detected_fish
+    WHEN NEW.status = 'characterized' AND NEW.taxonomy_json IS NOT NULL
+    BEGIN
+        {_add_taxa("NEW")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_taxonomy_delete AFTER DELETE ON detected_fish
+    WHEN OLD.status = 'characterized' AND OLD.taxonomy_json IS NOT NULL
+    BEGIN
+        {_remove_taxa("OLD")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_taxonomy_update
+    AFTER UPDATE OF status, taxonomy_json, timestamps, video_filename ON detected_fish
+    WHEN (OLD.status = 'characterized' OR NEW.status = 'characterized')
+        AND (OLD.status IS NOT NEW.status OR OLD.taxonomy_json IS NOT NEW.taxonomy_json
+            OR OLD.video_filename IS NOT NEW.video_filename)
+    BEGIN
+        {_remove_taxa("OLD")}
+        {_add_taxa("NEW")}
+    END
+    """,
+    # New sightings of a characterized fish only extend its counts and times
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_taxonomy_sightings
+    AFTER UPDATE OF timestamps ON detected_fish
+    WHEN NEW.status = 'characterized' AND OLD.status IS NEW.status
+        AND OLD.taxonomy_json IS NEW.taxonomy_json AND OLD.video_filename IS NEW.video_filename
+        AND OLD.timestamps IS NOT NEW.timestamps
+    BEGIN
+        UPDATE taxonomy_counts SET
+            sighting_count = sighting_count
+                + json_array_length(NEW.timestamps) - json_array_length(OLD.timestamps),
+            first_seen = MIN(first_seen, json_extract(NEW.timestamps, '$[0]')),
+            last_seen = MAX(last_seen, json_extract(NEW.timestamps, '$[#-1]'))
+        WHERE video_filename = NEW.video_filename AND (taxon_rank, taxon) IN ({_taxa_of("NEW")});
+    END
+    """,
+]
+
+
+# Search index (see search_fish): every distinct taxonomy of characterized fish
+# is one taxonomy_paths row, with its fish in fish_taxonomy. Filters and facets
+# are evaluated over the few thousand paths instead of the fish themselves.
+_PATH_COLUMNS = ", ".join(f'"{rank}"' for rank in TAXONOMY_RANKS)
+
+
+def _path_value(row, rank):
+    """SQL value of a taxonomy_paths column for a row ('' for a missing rank)."""
+    return (
+        f"CASE WHEN json_type({row}.taxonomy_json, '$.{rank}') = 'text' "
+        f"THEN json_extract({row}.taxonomy_json, '$.{rank}') ELSE '' END"
+    )
+
+
+def _path_values(row):
+    return ", ".join(_path_value(row, rank) for rank in TAXONOMY_RANKS)
+
+
+def _path_of(row):
+    return " AND ".join(f'p."{rank}" = {_path_value(row, rank)}' for rank in TAXONOMY_RANKS)
+
+
+def _indexed(row):
+    return f"{row}.status = 'characterized' AND json_valid({row}.taxonomy_json)"
+
+
+def _add_to_search(row):
+    return f"""
+        INSERT OR IGNORE INTO taxonomy_paths ({_PATH_COLUMNS})
+        SELECT {_path_values(row)} WHERE {_indexed(row)};
+        INSERT INTO fish_taxonomy (fish_id, path_id, video_filename)
+        SELECT {row}.id, p.id, {row}.video_filename FROM taxonomy_paths p
+        WHERE {_path_of(row)} AND {_indexed(row)};
+        UPDATE taxonomy_paths SET fish_count = fish_count + 1
+        WHERE id = (SELECT path_id FROM fish_taxonomy WHERE fish_id = {row}.id);
+    """
+
+
+def _remove_from_search(row):
+    return f"""
+        UPDATE taxonomy_paths SET fish_count = fish_count - 1
+        WHERE id = (SELECT path_id FROM fish_taxonomy WHERE fish_id = {row}.id);
+        DELETE FROM fish_taxonomy WHERE fish_id = {row}.id;
+    """
+
+
+_SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_search_insert AFTER INSERT ON detected_fish
+    WHEN {_indexed("NEW")}
+    BEGIN
+        {_add_to_search("NEW")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_search_delete AFTER DELETE ON detected_fish
+    WHEN OLD.status = 'characterized'
+    BEGIN
+        {_remove_from_search("OLD")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_search_update
+    AFTER UPDATE OF status, taxonomy_json, video_filename ON detected_fish
+    WHEN (OLD.status = 'characterized' OR NEW.status = 'characterized')
+        AND (OLD.status IS NOT NEW.status OR OLD.taxonomy_json IS NOT NEW.taxonomy_json
+            OR OLD.video_filename IS NOT NEW.video_filename)
+    BEGIN
+        {_remove_from_search("OLD")}
+        {_add_to_search("NEW")}
+    END
+    """,
+]
+
+# Word-prefix search over the paths; without FTS5 (a compile-time option of
+# SQLite) search_fish falls back to LIKE over the same table
+_PATH_FTS_TRIGGER = f"""
+    CREATE TRIGGER IF NOT EXISTS trg_taxonomy_paths_fts AFTER INSERT ON taxonomy_paths
+    BEGIN
+        INSERT INTO taxonomy_search (rowid, {_PATH_COLUMNS})
+        VALUES (NEW.id, {", ".join(f'NEW."{rank}"' for rank in TAXONOMY_RANKS)});
+    END
+"""
+SEARCH_FTS = True  # Updated by _create_schema()
+
+
+def _backfill_search_index(cursor):
+    """Indexes every characterized fish once."""
+    print("Building the taxonomy search index...")
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO taxonomy_paths ({_PATH_COLUMNS})
+        SELECT {_path_values("f")} FROM detected_fish f WHERE {_indexed("f")}
+    """)
+    cursor.execute(f"""
+        INSERT INTO fish_taxonomy (fish_id, path_id, video_filename)
+        SELECT f.id, p.id, f.video_filename FROM detected_fish f, taxonomy_paths p
+        WHERE {_path_of("f")} AND {_indexed("f")}
+    """)
+    cursor.execute("""
+        UPDATE taxonomy_paths SET fish_count =
+            (SELECT COUNT(*) FROM fish_taxonomy t WHERE t.path_id = taxonomy_paths.id)
+    """)
+
+
+def _backfill_taxonomy_counts(cursor):
+    """Rolls up the taxonomy of every characterized fish once."""
+    print("Computing taxonomy counts...")
+    cursor.execute(f"""
+        INSERT INTO taxonomy_counts
+            (video_filename, taxon_rank, taxon, fish_count, sighting_count, first_seen, last_seen)
+        SELECT f.video_filename, t.key, t.value, COUNT(*), SUM(json_array_length(f.timestamps)),
+            MIN(json_extract(f.timestamps, '$[0]')), MAX(json_extract(f.timestamps, '$[#-1]'))
+        FROM detected_fish f, json_each(CASE WHEN json_valid(f.taxonomy_json)
+            THEN f.taxonomy_json ELSE '{{}}' END) t
+        WHERE f.status = 'characterized' AND t.key IN ({_RANKS_SQL}) AND t.type = 'text'
+        GROUP BY f.video_filename, t.key, t.value
+    """)
+
+
+def _has_fish(cursor):
+    cursor.execute("SELECT 1 FROM detected_fish LIMIT 1")
+    return cursor.fetchone() is not None
+
+
+def _backfill_video_counts(cursor):
+    """Computes the fish counts of the videos table once, from detected_fish."""
+    print("Computing per-video statistics...")
+    cursor.execute(
+        "INSERT OR IGNORE INTO videos (video_filename) SELECT DISTINCT video_filename FROM detected_fish"
+    )
+    cursor.execute("""
+        UPDATE videos SET
+            fish_count = (SELECT COUNT(*) FROM detected_fish f
+                WHERE f.video_filename = videos.video_filename),
+            pending_count = (SELECT COUNT(*) FROM detected_fish f
+                WHERE f.video_filename = videos.video_filename AND f.status = 'pending_characterization'),
+            characterizing_count = (SELECT COUNT(*) FROM detected_fish f
+                WHERE f.video_filename = videos.video_filename AND f.status = 'characterizing'),
+            characterized_count = (SELECT COUNT(*) FROM detected_fish f
+                WHERE f.video_filename = videos.video_filename AND f.status = 'characterized'),
+            error_count = (SELECT COUNT(*) FROM detected_fish f
+                WHERE f.video_filename = videos.video_filename AND f.status = 'error')
+    """)
+
+
+def _create_schema():
+    # Ensure the directory for storing images exists
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+
+    conn = _connect()
     cursor = conn.cursor()
 
     # Check if the table exists first
@@ -38,7 +404,8 @@ def init_db():
                 perceptual_hash TEXT NOT NULL,
                 status TEXT NOT NULL DEFAULT 'pending_characterization', -- pending_characterization, characterizing, characterized, error
                 taxonomy_json TEXT,
-                first_detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                first_detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                identity_id INTEGER -- fish_identities row when the global identity index is on
             )
         """)
         # Add an index for faster hash lookups
@@ -64,6 +431,13 @@ def init_db():
             conn.commit()
             print("Column added successfully")
 
+        try:
+            cursor.execute("SELECT identity_id FROM detected_fish LIMIT 1")
+        except sqlite3.OperationalError:
+            print("Adding identity_id column to existing database...")
+            cursor.execute("ALTER TABLE detected_fish ADD COLUMN identity_id INTEGER")
+            conn.commit()
+
         # Make sure indexes exist
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_perceptual_hash ON detected_fish (perceptual_hash);
@@ -73,6 +447,217 @@ def init_db():
         """)
         conn.commit()
 
+    # Byte-range index for crops stored in per-video pack files (see crop_store.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS crop_pack_index (
+            image_filename TEXT PRIMARY KEY,
+            pack_filename TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_crop_pack_filename ON crop_pack_index (pack_filename);
+    """)
+    conn.commit()
+
+    # Per-video detection checkpoints used to resume interrupted jobs
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS detection_checkpoints (
+            video_filename TEXT PRIMARY KEY,
+            last_timestamp_sec REAL NOT NULL,
+            frame_count INTEGER NOT NULL,
+            processed_frame_count INTEGER NOT NULL,
+            detected_count INTEGER NOT NULL,
+            dedup_state TEXT, -- JSON summary of the per-video dedup index
+            config_json TEXT NOT NULL, -- JSON of the detection settings used
+            completed INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+    # Registry of videos, keyed by filename and looked up by content fingerprint.
+    # Rows are also created for every video that gets fish (e.g. stream
+    # segments), and the per-status fish counts are kept up to date by the
+    # triggers below, so listing and summarizing videos never scans detected_fish
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS videos (
+            video_filename TEXT PRIMARY KEY,
+            fingerprint TEXT,
+            size_bytes INTEGER,
+            frame_signature TEXT, -- optional ':'-joined pHashes of sampled frames
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("PRAGMA table_info(videos)")
+    video_columns = {row["name"] for row in cursor.fetchall()}
+    counts_missing = "fish_count" not in video_columns
+    for column, definition in _VIDEO_STATS_COLUMNS:
+        if column not in video_columns:
+            cursor.execute(f"ALTER TABLE videos ADD COLUMN {column} {definition}")
+    if counts_missing and _has_fish(cursor):
+        _backfill_video_counts(cursor)
+    for trigger in _VIDEO_COUNT_TRIGGERS:
+        cursor.execute(trigger)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_videos_fingerprint ON videos (fingerprint);
+    """)
+    # Other upload names of a video that was recognised as a duplicate
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS video_aliases (
+            alias_filename TEXT PRIMARY KEY,
+            video_filename TEXT NOT NULL,
+            linked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Fish counts per taxon (rank and value of the LLM taxonomy) and video,
+    # maintained by triggers whenever fish are characterized, re-sighted or deleted
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='taxonomy_counts'"
+    )
+    taxonomy_counts_exist = cursor.fetchone()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS taxonomy_counts (
+            video_filename TEXT NOT NULL,
+            taxon_rank TEXT NOT NULL, -- Kingdom ... Species
+            taxon TEXT NOT NULL,
+            fish_count INTEGER NOT NULL, -- Unique fish entries
+            sighting_count INTEGER NOT NULL, -- Timestamps of those fish
+            first_seen TEXT, -- HH:MM:SS.mmm into the video (NULL until recomputed
+            last_seen TEXT, -- after a removal, see _refresh_sighting_times)
+            PRIMARY KEY (video_filename, taxon_rank, taxon)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_taxonomy_counts_taxon
+        ON taxonomy_counts (taxon_rank, taxon, fish_count, sighting_count);
+    """)
+    if not taxonomy_counts_exist and _has_fish(cursor):
+        _backfill_taxonomy_counts(cursor)
+    # Databases created before the removal triggers only decremented counts
+    # still have the old ones
+    for trigger in ("trg_taxonomy_delete", "trg_taxonomy_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for trigger in _TAXONOMY_TRIGGERS:
+        cursor.execute(trigger)
+    conn.commit()
+
+    # Search index of the characterized fish (see search_fish)
+    global SEARCH_FTS
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='taxonomy_paths'"
+    )
+    search_index_exists = cursor.fetchone()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS taxonomy_paths (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            {", ".join(f'"{rank}" TEXT NOT NULL' for rank in TAXONOMY_RANKS)},
+            fish_count INTEGER NOT NULL DEFAULT 0, -- Characterized fish with this taxonomy
+            UNIQUE ({_PATH_COLUMNS})
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fish_taxonomy (
+            fish_id INTEGER PRIMARY KEY, -- detected_fish.id
+            path_id INTEGER NOT NULL,
+            video_filename TEXT NOT NULL
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_fish_taxonomy_path ON fish_taxonomy (path_id, fish_id)"
+    )
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_fish_taxonomy_video
+        ON fish_taxonomy (video_filename, path_id, fish_id)
+    """)
+    try:
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS taxonomy_search USING fts5 (
+                {_PATH_COLUMNS}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            )
+        """)
+        cursor.execute(_PATH_FTS_TRIGGER)
+    except sqlite3.OperationalError:
+        SEARCH_FTS = False
+    if not search_index_exists and _has_fish(cursor):
+        _backfill_search_index(cursor)
+    for trigger in _SEARCH_TRIGGERS:
+        cursor.execute(trigger)
+    conn.commit()
+
+    # Fish identities shared by all videos (see identity_index.py). Each
+    # detected_fish row linked to one is a sighting in that row's video.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fish_identities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            perceptual_hash TEXT NOT NULL,
+            embedding BLOB NOT NULL, -- float32 colour embedding of the first crop
+            representative_fish_id INTEGER, -- the fish sent for characterization
+            status TEXT NOT NULL DEFAULT 'pending_characterization', -- pending_characterization, characterized, error
+            taxonomy_json TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_identity_id ON detected_fish (identity_id);
+    """)
+    # Chunked uploads in progress; the bytes received so far are the size of
+    # the partial file on disk
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS uploads (
+            upload_id TEXT PRIMARY KEY,
+            video_filename TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            options_json TEXT,
+            status TEXT NOT NULL DEFAULT 'uploading',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Job and progress state shared by every app process (see job_state.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_state (
+            key TEXT PRIMARY KEY,
+            value_json TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            updated_at REAL NOT NULL
+        )
+    """)
+    # Change log of commands (stop, bump, ...) for the process running the job
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            target TEXT NOT NULL, -- process ID of the job owner
+            command TEXT NOT NULL,
+            args_json TEXT,
+            created_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_job_commands_target ON job_commands (target, id);
+    """)
+    # Offline re-characterization and re-clustering jobs (see reprocess.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reprocess_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL, -- characterize, recluster
+            selection_json TEXT NOT NULL, -- which fish (see select_fish)
+            options_json TEXT,
+            status TEXT NOT NULL DEFAULT 'queued', -- queued, running, paused, finished, error
+            last_id INTEGER NOT NULL DEFAULT 0, -- characterize: last fish ID of the last finished batch
+            last_video TEXT, -- recluster: last finished video
+            stats_json TEXT,
+            owner TEXT, -- process running the job
+            heartbeat REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    conn.commit()
+
     conn.close()
 
 
@@ -82,11 +667,12 @@ def add_or_update_fish(image_filename, video_filename, timestamp_str, p_hash):
     cursor = conn.cursor()
 
     # Check for existing fish with the same hash (or very similar if needed) from the same video
-    cursor.execute(
-        "SELECT id, timestamps FROM detected_fish WHERE perceptual_hash = ? AND video_filename = ?",
-        (p_hash, video_filename),
-    )
-    existing = cursor.fetchone()
+    with span("db_lookup"):
+        cursor.execute(
+            "SELECT id, timestamps FROM detected_fish WHERE perceptual_hash = ? AND video_filename = ?",
+            (p_hash, video_filename),
+        )
+        existing = cursor.fetchone()
 
     new_entry_id = None
     updated_existing = False
@@ -99,11 +685,13 @@ def add_or_update_fish(image_filename, video_filename, timestamp_str, p_hash):
         ):  # Avoid duplicate timestamps for the same fish
             timestamps.append(timestamp_str)
             timestamps.sort()  # Keep them ordered
-            cursor.execute(
-                "UPDATE detected_fish SET timestamps = ? WHERE id = ?",
-                (json.dumps(timestamps), existing_id),
-            )
-            conn.commit()
+            with span("db_write"):
+                cursor.execute(
+                    "UPDATE detected_fish SET timestamps = ? WHERE id = ?",
+                    (json.dumps(timestamps), existing_id),
+                )
+                conn.commit()
+            increment("fish_db_writes_total", operation="update_timestamps")
         updated_existing = True
         print(
             f"Updated timestamps for existing fish ID {existing_id} with hash {p_hash} from {video_filename}"
@@ -111,20 +699,22 @@ def add_or_update_fish(image_filename, video_filename, timestamp_str, p_hash):
     else:
         timestamps = json.dumps([timestamp_str])
         try:
-            cursor.execute(
-                """
-                INSERT INTO detected_fish (image_filename, video_filename, timestamps, perceptual_hash, status)
-                VALUES (?, ?, ?, ?, ?)
-            """,
-                (
-                    image_filename,
-                    video_filename,
-                    timestamps,
-                    p_hash,
-                    "pending_characterization",
-                ),
-            )
-            conn.commit()
+            with span("db_write"):
+                cursor.execute(
+                    """
+                    INSERT INTO detected_fish (image_filename, video_filename, timestamps, perceptual_hash, status)
+                    VALUES (?, ?, ?, ?, ?)
+                """,
+                    (
+                        image_filename,
+                        video_filename,
+                        timestamps,
+                        p_hash,
+                        "pending_characterization",
+                    ),
+                )
+                conn.commit()
+            increment("fish_db_writes_total", operation="insert_fish")
             new_entry_id = cursor.lastrowid
             print(
                 f"Added new fish ID {new_entry_id} with hash {p_hash} from {video_filename}"
@@ -141,12 +731,29 @@ def add_or_update_fish(image_filename, video_filename, timestamp_str, p_hash):
     return new_entry_id if not updated_existing else None
 
 
-def get_pending_fish():
+def get_pending_fish(video_filename=None):
+    """
+    Fish waiting for characterization. Fish whose global identity is being
+    characterized through another fish are left out; they get the result of
+    that fish (unless it is gone).
+    """
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, image_filename FROM detected_fish WHERE status = 'pending_characterization'"
-    )
+    query = """
+        SELECT f.id, f.image_filename, f.video_filename FROM detected_fish f
+        LEFT JOIN fish_identities i ON i.id = f.identity_id
+        WHERE f.status = 'pending_characterization'
+        AND (
+            i.id IS NULL
+            OR i.status != 'pending_characterization'
+            OR i.representative_fish_id = f.id
+            OR NOT EXISTS (SELECT 1 FROM detected_fish r WHERE r.id = i.representative_fish_id)
+        )
+    """
+    if video_filename:
+        cursor.execute(query + " AND f.video_filename = ?", (video_filename,))
+    else:
+        cursor.execute(query)
     pending = cursor.fetchall()
     conn.close()
     return pending
@@ -155,17 +762,48 @@ def get_pending_fish():
 def update_fish_status(fish_id, status, taxonomy_json=None):
     conn = get_db()
     cursor = conn.cursor()
-    if taxonomy_json:
+    with span("db_status_update"):
+        if taxonomy_json:
+            cursor.execute(
+                "UPDATE detected_fish SET status = ?, taxonomy_json = ? WHERE id = ?",
+                (status, taxonomy_json, fish_id),
+            )
+        else:
+            cursor.execute(
+                "UPDATE detected_fish SET status = ? WHERE id = ?", (status, fish_id)
+            )
+        if status in ("characterized", "error"):
+            _update_identity_status(cursor, fish_id, status, taxonomy_json)
+        conn.commit()
+    increment("fish_db_writes_total", operation="update_status")
+    conn.close()
+
+
+def _update_identity_status(cursor, fish_id, status, taxonomy_json):
+    """Passes the characterization result of a fish on to its global identity."""
+    cursor.execute("SELECT identity_id FROM detected_fish WHERE id = ?", (fish_id,))
+    row = cursor.fetchone()
+    if not row or row["identity_id"] is None:
+        return
+    identity_id = row["identity_id"]
+    if status == "characterized" and taxonomy_json:
         cursor.execute(
-            "UPDATE detected_fish SET status = ?, taxonomy_json = ? WHERE id = ?",
-            (status, taxonomy_json, fish_id),
+            "UPDATE fish_identities SET status = ?, taxonomy_json = ? WHERE id = ?",
+            (status, taxonomy_json, identity_id),
         )
-    else:
+        # Sightings that were waiting for this result
         cursor.execute(
-            "UPDATE detected_fish SET status = ? WHERE id = ?", (status, fish_id)
+            "UPDATE detected_fish SET status = ?, taxonomy_json = ? "
+            "WHERE identity_id = ? AND status = 'pending_characterization'",
+            (status, taxonomy_json, identity_id),
+        )
+    elif status == "error":
+        # The next sighting of the identity is characterized instead
+        cursor.execute(
+            "UPDATE fish_identities SET status = 'error' "
+            "WHERE id = ? AND representative_fish_id = ? AND status != 'characterized'",
+            (identity_id, fish_id),
         )
-    conn.commit()
-    conn.close()
 
 
 def get_all_fish_data(video_filename=None):
@@ -175,14 +813,14 @@ def get_all_fish_data(video_filename=None):
 
     if video_filename:
         cursor.execute(
-            "SELECT id, image_filename, video_filename, timestamps, status, taxonomy_json FROM detected_fish "
-            "WHERE video_filename = ? ORDER BY first_detected_at DESC",
+            "SELECT id, image_filename, video_filename, timestamps, status, taxonomy_json, identity_id "
+            "FROM detected_fish WHERE video_filename = ? ORDER BY first_detected_at DESC",
             (video_filename,),
         )
     else:
         cursor.execute(
-            "SELECT id, image_filename, video_filename, timestamps, status, taxonomy_json FROM detected_fish "
-            "ORDER BY first_detected_at DESC"
+            "SELECT id, image_filename, video_filename, timestamps, status, taxonomy_json, identity_id "
+            "FROM detected_fish ORDER BY first_detected_at DESC"
         )
 
     results = cursor.fetchall()
@@ -192,17 +830,122 @@ def get_all_fish_data(video_filename=None):
 
 
 def get_processed_videos():
-    """Get a list of all processed video filenames."""
+    """Get a list of all processed video filenames (videos with fish)."""
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
-        "SELECT DISTINCT video_filename FROM detected_fish ORDER BY video_filename"
+        "SELECT video_filename FROM videos WHERE fish_count > 0 ORDER BY video_filename"
     )
     results = cursor.fetchall()
     conn.close()
     return [row["video_filename"] for row in results]
 
 
+# Status of detected_fish -> its count column in the videos table
+_STATUS_COUNT_COLUMNS = {
+    "pending_characterization": "pending_count",
+    "characterizing": "characterizing_count",
+    "characterized": "characterized_count",
+    "error": "error_count",
+}
+
+
+def get_status_counts(video_filenames=None):
+    """Number of fish per status, optionally restricted to some videos."""
+    conn = get_db()
+    cursor = conn.cursor()
+    query = "SELECT " + ", ".join(
+        f"COALESCE(SUM({column}), 0) AS {column}" for column in _STATUS_COUNT_COLUMNS.values()
+    ) + " FROM videos"
+    params = ()
+    if video_filenames is not None:
+        params = tuple(video_filenames)
+        if not params:
+            conn.close()
+            return {}
+        query += f" WHERE video_filename IN ({', '.join('?' * len(params))})"
+    cursor.execute(query, params)
+    result = cursor.fetchone()
+    conn.close()
+    return {
+        status: result[column]
+        for status, column in _STATUS_COUNT_COLUMNS.items()
+        if result[column]
+    }
+
+
+def get_video_summary(video_filename):
+    """
+    Statistics of one video from the videos table: fish counts by status,
+    duration, sampling settings and processing timings. None if unknown.
+    """
+    video = get_video(video_filename)
+    if not video:
+        return None
+    config = json.loads(video.pop("config_json") or "null")
+    summary = {
+        "video_filename": video["video_filename"],
+        "fingerprint": video["fingerprint"],
+        "size_bytes": video["size_bytes"],
+        "uploaded_at": video["uploaded_at"],
+        "duration_sec": video["duration_sec"],
+        "fps": video["fps"],
+        "config": config,
+        "fish_count": video["fish_count"],
+        "status_counts": {
+            status: video[column] for status, column in _STATUS_COUNT_COLUMNS.items()
+        },
+        "detection_started_at": video["detection_started_at"],
+        "detection_finished_at": video["detection_finished_at"],
+        "detection_seconds": video["detection_seconds"],
+        "last_characterized_at": video["last_characterized_at"],
+    }
+    return summary
+
+
+def record_detection_start(video_filename, duration_sec, fps, config, resumed=False):
+    """
+    Records the video metadata and settings of a detection run. A run that
+    does not resume an earlier one restarts the detection timing.
+    """
+    conn = get_db()
+    conn.execute(
+        "INSERT OR IGNORE INTO videos (video_filename) VALUES (?)", (video_filename,)
+    )
+    conn.execute(
+        """
+        UPDATE videos SET
+            duration_sec = COALESCE(?, duration_sec),
+            fps = COALESCE(?, fps),
+            config_json = ?,
+            detection_started_at = CASE WHEN ? OR detection_started_at IS NULL
+                THEN CURRENT_TIMESTAMP ELSE detection_started_at END,
+            detection_seconds = CASE WHEN ? THEN detection_seconds ELSE 0 END,
+            detection_finished_at = NULL
+        WHERE video_filename = ?
+    """,
+        (duration_sec, fps, json.dumps(config), not resumed, resumed, video_filename),
+    )
+    conn.commit()
+    conn.close()
+
+
+def record_detection_end(video_filename, seconds, completed):
+    """Adds the time of a detection run; a completed run also sets the finish time."""
+    conn = get_db()
+    conn.execute(
+        """
+        UPDATE videos SET
+            detection_seconds = detection_seconds + ?,
+            detection_finished_at = CASE WHEN ? THEN CURRENT_TIMESTAMP ELSE NULL END
+        WHERE video_filename = ?
+    """,
+        (seconds, completed, video_filename),
+    )
+    conn.commit()
+    conn.close()
+
+
 def delete_fish_entry(fish_id):
     """Delete a specific fish entry by ID."""
     conn = get_db()
@@ -227,5 +970,1049 @@ def delete_fish_entry(fish_id):
     return None
 
 
-# Initialize the database on module load
-init_db()
+def delete_fish_bulk(
+    video_filename=None, statuses=None, fish_ids=None, purge_pack_filename=None
+):
+    """
+    Deletes every fish entry matching all of the given filters in a single
+    transaction and returns (ids, image_filenames) of the deleted entries.
+
+    Args:
+        video_filename: Only delete fish of this video
+        statuses: Only delete fish with one of these statuses
+        fish_ids: Only delete fish with one of these IDs
+        purge_pack_filename: Drop the whole pack index of this pack file
+            instead of flagging the deleted crops (used when purging a video)
+    """
+    conditions = []
+    params = []
+    if video_filename is not None:
+        conditions.append("video_filename = ?")
+        params.append(video_filename)
+    if statuses:
+        conditions.append("status IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(statuses)))
+    if fish_ids is not None:
+        conditions.append("id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps([int(fish_id) for fish_id in fish_ids]))
+    if not conditions:
+        raise ValueError("At least one filter is required for a bulk delete")
+    where = " AND ".join(conditions)
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            f"SELECT id, image_filename FROM detected_fish WHERE {where}", params
+        )
+        rows = cursor.fetchall()
+        ids = [row["id"] for row in rows]
+        image_filenames = [row["image_filename"] for row in rows]
+
+        if ids:
+            cursor.execute(
+                "DELETE FROM detected_fish WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(ids),),
+            )
+        if purge_pack_filename:
+            cursor.execute(
+                "DELETE FROM crop_pack_index WHERE pack_filename = ?",
+                (purge_pack_filename,),
+            )
+        elif image_filenames:
+            cursor.execute(
+                "UPDATE crop_pack_index SET deleted = 1 "
+                "WHERE image_filename IN (SELECT value FROM json_each(?))",
+                (json.dumps(image_filenames),),
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return ids, image_filenames
+
+
+def add_pack_entry(image_filename, pack_filename, offset, length):
+    """Records where a packed crop lives inside its pack file."""
+    conn = get_db()
+    conn.execute(
+        "INSERT OR REPLACE INTO crop_pack_index (image_filename, pack_filename, offset, length, deleted) "
+        "VALUES (?, ?, ?, ?, 0)",
+        (image_filename, pack_filename, offset, length),
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_pack_entry(image_filename):
+    """Returns the pack index row for a crop, or None if it is not packed."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT image_filename, pack_filename, offset, length, deleted FROM crop_pack_index "
+        "WHERE image_filename = ?",
+        (image_filename,),
+    )
+    result = cursor.fetchone()
+    conn.close()
+    return dict(result) if result else None
+
+
+def mark_pack_entry_deleted(image_filename):
+    """Flags a packed crop as deleted; its bytes are reclaimed by compaction."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE crop_pack_index SET deleted = 1 WHERE image_filename = ?",
+        (image_filename,),
+    )
+    conn.commit()
+    updated = cursor.rowcount > 0
+    conn.close()
+    return updated
+
+
+def get_packed_crops(image_filenames):
+    """The crops among `image_filenames` that have a pack index entry (deleted or not)."""
+    if not image_filenames:
+        return set()
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT image_filename FROM crop_pack_index "
+        "WHERE image_filename IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(image_filenames)),),
+    )
+    results = cursor.fetchall()
+    conn.close()
+    return {row["image_filename"] for row in results}
+
+
+def get_pack_filenames():
+    """Get a list of all pack files referenced by the pack index."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT DISTINCT pack_filename FROM crop_pack_index ORDER BY pack_filename"
+    )
+    results = cursor.fetchall()
+    conn.close()
+    return [row["pack_filename"] for row in results]
+
+
+def get_live_pack_entries(pack_filename):
+    """
+    Gets the entries of a pack that are still worth keeping: not deleted and
+    still referenced by a detected_fish row, ordered by their position in the pack.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT p.image_filename, p.offset, p.length FROM crop_pack_index p "
+        "JOIN detected_fish f ON f.image_filename = p.image_filename "
+        "WHERE p.pack_filename = ? AND p.deleted = 0 ORDER BY p.offset",
+        (pack_filename,),
+    )
+    results = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in results]
+
+
+def replace_pack_entries(pack_filename, entries, before_commit=None):
+    """
+    Replaces the whole index of a pack after compaction.
+    `entries` is a list of (image_filename, offset, length) tuples.
+    `before_commit` is called inside the transaction (e.g. to swap in the
+    compacted pack file) so the index and the file change together.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM crop_pack_index WHERE pack_filename = ?", (pack_filename,)
+    )
+    cursor.executemany(
+        "INSERT INTO crop_pack_index (image_filename, pack_filename, offset, length, deleted) "
+        "VALUES (?, ?, ?, ?, 0)",
+        [(name, pack_filename, offset, length) for name, offset, length in entries],
+    )
+    if before_commit:
+        try:
+            before_commit()
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+    conn.commit()
+    conn.close()
+
+
+
+def save_detection_checkpoint(
+    video_filename,
+    last_timestamp_sec,
+    frame_count,
+    processed_frame_count,
+    detected_count,
+    config,
+    completed=False,
+):
+    """Stores (or replaces) the detection checkpoint of a video."""
+    conn = get_db()
+    cursor = conn.cursor()
+
+    # Summarise the dedup index so a resumed run can tell what it continues from.
+    # The index itself is the per-video perceptual_hash rows already in the table.
+    cursor.execute(
+        "SELECT COUNT(*) AS unique_hashes FROM detected_fish WHERE video_filename = ?",
+        (video_filename,),
+    )
+    dedup_state = {"unique_hashes": cursor.fetchone()["unique_hashes"]}
+
+    cursor.execute(
+        """
+        INSERT OR REPLACE INTO detection_checkpoints
+            (video_filename, last_timestamp_sec, frame_count, processed_frame_count,
+             detected_count, dedup_state, config_json, completed, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """,
+        (
+            video_filename,
+            last_timestamp_sec,
+            frame_count,
+            processed_frame_count,
+            detected_count,
+            json.dumps(dedup_state),
+            json.dumps(config),
+            int(completed),
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_detection_checkpoint(video_filename):
+    """Returns the detection checkpoint of a video as a dict, or None."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT * FROM detection_checkpoints WHERE video_filename = ?",
+        (video_filename,),
+    )
+    result = cursor.fetchone()
+    conn.close()
+    if not result:
+        return None
+    checkpoint = dict(result)
+    checkpoint["dedup_state"] = json.loads(checkpoint["dedup_state"] or "{}")
+    checkpoint["config"] = json.loads(checkpoint.pop("config_json"))
+    checkpoint["completed"] = bool(checkpoint["completed"])
+    return checkpoint
+
+
+def delete_video_fish(video_filename):
+    """Deletes every fish entry of a video; returns their image filenames."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT image_filename FROM detected_fish WHERE video_filename = ?",
+        (video_filename,),
+    )
+    image_filenames = [row["image_filename"] for row in cursor.fetchall()]
+    cursor.execute(
+        "DELETE FROM detected_fish WHERE video_filename = ?", (video_filename,)
+    )
+    conn.commit()
+    conn.close()
+    return image_filenames
+
+
+def get_video_taxonomies(video_filename):
+    """Taxonomy JSON of the characterized fish of a video, by perceptual hash."""
+    conn = get_db()
+    rows = conn.execute(
+        "SELECT perceptual_hash, taxonomy_json FROM detected_fish "
+        "WHERE video_filename = ? AND status = 'characterized' AND taxonomy_json IS NOT NULL",
+        (video_filename,),
+    ).fetchall()
+    conn.close()
+    return {row["perceptual_hash"]: row["taxonomy_json"] for row in rows}
+
+
+def register_video(video_filename, fingerprint, size_bytes, frame_signature=None):
+    """Adds a video to the registry (or refreshes its fingerprint)."""
+    conn = get_db()
+    conn.execute(
+        """
+        INSERT INTO videos (video_filename, fingerprint, size_bytes, frame_signature)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(video_filename) DO UPDATE SET
+            fingerprint = excluded.fingerprint,
+            size_bytes = excluded.size_bytes,
+            frame_signature = COALESCE(excluded.frame_signature, videos.frame_signature)
+    """,
+        (video_filename, fingerprint, size_bytes, frame_signature),
+    )
+    # A real upload under this name replaces any earlier alias
+    conn.execute(
+        "DELETE FROM video_aliases WHERE alias_filename = ?", (video_filename,)
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_video(video_filename):
+    """Returns the registry row of a video as a dict, or None."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM videos WHERE video_filename = ?", (video_filename,))
+    result = cursor.fetchone()
+    conn.close()
+    return dict(result) if result else None
+
+
+def find_video_by_fingerprint(fingerprint):
+    """Returns the filename of a registered video with this fingerprint, or None."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT video_filename FROM videos WHERE fingerprint = ? ORDER BY uploaded_at LIMIT 1",
+        (fingerprint,),
+    )
+    result = cursor.fetchone()
+    conn.close()
+    return result["video_filename"] if result else None
+
+
+def get_video_signatures():
+    """Returns (video_filename, frame_signature) for videos that have a signature."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT video_filename, frame_signature FROM videos WHERE frame_signature IS NOT NULL"
+    )
+    results = cursor.fetchall()
+    conn.close()
+    return [(row["video_filename"], row["frame_signature"]) for row in results]
+
+
+def link_video_alias(alias_filename, video_filename):
+    """Records that `alias_filename` is a re-upload of `video_filename`."""
+    conn = get_db()
+    conn.execute(
+        "INSERT OR REPLACE INTO video_aliases (alias_filename, video_filename) VALUES (?, ?)",
+        (alias_filename, video_filename),
+    )
+    conn.commit()
+    conn.close()
+
+
+def resolve_video_alias(video_filename):
+    """Maps a duplicate upload name to the video holding its results."""
+    if not video_filename:
+        return video_filename
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT video_filename FROM video_aliases WHERE alias_filename = ?",
+        (video_filename,),
+    )
+    result = cursor.fetchone()
+    conn.close()
+    return result["video_filename"] if result else video_filename
+
+
+def delete_detection_checkpoint(video_filename):
+    """Forgets the detection checkpoint of a video."""
+    conn = get_db()
+    conn.execute(
+        "DELETE FROM detection_checkpoints WHERE video_filename = ?", (video_filename,)
+    )
+    conn.commit()
+    conn.close()
+
+
+def create_upload(upload_id, video_filename, size_bytes, options):
+    """Records a new chunked upload."""
+    conn = get_db()
+    conn.execute(
+        """
+        INSERT INTO uploads (upload_id, video_filename, size_bytes, options_json)
+        VALUES (?, ?, ?, ?)
+    """,
+        (upload_id, video_filename, size_bytes, json.dumps(options)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _upload_from_row(row):
+    if not row:
+        return None
+    upload = dict(row)
+    upload["options"] = json.loads(upload.pop("options_json") or "{}")
+    return upload
+
+
+def get_upload(upload_id):
+    """Returns a chunked upload as a dict (with parsed options), or None."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM uploads WHERE upload_id = ?", (upload_id,))
+    result = cursor.fetchone()
+    conn.close()
+    return _upload_from_row(result)
+
+
+def find_unfinished_upload(video_filename, size_bytes):
+    """Returns the newest unfinished upload of the same file, or None."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT * FROM uploads
+        WHERE video_filename = ? AND size_bytes = ? AND status != 'complete'
+        ORDER BY created_at DESC LIMIT 1
+    """,
+        (video_filename, size_bytes),
+    )
+    result = cursor.fetchone()
+    conn.close()
+    return _upload_from_row(result)
+
+
+def set_upload_status(upload_id, status):
+    """Updates the status of a chunked upload ('uploading', 'detecting' or 'complete')."""
+    conn = get_db()
+    conn.execute(
+        "UPDATE uploads SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE upload_id = ?",
+        (status, upload_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def create_identity(fish_id, p_hash, embedding):
+    """Creates a global identity represented by a new fish; returns its ID."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO fish_identities (perceptual_hash, embedding, representative_fish_id) "
+        "VALUES (?, ?, ?)",
+        (p_hash, embedding, fish_id),
+    )
+    identity_id = cursor.lastrowid
+    cursor.execute(
+        "UPDATE detected_fish SET identity_id = ? WHERE id = ?", (identity_id, fish_id)
+    )
+    conn.commit()
+    conn.close()
+    return identity_id
+
+
+def link_fish_to_identity(fish_id, identity_id):
+    """
+    Records a fish as a sighting of an existing identity. Returns True if the
+    fish has to be characterized itself: the identity's earlier
+    characterization failed or its representative fish was deleted.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    # Take the write lock first so that concurrent detection processes see a
+    # consistent identity status
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        """
+        SELECT i.status, i.taxonomy_json,
+            EXISTS (SELECT 1 FROM detected_fish r WHERE r.id = i.representative_fish_id)
+                AS has_representative
+        FROM fish_identities i WHERE i.id = ?
+    """,
+        (identity_id,),
+    )
+    identity = cursor.fetchone()
+    needs_characterization = False
+    if identity["status"] == "characterized":
+        cursor.execute(
+            "UPDATE detected_fish SET identity_id = ?, status = 'characterized', taxonomy_json = ? "
+            "WHERE id = ?",
+            (identity_id, identity["taxonomy_json"], fish_id),
+        )
+    elif identity["status"] == "pending_characterization" and identity["has_representative"]:
+        cursor.execute(
+            "UPDATE detected_fish SET identity_id = ? WHERE id = ?", (identity_id, fish_id)
+        )
+    else:
+        cursor.execute(
+            "UPDATE fish_identities SET representative_fish_id = ?, "
+            "status = 'pending_characterization' WHERE id = ?",
+            (fish_id, identity_id),
+        )
+        cursor.execute(
+            "UPDATE detected_fish SET identity_id = ? WHERE id = ?", (identity_id, fish_id)
+        )
+        needs_characterization = True
+    conn.commit()
+    conn.close()
+    return needs_characterization
+
+
+def get_identities_since(last_id):
+    """Identities created after `last_id`, for updating the in-memory index."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, perceptual_hash, embedding FROM fish_identities WHERE id > ? ORDER BY id",
+        (last_id,),
+    )
+    results = cursor.fetchall()
+    conn.close()
+    return results
+
+
+def get_identities():
+    """Every global identity with its number of sightings and videos."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT i.id, i.status, i.taxonomy_json, i.representative_fish_id, i.created_at,
+            COUNT(f.id) AS sightings, COUNT(DISTINCT f.video_filename) AS videos
+        FROM fish_identities i
+        LEFT JOIN detected_fish f ON f.identity_id = i.id
+        GROUP BY i.id
+        ORDER BY videos DESC, sightings DESC, i.id
+    """)
+    results = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in results]
+
+
+def get_identity_sightings(identity_id):
+    """The fish entries (one per video and hash) linked to a global identity."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, image_filename, video_filename, timestamps, status FROM detected_fish "
+        "WHERE identity_id = ? ORDER BY video_filename, first_detected_at",
+        (identity_id,),
+    )
+    results = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in results]
+
+
+def get_taxonomy_counts(taxon_rank, video_filename=None, by_video=False):
+    """
+    Fish per taxon of one rank, from the taxonomy_counts rollup.
+
+    Args:
+        taxon_rank: One of TAXONOMY_RANKS
+        video_filename: Only count the fish of this video
+        by_video: One row per video and taxon (with first/last sighting times)
+            instead of totals over all videos
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    if video_filename or by_video:
+        _refresh_sighting_times(cursor, taxon_rank, video_filename)
+        conn.commit()
+        query = (
+            "SELECT video_filename, taxon, fish_count, sighting_count, first_seen, last_seen "
+            "FROM taxonomy_counts WHERE taxon_rank = ?"
+        )
+        params = [taxon_rank]
+        if video_filename:
+            query += " AND video_filename = ?"
+            params.append(video_filename)
+        cursor.execute(query + " ORDER BY video_filename, fish_count DESC, taxon", params)
+    else:
+        cursor.execute(
+            """
+            SELECT taxon, SUM(fish_count) AS fish_count, SUM(sighting_count) AS sighting_count,
+                COUNT(*) AS video_count
+            FROM taxonomy_counts WHERE taxon_rank = ?
+            GROUP BY taxon ORDER BY fish_count DESC, taxon
+        """,
+            (taxon_rank,),
+        )
+    results = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in results]
+
+
+def get_job_state(key):
+    """Returns the shared state stored under `key`, or None."""
+    conn = get_db()
+    row = conn.execute(
+        "SELECT value_json FROM job_state WHERE key = ?", (key,)
+    ).fetchone()
+    conn.close()
+    return json.loads(row["value_json"]) if row else None
+
+
+def set_job_state(key, value):
+    """Replaces the shared state stored under `key`."""
+    conn = get_db()
+    conn.execute(
+        """
+        INSERT INTO job_state (key, value_json, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET
+            value_json = excluded.value_json,
+            version = version + 1,
+            updated_at = excluded.updated_at
+        """,
+        (key, json.dumps(value), time.time()),
+    )
+    conn.commit()
+    conn.close()
+
+
+@contextmanager
+def edit_job_state(key, default):
+    """
+    Read-modify-write of the shared state under `key`: yields its value (or a
+    copy of `default`) and stores it when the block exits without an error.
+    The write lock is held for the whole block, so keep it short and never
+    nest edits.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        row = cursor.execute(
+            "SELECT value_json FROM job_state WHERE key = ?", (key,)
+        ).fetchone()
+        value = json.loads(row["value_json"] if row else json.dumps(default))
+        yield value
+        cursor.execute(
+            """
+            INSERT INTO job_state (key, value_json, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value_json = excluded.value_json,
+                version = version + 1,
+                updated_at = excluded.updated_at
+            """,
+            (key, json.dumps(value), time.time()),
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def add_job_command(target, command, args=None, max_age=3600):
+    """
+    Queues a command for the process `target`. Commands older than `max_age`
+    seconds (e.g. for a process that has exited) are dropped.
+    """
+    now = time.time()
+    conn = get_db()
+    conn.execute("DELETE FROM job_commands WHERE created_at < ?", (now - max_age,))
+    conn.execute(
+        "INSERT INTO job_commands (target, command, args_json, created_at) VALUES (?, ?, ?, ?)",
+        (target, command, json.dumps(args or {}), now),
+    )
+    conn.commit()
+    conn.close()
+
+
+def take_job_commands(target):
+    """Removes and returns the queued commands of `target` as (command, args) in order."""
+    conn = get_db()
+    cursor = conn.cursor()
+    # Only the target consumes its commands, so reading first is safe and
+    # keeps the (frequent) empty polls free of write locks
+    cursor.execute(
+        "SELECT id, command, args_json FROM job_commands WHERE target = ? ORDER BY id",
+        (target,),
+    )
+    rows = cursor.fetchall()
+    if rows:
+        cursor.execute(
+            "DELETE FROM job_commands WHERE target = ? AND id <= ?",
+            (target, rows[-1]["id"]),
+        )
+        conn.commit()
+    conn.close()
+    return [(row["command"], json.loads(row["args_json"] or "{}")) for row in rows]
+
+
+def _fish_selection(selection):
+    """WHERE clause and parameters of a fish selection (see select_fish)."""
+    conditions = []
+    params = []
+    if selection.get("video_filename"):
+        conditions.append("video_filename = ?")
+        params.append(selection["video_filename"])
+    if selection.get("statuses"):
+        conditions.append("status IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(selection["statuses"])))
+    elif selection.get("idle_only"):
+        # Fish that are queued or being characterized are left alone
+        conditions.append("status NOT IN ('pending_characterization', 'characterizing')")
+    for rank, taxon in (selection.get("taxon") or {}).items():
+        if rank not in TAXONOMY_RANKS:
+            raise ValueError(f"Unknown taxonomy rank: {rank}")
+        conditions.append(
+            f"json_valid(taxonomy_json) AND json_extract(taxonomy_json, '$.{rank}') = ?"
+        )
+        params.append(taxon)
+    if selection.get("min_unknown_ranks"):
+        # Fish without a (valid) taxonomy count as all "Unknown"
+        unknown = " + ".join(
+            f"(COALESCE(json_extract(taxonomy_json, '$.{rank}'), 'Unknown') IN ('', 'Unknown'))"
+            for rank in TAXONOMY_RANKS
+        )
+        conditions.append(
+            f"(CASE WHEN json_valid(taxonomy_json) THEN {unknown} ELSE {len(TAXONOMY_RANKS)} END) >= ?"
+        )
+        params.append(int(selection["min_unknown_ranks"]))
+    return " AND ".join(conditions) or "1", params
+
+
+def select_fish(selection, after_id=0, limit=None):
+    """
+    Fish entries matching all filters of `selection`, in ID order.
+
+    Args:
+        selection: Dict with any of "video_filename", "statuses" (list),
+            "taxon" ({rank: taxon}, e.g. {"Species": "Unknown"}),
+            "min_unknown_ranks" (at least this many "Unknown" ranks) and
+            "idle_only" (skip queued and characterizing fish unless
+            "statuses" is given)
+        after_id: Only fish with a higher ID
+        limit: Maximum number of fish
+    """
+    where, params = _fish_selection(selection)
+    query = (
+        "SELECT id, image_filename, video_filename, timestamps, perceptual_hash, status, "
+        f"taxonomy_json, identity_id FROM detected_fish WHERE id > ? AND {where} ORDER BY id"
+    )
+    params = [after_id] + params
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    conn = get_db()
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def count_selected_fish(selection, after_id=0):
+    """Number of fish entries select_fish() would return."""
+    where, params = _fish_selection(selection)
+    conn = get_db()
+    count = conn.execute(
+        f"SELECT COUNT(*) FROM detected_fish WHERE id > ? AND {where}",
+        [after_id] + params,
+    ).fetchone()[0]
+    conn.close()
+    return count
+
+
+def get_fish_by_ids(fish_ids):
+    """Status and taxonomy of the given fish entries, by ID."""
+    conn = get_db()
+    rows = conn.execute(
+        "SELECT id, status, taxonomy_json FROM detected_fish "
+        "WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps([int(fish_id) for fish_id in fish_ids]),),
+    ).fetchall()
+    conn.close()
+    return {row["id"]: dict(row) for row in rows}
+
+
+def merge_fish(keep_id, merged_ids):
+    """
+    Merges fish entries of one video into `keep_id`: their timestamps are
+    added to it and the entries are deleted. Identities represented by a
+    merged fish are represented by `keep_id` instead. Returns the image
+    filenames of the deleted entries (packed crops are already flagged).
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        rows = cursor.execute(
+            "SELECT id, image_filename, timestamps, identity_id FROM detected_fish "
+            "WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([keep_id] + list(merged_ids)),),
+        ).fetchall()
+        keep = next((row for row in rows if row["id"] == keep_id), None)
+        merged = [row for row in rows if row["id"] != keep_id]
+        if keep is None or not merged:
+            conn.rollback()
+            return []
+
+        timestamps = set(json.loads(keep["timestamps"]))
+        for row in merged:
+            timestamps.update(json.loads(row["timestamps"]))
+        ids = json.dumps([row["id"] for row in merged])
+        image_filenames = [row["image_filename"] for row in merged]
+        identity_id = keep["identity_id"] or next(
+            (row["identity_id"] for row in merged if row["identity_id"]), None
+        )
+
+        cursor.execute(
+            "UPDATE detected_fish SET timestamps = ?, identity_id = ? WHERE id = ?",
+            (json.dumps(sorted(timestamps)), identity_id, keep_id),
+        )
+        cursor.execute(
+            "UPDATE fish_identities SET representative_fish_id = ? "
+            "WHERE representative_fish_id IN (SELECT value FROM json_each(?))",
+            (keep_id, ids),
+        )
+        cursor.execute(
+            "DELETE FROM detected_fish WHERE id IN (SELECT value FROM json_each(?))", (ids,)
+        )
+        cursor.execute(
+            "UPDATE crop_pack_index SET deleted = 1 "
+            "WHERE image_filename IN (SELECT value FROM json_each(?))",
+            (json.dumps(image_filenames),),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    increment("fish_db_writes_total", operation="merge_fish")
+    return image_filenames
+
+
+def _reprocess_job_from_row(row):
+    job = dict(row)
+    job["selection"] = json.loads(job.pop("selection_json"))
+    job["options"] = json.loads(job.pop("options_json") or "{}")
+    job["stats"] = json.loads(job.pop("stats_json") or "{}")
+    return job
+
+
+def create_reprocess_job(kind, selection, options=None):
+    """Stores a new reprocessing job and returns its ID."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO reprocess_jobs (kind, selection_json, options_json) VALUES (?, ?, ?)",
+        (kind, json.dumps(selection), json.dumps(options or {})),
+    )
+    conn.commit()
+    job_id = cursor.lastrowid
+    conn.close()
+    return job_id
+
+
+def get_reprocess_job(job_id):
+    """Returns a reprocessing job as a dict, or None."""
+    conn = get_db()
+    row = conn.execute("SELECT * FROM reprocess_jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return _reprocess_job_from_row(row) if row else None
+
+
+def get_reprocess_jobs(limit=50):
+    """The most recent reprocessing jobs, newest first."""
+    conn = get_db()
+    rows = conn.execute(
+        "SELECT * FROM reprocess_jobs ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    conn.close()
+    return [_reprocess_job_from_row(row) for row in rows]
+
+
+def claim_reprocess_job(job_id, owner, stale_before):
+    """
+    Marks a job as running in the process `owner`. Fails (returns False) if
+    it is finished or running in a process that sent a heartbeat after
+    `stale_before`.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        UPDATE reprocess_jobs SET status = 'running', owner = ?, heartbeat = ?,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND (
+            status IN ('queued', 'paused', 'error')
+            OR (status = 'running' AND (heartbeat IS NULL OR heartbeat < ?))
+        )
+        """,
+        (owner, time.time(), job_id, stale_before),
+    )
+    conn.commit()
+    claimed = cursor.rowcount == 1
+    conn.close()
+    return claimed
+
+
+def update_reprocess_job(job_id, owner=None, finished=False, **fields):
+    """
+    Updates the status, checkpoint (last_id, last_video) and/or stats (a
+    dict) of a job and refreshes its heartbeat. With `owner`, nothing is
+    changed unless that process still runs the job; returns whether the row
+    was updated.
+    """
+    columns = {"heartbeat": time.time()}
+    for key, value in fields.items():
+        if key == "stats":
+            columns["stats_json"] = json.dumps(value)
+        elif key in ("status", "last_id", "last_video"):
+            columns[key] = value
+        else:
+            raise ValueError(f"Unknown reprocess job field: {key}")
+    assignments = ", ".join(f"{column} = ?" for column in columns)
+    if finished:
+        assignments += ", finished_at = CURRENT_TIMESTAMP"
+    query = f"UPDATE reprocess_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+    params = list(columns.values()) + [job_id]
+    if owner is not None:
+        query += " AND owner = ? AND status = 'running'"
+        params.append(owner)
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    conn.commit()
+    updated = cursor.rowcount == 1
+    conn.close()
+    return updated
+
+
+# Share of all characterized fish above which search_fish pages by walking the
+# fish IDs and skipping non-matches, instead of sorting every match
+SEARCH_DENSE_RATIO = 0.01
+
+
+def _search_text_condition(words):
+    """SQL condition on taxonomy_paths: every word starts a word of some rank."""
+    if SEARCH_FTS:
+        return (
+            "p.id IN (SELECT rowid FROM taxonomy_search WHERE taxonomy_search MATCH ?)",
+            [" ".join(f'"{word}"*' for word in words)],
+        )
+    ranks = " || ' ' || ".join(f'p."{rank}"' for rank in TAXONOMY_RANKS)
+    conditions = [f"(' ' || {ranks}) LIKE ? ESCAPE '\\'" for _ in words]
+    return " AND ".join(conditions), ["% " + word.replace("_", "\\_") + "%" for word in words]
+
+
+def search_fish(
+    text=None,
+    taxa=None,
+    video_filename=None,
+    facets=(),
+    limit=50,
+    before_id=None,
+    facet_limit=20,
+):
+    """
+    Characterized fish whose taxonomy matches a search, newest first.
+
+    Totals and facets are summed over the matching taxonomy_paths (or, for
+    one video, its fish_taxonomy rows); only the returned page reads
+    detected_fish.
+
+    Args:
+        text: Words that must each start a word of some rank, case- and
+            accent-insensitive (e.g. "amphi ocel")
+        taxa: {rank: taxon} exact, case-insensitive matches
+        video_filename: Only fish of this video
+        facets: Ranks to count the matching fish by
+        limit: Fish per page
+        before_id: Only fish with a lower ID (next_before_id of the previous page)
+        facet_limit: Taxa per facet, most frequent first
+
+    Returns a dict with "total" (matching fish), "fish" (this page), "facets"
+    ({rank: [{"taxon", "fish_count"}]}) and "next_before_id" (None on the
+    last page). Raises ValueError for an unknown rank.
+    """
+    taxa = taxa or {}
+    for rank in list(taxa) + list(facets):
+        if rank not in TAXONOMY_RANKS:
+            raise ValueError(f"Unknown taxonomy rank: {rank}")
+
+    conditions, params = [], []
+    words = re.findall(r"\w+", text or "")
+    if words:
+        condition, condition_params = _search_text_condition(words)
+        conditions.append(condition)
+        params += condition_params
+    for rank, taxon in taxa.items():
+        conditions.append(f'p."{rank}" = ? COLLATE NOCASE')
+        params.append(taxon)
+    filtered = bool(conditions)
+    conditions.append("p.fish_count > 0")
+    where = " AND ".join(conditions)
+    matching = f"SELECT p.id FROM taxonomy_paths p WHERE {where}"
+    # Fish per matching taxonomy path
+    if video_filename:
+        source = (
+            "taxonomy_paths p JOIN (SELECT path_id, COUNT(*) AS fish_count FROM fish_taxonomy "
+            "WHERE video_filename = ? GROUP BY path_id) s ON s.path_id = p.id"
+        )
+        source_params = [video_filename] + params
+        fish_count = "s.fish_count"
+    else:
+        source = "taxonomy_paths p"
+        source_params = params
+        fish_count = "p.fish_count"
+
+    conn = get_db()
+    total = conn.execute(
+        f"SELECT COALESCE(SUM({fish_count}), 0) FROM {source} WHERE {where}", source_params
+    ).fetchone()[0]
+    facet_counts = {}
+    for rank in facets:
+        rows = conn.execute(
+            f"""
+            SELECT p."{rank}" AS taxon, SUM({fish_count}) AS fish_count FROM {source}
+            WHERE {where} AND p."{rank}" != ''
+            GROUP BY p."{rank}" ORDER BY fish_count DESC, taxon LIMIT ?
+        """,
+            source_params + [facet_limit],
+        ).fetchall()
+        facet_counts[rank] = [dict(row) for row in rows]
+
+    # One more ID than the page tells whether there is a next page
+    query = "SELECT fish_id FROM fish_taxonomy WHERE 1"
+    query_params = []
+    if video_filename:
+        # The video's fish are read from its index range and sorted
+        query += " AND video_filename = ?"
+        query_params.append(video_filename)
+        if filtered:
+            query += f" AND path_id IN ({matching})"
+            query_params += params
+    elif filtered:
+        all_fish = conn.execute("SELECT SUM(fish_count) FROM taxonomy_paths").fetchone()[0]
+        if total >= SEARCH_DENSE_RATIO * (all_fish or 0):
+            # Common matches: walk the newest fish until the page is full
+            query += f" AND +path_id IN ({matching})"
+        else:
+            # Rare matches: read all of them from the path index
+            query += f" AND path_id IN ({matching})"
+        query_params += params
+    if before_id is not None:
+        query += " AND fish_id < ?"
+        query_params.append(before_id)
+    query += " ORDER BY fish_id DESC LIMIT ?"
+    query_params.append(limit + 1)
+    fish_ids = [row[0] for row in conn.execute(query, query_params).fetchall()]
+    has_more = len(fish_ids) > limit
+    fish_ids = fish_ids[:limit]
+
+    fish = conn.execute(
+        "SELECT id, image_filename, video_filename, timestamps, status, taxonomy_json, identity_id "
+        "FROM detected_fish WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id DESC",
+        (json.dumps(fish_ids),),
+    ).fetchall()
+    conn.close()
+    return {
+        "total": total,
+        "fish": [dict(row) for row in fish],
+        "facets": facet_counts,
+        "next_before_id": fish_ids[-1] if has_more else None,
+    }
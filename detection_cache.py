@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Cache of raw per-frame YOLO detections.
+
+While a video is processed, every box the model returns (down to
+CACHE_MIN_CONFIDENCE, below the normal CONFIDENCE_THRESHOLD) is recorded
+together with the frame index and timestamp. The arrays are stored as a
+compressed .npz in DETECTION_CACHE_DIR, keyed by the video's content
+fingerprint and the model, so the cache survives renames and is never reused
+across models.
+
+With a cache in place, changing HASH_SIZE, the similarity threshold or the
+confidence threshold no longer needs model.predict: detector.rederive_video()
+rebuilds a video's detected_fish rows from the cache and only decodes the
+sampled frames again to re-crop them.
+
+    python detection_cache.py rederive uploads/video.mp4 --confidence 0.3 --hash-size 8
+    python detection_cache.py rederive dive2/GOPR0001.MP4 --video-filename GOPR0001_24c337384ee4.MP4
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+from database import get_video
+from fingerprint import fingerprint_file
+
+load_dotenv()
+
+# --- Configuration ---
+DETECTION_CACHE_ENABLED = os.getenv("DETECTION_CACHE", "1") == "1"
+DETECTION_CACHE_DIR = os.getenv("DETECTION_CACHE_DIR", "detection_cache")
+CACHE_MIN_CONFIDENCE = float(
+    os.getenv("CACHE_MIN_CONFIDENCE", "0.1")
+)  # Lowest confidence kept in the cache, so thresholds can later be lowered
+
+
+def model_id_for(model_path):
+    """Short identifier of a model used in cache file names."""
+    name = os.path.basename(str(model_path))
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+def video_fingerprint(video_path, video_filename=None):
+    """
+    Fingerprint of a video, from the videos registry when it is registered.
+
+    Args:
+        video_path: Path to the video file
+        video_filename: Name the video is registered under, when it differs
+            from the basename (see ingest.video_filename_for)
+    """
+    video = get_video(video_filename or os.path.basename(video_path))
+    if video and video["fingerprint"]:
+        return video["fingerprint"]
+    return fingerprint_file(video_path)[0]
+
+
+def cache_path_for(fingerprint, model_id):
+    return os.path.join(DETECTION_CACHE_DIR, f"{fingerprint}_{model_id}.npz")
+
+
+def partial_cache_key(video_filename):
+    """Cache key of a video that is still being uploaded (no fingerprint yet)."""
+    name = "".join(c if c.isalnum() or c in "-_." else "_" for c in video_filename)
+    return f"partial_{name}"
+
+
+def adopt_partial_cache(video_filename, fingerprint, model_id):
+    """
+    Files the cache written while a video was uploading under its final
+    fingerprint. Returns True if there was such a cache.
+    """
+    partial_path = cache_path_for(partial_cache_key(video_filename), model_id)
+    if not os.path.exists(partial_path):
+        return False
+    os.replace(partial_path, cache_path_for(fingerprint, model_id))
+    return True
+
+
+def discard_partial_cache(video_filename, model_id):
+    """Removes the cache written while a video was uploading, if any."""
+    partial_path = cache_path_for(partial_cache_key(video_filename), model_id)
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+
+def _to_numpy(values, dtype):
+    if hasattr(values, "cpu"):  # torch tensors from ultralytics
+        values = values.cpu().numpy()
+    return np.asarray(values, dtype=dtype)
+
+
+class DetectionCache:
+    """Raw detections of one video for one model, one entry per processed frame."""
+
+    def __init__(self, fingerprint, model_id, min_confidence=CACHE_MIN_CONFIDENCE):
+        self.fingerprint = fingerprint
+        self.model_id = model_id
+        self.min_confidence = min_confidence
+        self.complete = False
+        self.frame_indices = []
+        self.timestamps = []
+        self._boxes = []  # list of (xyxy, conf, cls) arrays per frame
+
+    @property
+    def path(self):
+        return cache_path_for(self.fingerprint, self.model_id)
+
+    def __len__(self):
+        return len(self.frame_indices)
+
+    def add_frame(self, frame_index, timestamp_sec, xyxy, conf, cls):
+        """Records every box of one processed frame (tensors or arrays)."""
+        self.frame_indices.append(frame_index)
+        self.timestamps.append(timestamp_sec)
+        self._boxes.append(
+            (
+                _to_numpy(xyxy, np.float32).reshape(-1, 4),
+                _to_numpy(conf, np.float32).reshape(-1),
+                _to_numpy(cls, np.int16).reshape(-1),
+            )
+        )
+
+    def truncate_after(self, timestamp_sec):
+        """Drops frames after `timestamp_sec` (used when resuming from a checkpoint)."""
+        keep = sum(1 for t in self.timestamps if t <= timestamp_sec)
+        del self.frame_indices[keep:]
+        del self.timestamps[keep:]
+        del self._boxes[keep:]
+
+    def frames(self):
+        """Yields (frame_index, timestamp_sec, xyxy, conf, cls) in processing order."""
+        for frame_index, timestamp_sec, (xyxy, conf, cls) in zip(
+            self.frame_indices, self.timestamps, self._boxes
+        ):
+            yield frame_index, timestamp_sec, xyxy, conf, cls
+
+    def box_count(self):
+        return sum(len(conf) for _, conf, _ in self._boxes)
+
+    def save(self, complete=False):
+        """Writes the cache as a compressed .npz (atomically replaced)."""
+        self.complete = complete
+        os.makedirs(DETECTION_CACHE_DIR, exist_ok=True)
+
+        counts = np.array([len(conf) for _, conf, _ in self._boxes], dtype=np.int64)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        if self._boxes:
+            xyxy = np.concatenate([b[0] for b in self._boxes])
+            conf = np.concatenate([b[1] for b in self._boxes])
+            cls = np.concatenate([b[2] for b in self._boxes])
+        else:
+            xyxy = np.zeros((0, 4), dtype=np.float32)
+            conf = np.zeros(0, dtype=np.float32)
+            cls = np.zeros(0, dtype=np.int16)
+
+        meta = {
+            "fingerprint": self.fingerprint,
+            "model_id": self.model_id,
+            "min_confidence": self.min_confidence,
+            "complete": complete,
+        }
+        tmp_path = self.path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            frame_index=np.array(self.frame_indices, dtype=np.int64),
+            timestamp=np.array(self.timestamps, dtype=np.float64),
+            offsets=offsets,
+            xyxy=xyxy,
+            conf=conf,
+            cls=cls,
+            meta=np.array(json.dumps(meta)),
+        )
+        os.replace(tmp_path, self.path)
+        return self.path
+
+    @classmethod
+    def load(cls, fingerprint, model_id):
+        """Loads a cache from disk, or returns None if there is none."""
+        path = cache_path_for(fingerprint, model_id)
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            cache = cls(fingerprint, model_id, meta["min_confidence"])
+            cache.complete = meta["complete"]
+            cache.frame_indices = data["frame_index"].tolist()
+            cache.timestamps = data["timestamp"].tolist()
+            offsets = data["offsets"]
+            xyxy, conf, classes = data["xyxy"], data["conf"], data["cls"]
+            cache._boxes = [
+                (xyxy[start:end], conf[start:end], classes[start:end])
+                for start, end in zip(offsets[:-1], offsets[1:])
+            ]
+        return cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Work with cached raw detections.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rederive_parser = subparsers.add_parser(
+        "rederive",
+        help="Rebuild a video's detected fish from the cache with new parameters",
+    )
+    rederive_parser.add_argument("video_path")
+    rederive_parser.add_argument(
+        "--video-filename",
+        help="Name the video was stored under, if not its basename (e.g. by ingest.py)",
+    )
+    rederive_parser.add_argument("--confidence", type=float)
+    rederive_parser.add_argument("--hash-size", type=int)
+    rederive_parser.add_argument(
+        "--similarity",
+        type=int,
+        help="Maximum Hamming distance for two crops to count as the same fish",
+    )
+    info_parser = subparsers.add_parser("info", help="Show what is cached for a video")
+    info_parser.add_argument("video_path")
+    info_parser.add_argument("--video-filename", help="Name the video was stored under")
+    args = parser.parse_args()
+
+    # Imported here because detector loads the model configuration
+    import detector
+
+    if args.command == "rederive":
+        detector.rederive_video(
+            args.video_path,
+            confidence_threshold=args.confidence,
+            hash_size=args.hash_size,
+            similarity_threshold=args.similarity,
+            video_filename=args.video_filename,
+        )
+    elif args.command == "info":
+        cache = DetectionCache.load(
+            video_fingerprint(args.video_path, args.video_filename),
+            model_id_for(detector.MODEL_PATH),
+        )
+        if not cache:
+            print("No cached detections for this video and model.")
+        else:
+            print(
+                f"{cache.path}: {len(cache)} frames, {cache.box_count()} boxes, "
+                f"min confidence {cache.min_confidence}, complete: {cache.complete}"
+            )
@@ -1,11 +1,33 @@
 import cv2
-from ultralytics import YOLO
+import numpy as np
 import os
+import queue
 import uuid
 import time
-from PIL import Image
-import imagehash  # For perceptual hashing
-from database import add_or_update_fish, IMAGE_DIR
+from database import (
+    add_or_update_fish,
+    IMAGE_DIR,
+    get_detection_checkpoint,
+    save_detection_checkpoint,
+    delete_detection_checkpoint,
+    delete_video_fish,
+    get_video_taxonomies,
+    update_fish_status,
+    record_detection_start,
+    record_detection_end,
+)
+from batch_phash import phash_batch  # For perceptual hashing
+from identity_index import needs_characterization
+from crop_store import save_crop, delete_crop, CROP_STORAGE, PACK_EXTENSION
+from metrics import span, increment
+from frame_pool import FramePool, frame_shape
+from detection_cache import (
+    DETECTION_CACHE_ENABLED,
+    DetectionCache,
+    model_id_for,
+    partial_cache_key,
+    video_fingerprint,
+)
 from dotenv import load_dotenv
 import threading  # Added for stop event support
 import pathlib  # For handling file paths
@@ -25,36 +47,335 @@ HASH_SIZE = 8  # Perceptual hash size (higher = more detail, slower)
 HASH_SIMILARITY_THRESHOLD = (
     5  # How different hashes can be to be considered the same fish (lower = stricter)
 )
+CROP_CONTEXT_MARGIN = float(
+    os.getenv("CROP_CONTEXT_MARGIN", "0")
+)  # Fraction of the box size kept around a stored crop as context (hashes use the box only)
+# Box filters applied before cropping (YOLO's COCO classes also find divers and rocks)
+DETECTION_CLASS_IDS = [
+    int(class_id) for class_id in os.getenv("DETECTION_CLASS_IDS", "").split(",") if class_id.strip()
+]  # Class IDs kept as fish (empty keeps every class)
+MIN_BOX_AREA = float(os.getenv("MIN_BOX_AREA", "0"))  # Minimum box area in pixels
+MIN_BOX_ASPECT = float(
+    os.getenv("MIN_BOX_ASPECT", "0")
+)  # Minimum box width / height (0 = no limit)
+MAX_BOX_ASPECT = float(
+    os.getenv("MAX_BOX_ASPECT", "0")
+)  # Maximum box width / height (0 = no limit)
+CHECKPOINT_EVERY_FRAMES = int(
+    os.getenv("CHECKPOINT_EVERY_FRAMES", "10")
+)  # Save a resumable checkpoint every N processed frames
 
 # --- Load Model ---
-# Ensure you have downloaded the model weights (it might download automatically first time)
-try:
-    print(
-        f"Loading YOLO model '{MODEL_PATH}'... This may take a moment on first run as the model needs to be downloaded."
-    )
-    start_time = time.time()
+# The model is loaded lazily on first use (or by warm_up) so that importing this
+# module is cheap. When MODEL_SERVER_ADDRESS is set, inference is delegated to a
+# shared model_server.py process instead of loading a copy in this process.
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS")
+_model = None
+_model_lock = threading.Lock()
+
+
+def _load_model():
+    """Loads the YOLO model (or connects to the model server). Returns None on failure."""
+    if MODEL_SERVER_ADDRESS:
+        from model_server import RemoteModel
+
+        print(f"Using shared YOLO model server at {MODEL_SERVER_ADDRESS}")
+        return RemoteModel(MODEL_SERVER_ADDRESS)
+
+    # Ensure you have downloaded the model weights (it might download automatically first time)
+    try:
+        from ultralytics import YOLO
 
-    # Check if the model file exists locally before loading
-    if not os.path.exists(MODEL_PATH):
         print(
-            f"YOLO model file '{MODEL_PATH}' not found locally. It will be downloaded automatically (20-30MB)."
+            f"Loading YOLO model '{MODEL_PATH}'... This may take a moment on first run as the model needs to be downloaded."
         )
-        print("Downloading model. Please wait...")
+        start_time = time.time()
 
-    model = YOLO(MODEL_PATH)
-    load_time = time.time() - start_time
+        # Check if the model file exists locally before loading
+        if not os.path.exists(MODEL_PATH):
+            print(
+                f"YOLO model file '{MODEL_PATH}' not found locally. It will be downloaded automatically (20-30MB)."
+            )
+            print("Downloading model. Please wait...")
 
-    print(f"YOLO model '{MODEL_PATH}' loaded successfully in {load_time:.2f} seconds.")
-    print(
-        f"Using time-based frame sampling: processing a frame every {SECONDS_BETWEEN_FRAMES} seconds"
+        model = YOLO(MODEL_PATH)
+        load_time = time.time() - start_time
+
+        print(
+            f"YOLO model '{MODEL_PATH}' loaded successfully in {load_time:.2f} seconds."
+        )
+        print(
+            f"Using time-based frame sampling: processing a frame every {SECONDS_BETWEEN_FRAMES} seconds"
+        )
+        return model
+    except Exception as e:
+        print(f"Error loading YOLO model: {e}")
+        return None
+
+
+def get_model():
+    """Returns the shared detection model, loading it on first use (thread-safe)."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _load_model()
+    return _model
+
+
+def warm_up():
+    """Loads the model and runs one dummy inference so the first job starts fast."""
+    model = get_model()
+    if not model:
+        return False
+    start_time = time.time()
+    model.predict(
+        np.zeros((640, 640, 3), dtype=np.uint8),
+        conf=CONFIDENCE_THRESHOLD,
+        verbose=False,
+    )
+    print(f"YOLO model warmed up in {time.time() - start_time:.2f} seconds.")
+    return True
+
+
+def get_video_dirname(video_filename):
+    """Safe directory name for a video's crops (the file stem without special characters)."""
+    video_dirname = pathlib.Path(video_filename).stem  # Remove the extension
+    # Remove any special characters that might cause issues in directory names
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in video_dirname)
+
+
+def format_timestamp(timestamp_sec):
+    """Formats seconds as HH:MM:SS.mmm (e.g., 00:01:23.456)."""
+    minutes, seconds = divmod(timestamp_sec, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def context_crop(frame, x1, y1, x2, y2):
+    """The crop that is stored for a box: the box plus CROP_CONTEXT_MARGIN on each side."""
+    if CROP_CONTEXT_MARGIN <= 0:
+        return frame[y1:y2, x1:x2]
+    margin_x = int((x2 - x1) * CROP_CONTEXT_MARGIN)
+    margin_y = int((y2 - y1) * CROP_CONTEXT_MARGIN)
+    height, width = frame.shape[:2]
+    return frame[
+        max(0, y1 - margin_y) : min(height, y2 + margin_y),
+        max(0, x1 - margin_x) : min(width, x2 + margin_x),
+    ]
+
+
+def crop_quality(crop, confidence):
+    """
+    Score between 0 and 1 of how well a crop is likely to characterize: the
+    detection confidence, reduced for blurry (low Laplacian variance) and
+    small crops. Used to order the characterization queue.
+    """
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    sharpness = min(1.0, cv2.Laplacian(gray, cv2.CV_64F).var() / 100.0)
+    size = min(1.0, min(crop.shape[:2]) / 64.0)
+    return round(float(confidence) * (0.5 + 0.5 * sharpness) * (0.5 + 0.5 * size), 3)
+
+
+def get_detection_config():
+    """Settings that a checkpoint must share with the run resuming it."""
+    return {
+        "model_path": MODEL_PATH,
+        "confidence_threshold": CONFIDENCE_THRESHOLD,
+        "seconds_between_frames": SECONDS_BETWEEN_FRAMES,
+        "hash_size": HASH_SIZE,
+        "class_ids": DETECTION_CLASS_IDS,
+        "min_box_area": MIN_BOX_AREA,
+        "box_aspect": [MIN_BOX_ASPECT, MAX_BOX_ASPECT],
+    }
+
+
+def _to_numpy(values, dtype):
+    if hasattr(values, "cpu"):  # torch tensors from ultralytics
+        values = values.cpu().numpy()
+    return np.asarray(values, dtype=dtype)
+
+
+def filter_boxes(xyxy, conf, cls, confidence_threshold=None, rejected=None):
+    """
+    The boxes of one frame that pass the confidence, class, area and aspect
+    ratio filters, computed as masks over all boxes at once so that rejected
+    boxes are never cropped, hashed or stored.
+
+    Args:
+        xyxy, conf, cls: Boxes, confidences and class IDs (tensors or arrays)
+        confidence_threshold: Minimum confidence (default CONFIDENCE_THRESHOLD)
+        rejected: Optional dict counting rejected boxes per filter; each box
+            counts for the first filter it fails
+
+    Returns (boxes as an (n, 4) int array, their confidences).
+    """
+    if confidence_threshold is None:
+        confidence_threshold = CONFIDENCE_THRESHOLD
+    xyxy = _to_numpy(xyxy, np.float32).reshape(-1, 4)
+    conf = _to_numpy(conf, np.float32).reshape(-1)
+    cls = _to_numpy(cls, np.int64).reshape(-1)
+    width = xyxy[:, 2] - xyxy[:, 0]
+    height = xyxy[:, 3] - xyxy[:, 1]
+
+    filters = [("confidence", conf >= confidence_threshold)]
+    if DETECTION_CLASS_IDS:
+        filters.append(("class", np.isin(cls, DETECTION_CLASS_IDS)))
+    if MIN_BOX_AREA > 0:
+        filters.append(("area", width * height >= MIN_BOX_AREA))
+    if MIN_BOX_ASPECT > 0 or MAX_BOX_ASPECT > 0:
+        aspect = np.divide(
+            width, height, out=np.full_like(width, np.inf), where=height > 0
+        )
+        passed = np.ones(len(aspect), dtype=bool)
+        if MIN_BOX_ASPECT > 0:
+            passed &= aspect >= MIN_BOX_ASPECT
+        if MAX_BOX_ASPECT > 0:
+            passed &= aspect <= MAX_BOX_ASPECT
+        filters.append(("aspect", passed))
+
+    keep = np.ones(len(conf), dtype=bool)
+    for name, passed in filters:
+        count = int(np.count_nonzero(keep & ~passed))
+        if count:
+            increment("fish_boxes_rejected_total", count, filter=name)
+            if rejected is not None:
+                rejected[name] = rejected.get(name, 0) + count
+        keep &= passed
+    # astype truncates like int() did for each coordinate
+    return xyxy[keep].astype(np.int32), conf[keep]
+
+
+def format_rejections(rejected):
+    """Summary of filter_boxes() rejection counts for the log."""
+    if not rejected:
+        return "no boxes filtered out"
+    return "filtered out " + ", ".join(
+        f"{count} by {name}" for name, count in sorted(rejected.items())
     )
-except Exception as e:
-    print(f"Error loading YOLO model: {e}")
-    model = None
+
+
+class SampledFrameReader(threading.Thread):
+    """
+    Decodes the frames detect_and_extract_fish() samples ahead of detection.
+    Frames in between are only grabbed, not decoded into arrays; sampled
+    frames are decoded into buffers of a FramePool, whose budget bounds how
+    far the reader runs ahead. Each sampled frame is put on `frames` as
+    (frame_count, timestamp_sec, frame), followed by None at the end.
+
+    Args:
+        cap: Opened capture, positioned at the first frame to read
+        frame_pool: FramePool providing the frame buffers
+        frame_count: Frames read before the current position
+        last_processed_time: Timestamp of the last processed frame
+        growing: Only return frames that are followed by another one (see
+            detect_and_extract_fish)
+        frames_to_skip: Frames between sampled frames
+        stop_event: threading.Event of the job
+    """
+
+    def __init__(
+        self,
+        cap,
+        frame_pool,
+        frame_count,
+        last_processed_time,
+        growing,
+        frames_to_skip,
+        stop_event,
+    ):
+        super().__init__(name="frame-reader", daemon=True)
+        self.cap = cap
+        self.frame_pool = frame_pool
+        self.frame_count = frame_count
+        self.last_processed_time = last_processed_time
+        self.growing = growing
+        self.frames_to_skip = frames_to_skip
+        self.job_stop_event = stop_event
+        self.stop_event = threading.Event()  # Set when detection needs no more frames
+        self.frames = queue.Queue()
+        self.error = None
+
+    def _stopped(self):
+        return self.stop_event.is_set() or self.job_stop_event.is_set()
+
+    def run(self):
+        cap = self.cap
+        shape = frame_shape(cap)
+        try:
+            while not self._stopped():
+                with span("decode"):
+                    grabbed = cap.grab()
+                if not grabbed:
+                    break  # End of video
+                self.frame_count += 1
+
+                # Get current timestamp in seconds
+                timestamp_sec = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+                # Process only if enough time has passed since the last processed frame
+                if timestamp_sec - self.last_processed_time < SECONDS_BETWEEN_FRAMES:
+                    continue
+
+                # Wait for a free buffer while detection is behind by the whole budget
+                buffer = None
+                while buffer is None and not self._stopped():
+                    buffer = self.frame_pool.acquire(shape, timeout=0.5)
+                if buffer is None:
+                    break
+                with span("decode"):
+                    ret, frame = cap.retrieve(buffer)
+                if not ret:
+                    self.frame_pool.release(buffer)
+                    break
+                self.frame_pool.replace(buffer, frame)
+                shape = frame.shape
+
+                if self.growing and self.frames_to_skip > 1:
+                    # The newest decodable frame of a file that is still being written
+                    # may be truncated, so only process frames that are followed by
+                    # another one (which is never sampled itself, as frames_to_skip > 1).
+                    # The next pass picks the frame up again from the checkpoint.
+                    if not cap.grab():
+                        self.frame_pool.release(frame)
+                        break
+                    self.frame_count += 1
+
+                self.last_processed_time = timestamp_sec
+                self.frames.put((self.frame_count, timestamp_sec, frame))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.frames.put(None)
+
+    def close(self):
+        """Stops reading, waits for the thread and frees the frames not taken."""
+        self.stop_event.set()
+        while self.is_alive():
+            # Unblock a reader waiting for a buffer
+            self._drain()
+            self.join(timeout=0.1)
+        self._drain()
+        self.frame_pool.clear()
+
+    def _drain(self):
+        while True:
+            try:
+                item = self.frames.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                self.frame_pool.release(item[2])
 
 
 def detect_and_extract_fish(
-    video_path, detection_queue, progress_callback, stop_event=None
+    video_path,
+    detection_queue,
+    progress_callback,
+    stop_event=None,
+    resume=False,
+    growing=False,
+    video_filename=None,
 ):
     """
     Opens a video, detects fish frame by frame, extracts, hashes, saves,
@@ -65,7 +386,15 @@ def detect_and_extract_fish(
         detection_queue: Queue for adding detected fish
         progress_callback: Callback function to report progress
         stop_event: Optional threading.Event to signal stopping the process
+        resume: Continue from the video's last checkpoint instead of frame 0
+        growing: The file is still being written (chunked upload). Detection
+            stops at the end of the data received so far and checkpoints
+            there without marking the video complete, so that a later call
+            with resume=True continues from that point
+        video_filename: Name the video's fish and checkpoint are stored under
+            (default: the file's basename)
     """
+    model = get_model()
     if not model:
         print("Detection cannot proceed: YOLO model not loaded.")
         progress_callback(0, 0, True)  # Signal error
@@ -76,18 +405,18 @@ def detect_and_extract_fish(
         stop_event = threading.Event()
 
     # Extract video filename from path
-    video_filename = os.path.basename(video_path)
+    video_filename = video_filename or os.path.basename(video_path)
 
     # Create a safe directory name from the video filename
-    video_dirname = pathlib.Path(video_filename).stem  # Remove the extension
-    # Remove any special characters that might cause issues in directory names
-    video_dirname = "".join(
-        c if c.isalnum() or c in "-_" else "_" for c in video_dirname
-    )
+    video_dirname = get_video_dirname(video_filename)
 
-    # Create video-specific directory for detected fish
+    # Create video-specific directory for detected fish (pack storage keeps
+    # a single <video_dirname>.pack file instead)
     video_image_dir = os.path.join(IMAGE_DIR, video_dirname)
-    os.makedirs(video_image_dir, exist_ok=True)
+    if CROP_STORAGE == "pack":
+        video_image_dir += PACK_EXTENSION
+    else:
+        os.makedirs(video_image_dir, exist_ok=True)
 
     print(f"Processing video: {video_filename}")
     print(f"Storing detected fish images in: {video_image_dir}")
@@ -113,137 +442,506 @@ def detect_and_extract_fish(
         f"Video FPS: {fps}, processing every {frames_to_skip} frames (about every {SECONDS_BETWEEN_FRAMES} seconds)"
     )
 
+    def progress_total():
+        # The frame count of a growing file is unknown or not reached yet
+        return max(total_frames, frame_count + 1) if growing else total_frames
+
     last_processed_time = -float(
         "inf"
     )  # Initialize to negative infinity to ensure first frame is processed
 
-    while not stop_event.is_set():
-        ret, frame = cap.read()
-        if not ret:
-            break  # End of video
+    config = get_detection_config()
+    if resume:
+        checkpoint = get_detection_checkpoint(video_filename)
+        if checkpoint and checkpoint["completed"]:
+            print(f"Video {video_filename} was already fully processed. Nothing to resume.")
+            cap.release()
+            progress_callback(total_frames, total_frames, False)
+            return
+        if not checkpoint:
+            print(f"No checkpoint found for {video_filename}. Starting from the beginning.")
+        elif checkpoint["config"].get("hash_size") != HASH_SIZE:
+            # Hashes of a different size would never match the stored ones
+            print(
+                f"Checkpoint for {video_filename} used a different hash size. Starting from the beginning."
+            )
+        else:
+            frame_count = checkpoint["frame_count"]
+            processed_frame_count = checkpoint["processed_frame_count"]
+            detected_count = checkpoint["detected_count"]
+            last_processed_time = checkpoint["last_timestamp_sec"]
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count)
+            print(
+                f"Resuming {video_filename} from checkpoint at {last_processed_time:.3f}s "
+                f"(frame {frame_count}, {detected_count} unique fish so far)"
+            )
+
+    run_start_time = time.time()
+    record_detection_start(
+        video_filename,
+        # The frame count of a file that is still growing is not final
+        total_frames / fps if fps and total_frames > 0 and not growing else None,
+        fps or None,
+        config,
+        resumed=last_processed_time > -float("inf"),
+    )
 
-        frame_count += 1
+    # Raw detections are cached so thresholds and hashing can be changed later
+    # without running the model again (see rederive_video)
+    detection_cache = None
+    cache_has_gap = False
+    predict_confidence = CONFIDENCE_THRESHOLD
+    if DETECTION_CACHE_ENABLED:
+        model_id = model_id_for(MODEL_PATH)
+        if growing:
+            # The fingerprint needs the whole file; adopt_partial_cache() renames
+            # the cache once the upload is complete
+            fingerprint = partial_cache_key(video_filename)
+        else:
+            fingerprint = video_fingerprint(video_path, video_filename)
+        if last_processed_time > -float("inf"):
+            # Resumed: continue the cache written before the interruption
+            detection_cache = DetectionCache.load(fingerprint, model_id)
+            if detection_cache and detection_cache.timestamps:
+                detection_cache.truncate_after(last_processed_time)
+                cache_has_gap = detection_cache.timestamps[-1] < last_processed_time
+            else:
+                cache_has_gap = True
+        if not detection_cache:
+            detection_cache = DetectionCache(fingerprint, model_id)
+        predict_confidence = min(CONFIDENCE_THRESHOLD, detection_cache.min_confidence)
+
+    def save_detection_cache(completed=False):
+        if detection_cache is not None:
+            path = detection_cache.save(complete=completed and not cache_has_gap)
+            print(f"Saved {len(detection_cache)} frames of raw detections to {path}")
+
+    # Position of the last frame whose detections are all in the database
+    checkpoint_time = last_processed_time
+    checkpoint_frame = frame_count
+    checkpoint_processed = processed_frame_count
+
+    def save_checkpoint(completed=False):
+        if checkpoint_time == -float("inf"):
+            return  # Nothing processed yet
+        save_detection_checkpoint(
+            video_filename,
+            checkpoint_time,
+            checkpoint_frame,
+            checkpoint_processed,
+            detected_count,
+            config,
+            completed,
+        )
 
-        # Get current timestamp in seconds
-        timestamp_msec = cap.get(cv2.CAP_PROP_POS_MSEC)
-        timestamp_sec = timestamp_msec / 1000.0
+    rejected_boxes = {}  # Boxes filtered out by filter_boxes(), per filter
+
+    # Sampled frames are decoded ahead of detection into reused buffers
+    frame_pool = FramePool()
+    reader = SampledFrameReader(
+        cap,
+        frame_pool,
+        frame_count,
+        last_processed_time,
+        growing,
+        frames_to_skip,
+        stop_event,
+    )
+    reader.start()
+    try:
+        while not stop_event.is_set():
+            item = reader.frames.get()
+            if item is None:
+                if reader.error:
+                    raise reader.error
+                frame_count = reader.frame_count
+                break  # End of video
+            frame_count, timestamp_sec, frame = item
+
+            processed_frame_count += 1
+            increment("fish_frames_processed_total")
+            # Format timestamp (e.g., 00:01:23.456)
+            timestamp_str = format_timestamp(timestamp_sec)
+
+            # Run YOLO detection
+            with span("predict"):
+                results = model.predict(
+                    frame, conf=predict_confidence, verbose=False
+                )  # verbose=False reduces console spam
+
+            # Process results
+            for result in results:
+                boxes = result.boxes
+                if detection_cache is not None:
+                    detection_cache.add_frame(
+                        frame_count, timestamp_sec, boxes.xyxy, boxes.conf, boxes.cls
+                    )
+                # Filter all boxes at once (the cache may have asked the model for
+                # lower-confidence boxes), then crop every kept box first so that
+                # all crops of the frame are hashed together
+                kept_boxes, kept_confidences = filter_boxes(
+                    boxes.xyxy, boxes.conf, boxes.cls, rejected=rejected_boxes
+                )
+                crops = []
+                crop_boxes = []
+                crop_confidences = []
+                for (x1, y1, x2, y2), box_confidence in zip(
+                    kept_boxes.tolist(), kept_confidences.tolist()
+                ):  # Bounding boxes in xyxy format
+                    # Crop the detected fish
+                    cropped_fish = frame[y1:y2, x1:x2]
+
+                    # Ensure crop is valid
+                    if cropped_fish.size == 0:
+                        print(
+                            f"Warning: Empty crop at frame {frame_count}, timestamp {timestamp_str}. Skipping."
+                        )
+                        continue
+                    crops.append(cropped_fish)
+                    crop_boxes.append((x1, y1, x2, y2))
+                    crop_confidences.append(box_confidence)
 
-        # Process only if enough time has passed since the last processed frame
-        if timestamp_sec - last_processed_time < SECONDS_BETWEEN_FRAMES:
-            # Check stop event more frequently
-            if frame_count % 10 == 0 and stop_event.is_set():
-                print("Stopping detection process as requested.")
-                break
-            continue
+                try:
+                    with span("phash"):
+                        # Calculate the perceptual hashes of all crops in one batch
+                        p_hashes = phash_batch(crops, HASH_SIZE)
+                except Exception as e:
+                    print(f"Error hashing detections at frame {frame_count}: {e}")
+                    p_hashes = []
+
+                for cropped_fish, crop_box, confidence, p_hash in zip(
+                    crops, crop_boxes, crop_confidences, p_hashes
+                ):
+                    # Check stop event during processing
+                    if stop_event.is_set():
+                        print("Stopping detection during result processing.")
+                        break
+
+                    try:
+
+                        # --- Check for Similarity (More Advanced - Optional) ---
+                        # Instead of exact hash match in DB, query for hashes within threshold
+                        # This requires a different DB query approach (potentially slower)
+                        # For simplicity, we'll use exact hash matching first. If too many duplicates
+                        # are missed, this is the place to implement hamming distance check.
+
+                        # Save the cropped image with a unique name. The returned path is
+                        # relative to IMAGE_DIR to preserve video folder organization
+                        image_filename = f"fish_{uuid.uuid4()}.png"
+                        with span("imwrite"):
+                            rel_image_path = save_crop(
+                                video_dirname, image_filename, context_crop(frame, *crop_box)
+                            )
+
+                        # Add to DB or update timestamp; get ID if it's a *new* unique fish
+                        new_fish_id = add_or_update_fish(
+                            rel_image_path, video_filename, timestamp_str, p_hash
+                        )
 
-        # Check if stop requested before processing this frame
-        if stop_event.is_set():
-            print("Stopping detection process as requested.")
-            break
-
-        # Update the last processed time
-        last_processed_time = timestamp_sec
-
-        processed_frame_count += 1
-        # Format timestamp (e.g., 00:01:23.456)
-        minutes, seconds = divmod(timestamp_sec, 60)
-        hours, minutes = divmod(minutes, 60)
-        timestamp_str = f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
-
-        # Run YOLO detection
-        results = model.predict(
-            frame, conf=CONFIDENCE_THRESHOLD, verbose=False
-        )  # verbose=False reduces console spam
-
-        # Process results
-        for result in results:
-            boxes = result.boxes
-            for box in boxes.xyxy:  # Bounding boxes in xyxy format
-                # Check stop event during processing
+                        increment("fish_detections_total")
+                        if new_fish_id:
+                            detected_count += 1
+                            # Fish of an identity seen in another video get its taxonomy instead
+                            if needs_characterization(new_fish_id, p_hash, cropped_fish):
+                                # Add the *ID* and filename to the queue for LLM processing
+                                detection_queue.put(
+                                    {
+                                        "id": new_fish_id,
+                                        "filename": rel_image_path,
+                                        "video": video_filename,
+                                        "quality": crop_quality(cropped_fish, confidence),
+                                    }
+                                )
+                                print(f"Queued new fish ID {new_fish_id} for characterization.")
+                        else:
+                            # It was an update to an existing hash, don't requeue, maybe log differently?
+                            # print(f"Updated existing fish with hash {p_hash} at {timestamp_str}")
+                            # If we just updated, we don't increment detected_count as it's not 'new'
+                            pass
+
+                    except Exception as e:
+                        print(f"Error processing detection at frame {frame_count}: {e}")
+
+                # Check if we need to stop after processing this batch of results
                 if stop_event.is_set():
-                    print("Stopping detection during result processing.")
                     break
 
-                x1, y1, x2, y2 = map(int, box)
+            if not stop_event.is_set():
+                # Every detection of this frame is stored, so a resume can start after it
+                checkpoint_time = timestamp_sec
+                checkpoint_frame = frame_count
+                checkpoint_processed = processed_frame_count
+                if processed_frame_count % CHECKPOINT_EVERY_FRAMES == 0:
+                    save_checkpoint()
 
-                # --- Optional: Filter by Class ID ---
-                # current_class_id = int(boxes.cls[boxes.xyxy.tolist().index(box.tolist())])
-                # if fish_class_id != -1 and current_class_id != fish_class_id:
-                #      continue # Skip if not the fish class ID
+            # Crops are views of the frame, which are all encoded by now
+            frame_pool.release(frame)
 
-                # Crop the detected fish
-                cropped_fish = frame[y1:y2, x1:x2]
+            # Update progress periodically
+            if processed_frame_count % 10 == 0:  # Update progress every 10 processed frames
+                progress_callback(frame_count, progress_total(), False)
+        if stop_event.is_set():
+            print("Stopping detection process as requested.")
+    finally:
+        reader.close()
+        cap.release()
 
-                # Ensure crop is valid
-                if cropped_fish.size == 0:
-                    print(
-                        f"Warning: Empty crop at frame {frame_count}, timestamp {timestamp_str}. Skipping."
-                    )
-                    continue
+    record_detection_end(
+        video_filename,
+        time.time() - run_start_time,
+        completed=not (stop_event.is_set() or growing),
+    )
 
-                try:
-                    # Convert to PIL Image for hashing
-                    pil_image = Image.fromarray(
-                        cv2.cvtColor(cropped_fish, cv2.COLOR_BGR2RGB)
-                    )
+    # If we exited because of stop_event
+    if stop_event.is_set():
+        save_checkpoint()
+        save_detection_cache()
+        print(
+            f"Detection stopped by user. Processed {processed_frame_count} frames. Found {detected_count} unique new fish "
+            f"({format_rejections(rejected_boxes)})."
+        )
+        progress_callback(frame_count, progress_total(), False)
+    elif growing:
+        # End of the data received so far; more of the video is still coming
+        save_checkpoint()
+        save_detection_cache()
+        print(
+            f"Reached the end of the data received so far for {video_filename}. "
+            f"Processed {processed_frame_count} frames. Found {detected_count} unique new fish "
+            f"({format_rejections(rejected_boxes)})."
+        )
+        progress_callback(frame_count, progress_total(), False)
+    else:
+        # We exited normally (end of video)
+        save_checkpoint(completed=True)
+        save_detection_cache(completed=True)
+        print(
+            f"Video processing complete. Processed {processed_frame_count} frames. Found {detected_count} unique new fish "
+            f"({format_rejections(rejected_boxes)})."
+        )
+        # Final progress update
+        progress_callback(total_frames, total_frames, False)
 
-                    # Calculate perceptual hash
-                    p_hash = str(imagehash.phash(pil_image, hash_size=HASH_SIZE))
 
-                    # --- Check for Similarity (More Advanced - Optional) ---
-                    # Instead of exact hash match in DB, query for hashes within threshold
-                    # This requires a different DB query approach (potentially slower)
-                    # For simplicity, we'll use exact hash matching first. If too many duplicates
-                    # are missed, this is the place to implement hamming distance check.
+def rederive_video(
+    video_path,
+    detection_queue=None,
+    progress_callback=None,
+    stop_event=None,
+    confidence_threshold=None,
+    hash_size=None,
+    similarity_threshold=None,
+    video_filename=None,
+):
+    """
+    Rebuilds a video's detected fish from its raw detection cache with new
+    parameters, without running the model. The video is only decoded at the
+    cached frames to re-crop the boxes.
 
-                    # Save the cropped image with a unique name
-                    image_filename = f"fish_{uuid.uuid4()}.png"
-                    save_path = os.path.join(video_image_dir, image_filename)
-                    cv2.imwrite(save_path, cropped_fish)
+    Args:
+        video_path: Path to the video file
+        detection_queue: Optional queue receiving the new fish for characterization
+        progress_callback: Optional callback function to report progress
+        stop_event: Optional threading.Event to signal stopping the process
+        confidence_threshold: Minimum box confidence (default CONFIDENCE_THRESHOLD)
+        hash_size: Perceptual hash size (default HASH_SIZE)
+        similarity_threshold: Maximum Hamming distance between the hashes of two
+            crops of the same fish (default 0, i.e. exact matches as in detection)
+        video_filename: Name the video is stored under (default: its basename)
 
-                    # Store image path relative to IMAGE_DIR to preserve video folder organization
-                    rel_image_path = os.path.join(video_dirname, image_filename)
+    Returns a dict of statistics, or None if the video has no cached detections.
+    """
+    confidence_threshold = (
+        CONFIDENCE_THRESHOLD if confidence_threshold is None else confidence_threshold
+    )
+    hash_size = HASH_SIZE if hash_size is None else hash_size
+    similarity_threshold = similarity_threshold or 0
+    if progress_callback is None:
+        progress_callback = lambda current, total, error: None  # noqa: E731
+    if stop_event is None:
+        stop_event = threading.Event()
 
-                    # Add to DB or update timestamp; get ID if it's a *new* unique fish
-                    new_fish_id = add_or_update_fish(
-                        rel_image_path, video_filename, timestamp_str, p_hash
-                    )
+    video_filename = video_filename or os.path.basename(video_path)
+    video_dirname = get_video_dirname(video_filename)
+    start_time = time.time()
 
-                    if new_fish_id:
-                        detected_count += 1
-                        # Add the *ID* and filename to the queue for LLM processing
-                        detection_queue.put(
-                            {"id": new_fish_id, "filename": rel_image_path}
-                        )
-                        print(f"Queued new fish ID {new_fish_id} for characterization.")
-                    else:
-                        # It was an update to an existing hash, don't requeue, maybe log differently?
-                        # print(f"Updated existing fish with hash {p_hash} at {timestamp_str}")
-                        # If we just updated, we don't increment detected_count as it's not 'new'
-                        pass
+    cache = DetectionCache.load(
+        video_fingerprint(video_path, video_filename), model_id_for(MODEL_PATH)
+    )
+    if not cache:
+        print(f"No cached detections for {video_filename}. Process the video first.")
+        progress_callback(0, 0, True)
+        return None
+    if not cache.complete:
+        print(f"Warning: cached detections for {video_filename} do not cover the whole video.")
+    if confidence_threshold < cache.min_confidence:
+        print(
+            f"Warning: boxes below {cache.min_confidence} were not cached; "
+            f"confidence threshold {confidence_threshold} behaves like {cache.min_confidence}."
+        )
 
-                except Exception as e:
-                    print(f"Error processing detection at frame {frame_count}: {e}")
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Error: Could not open video file {video_path}")
+        progress_callback(0, 0, True)
+        return None
+
+    # Replace the current results of this video. Until the new ones are
+    # complete, the video must not count as fully processed (for resuming
+    # and for linking duplicate uploads to it); fish whose hash survives keep
+    # their taxonomy instead of being characterized again.
+    previous_taxonomies = get_video_taxonomies(video_filename)
+    delete_detection_checkpoint(video_filename)
+    for image_filename in delete_video_fish(video_filename):
+        try:
+            delete_crop(image_filename)
+        except Exception as e:
+            print(f"Error deleting image file: {e}")
+    if CROP_STORAGE != "pack":
+        os.makedirs(os.path.join(IMAGE_DIR, video_dirname), exist_ok=True)
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    known_hashes = []  # (hash as int, hash string) of every unique fish so far
+    frame_total = len(cache)
+    position = 0  # Index of the next frame cap.read() would return
+    frame = None  # Decoded into again for every frame (crops are views of it)
+    stats = {
+        "frames": 0,
+        "boxes": 0,
+        "unique_fish": 0,
+        "sightings": 0,
+        "kept_taxonomies": 0,
+        "rejected": {},
+    }
+    current = None  # (timestamp, frame index, cached frames) of the frame being processed
+    done = None  # The same for the last frame whose fish are all stored
+    stopped = False
 
-            # Check if we need to stop after processing this batch of results
+    print(
+        f"Re-deriving {video_filename} from {frame_total} cached frames "
+        f"(confidence {confidence_threshold}, hash size {hash_size}, similarity {similarity_threshold})"
+    )
+    try:
+        for i, (frame_index, timestamp_sec, xyxy, conf, cls) in enumerate(cache.frames()):
+            done = current
             if stop_event.is_set():
+                print("Stopping re-derivation as requested.")
+                stopped = True
                 break
+            current = (timestamp_sec, frame_index, i + 1)
+            kept_boxes, kept_confidences = filter_boxes(
+                xyxy, conf, cls, confidence_threshold, stats["rejected"]
+            )
+            if not len(kept_boxes):
+                continue
+
+            # frame_index counts frames read, so the frame itself is at frame_index - 1
+            target = frame_index - 1
+            with span("decode"):
+                if target < position or target - position > 2 * fps:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                else:
+                    while position < target:
+                        cap.grab()
+                        position += 1
+                ret, frame = cap.read(frame)
+            position = target + 1
+            if not ret:
+                print(f"Warning: could not decode frame {target}. Skipping.")
+                continue
+
+            stats["frames"] += 1
+            timestamp_str = format_timestamp(timestamp_sec)
+            crops = []
+            crop_boxes = []
+            crop_confidences = []
+            for (x1, y1, x2, y2), box_confidence in zip(
+                kept_boxes.tolist(), kept_confidences.tolist()
+            ):
+                cropped_fish = frame[y1:y2, x1:x2]
+                if cropped_fish.size > 0:
+                    crops.append(cropped_fish)
+                    crop_boxes.append((x1, y1, x2, y2))
+                    crop_confidences.append(box_confidence)
+            stats["boxes"] += len(crops)
+            with span("phash"):
+                p_hashes = phash_batch(crops, hash_size)
+
+            for cropped_fish, crop_box, confidence, p_hash in zip(
+                crops, crop_boxes, crop_confidences, p_hashes
+            ):
+                hash_value = int(p_hash, 16)
+
+                # Reuse the hash of an already known fish within the threshold so
+                # add_or_update_fish adds this sighting to that fish
+                match = None
+                for known_value, known_hash in known_hashes:
+                    if bin(known_value ^ hash_value).count("1") <= similarity_threshold:
+                        match = known_hash
+                        break
+
+                if match:
+                    add_or_update_fish(None, video_filename, timestamp_str, match)
+                    stats["sightings"] += 1
+                    continue
+
+                image_filename = f"fish_{uuid.uuid4()}.png"
+                with span("imwrite"):
+                    rel_image_path = save_crop(
+                        video_dirname, image_filename, context_crop(frame, *crop_box)
+                    )
+                new_fish_id = add_or_update_fish(
+                    rel_image_path, video_filename, timestamp_str, p_hash
+                )
+                known_hashes.append((hash_value, p_hash))
+                if new_fish_id:
+                    stats["unique_fish"] += 1
+                    if p_hash in previous_taxonomies:
+                        update_fish_status(
+                            new_fish_id, "characterized", previous_taxonomies[p_hash]
+                        )
+                        stats["kept_taxonomies"] += 1
+                    elif detection_queue is not None and needs_characterization(
+                        new_fish_id, p_hash, cropped_fish
+                    ):
+                        detection_queue.put(
+                            {
+                                "id": new_fish_id,
+                                "filename": rel_image_path,
+                                "video": video_filename,
+                                "quality": crop_quality(cropped_fish, confidence),
+                            }
+                        )
 
-        # Update progress periodically
-        if processed_frame_count % 10 == 0:  # Update progress every 10 processed frames
-            progress_callback(frame_count, total_frames, False)
+            if (i + 1) % 10 == 0:
+                progress_callback(i + 1, frame_total, False)
+    finally:
+        cap.release()
 
-    # If we exited because of stop_event
-    if stop_event.is_set():
-        print(
-            f"Detection stopped by user. Processed {processed_frame_count} frames. Found {detected_count} unique new fish."
+    config = get_detection_config()
+    config.update(confidence_threshold=confidence_threshold, hash_size=hash_size)
+    if not stopped and cache.timestamps:
+        # The new rows fully replace the old ones, so record them as a finished run
+        save_detection_checkpoint(
+            video_filename,
+            cache.timestamps[-1],
+            cache.frame_indices[-1],
+            frame_total,
+            stats["unique_fish"],
+            config,
+            completed=cache.complete,
         )
-        progress_callback(frame_count, total_frames, False)
-    else:
-        # We exited normally (end of video)
-        cap.release()
-        print(
-            f"Video processing complete. Processed {processed_frame_count} frames. Found {detected_count} unique new fish."
+    elif stopped and done:
+        # Resuming continues detection after the last re-derived frame
+        save_detection_checkpoint(
+            video_filename, done[0], done[1], done[2], stats["unique_fish"], config
         )
-        # Final progress update
-        progress_callback(total_frames, total_frames, False)
+
+    stats["seconds"] = round(time.time() - start_time, 3)
+    print(
+        f"Re-derivation of {video_filename} finished in {stats['seconds']}s: "
+        f"{stats['unique_fish']} unique fish from {stats['boxes']} boxes in {stats['frames']} frames, "
+        f"{stats['kept_taxonomies']} taxonomies kept ({format_rejections(stats['rejected'])})."
+    )
+    progress_callback(frame_total, frame_total, False)
+    return stats
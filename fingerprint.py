@@ -0,0 +1,181 @@
+"""
+Fast content fingerprints for uploaded videos.
+
+A fingerprint is a SHA-256 over the file size and a sample of fixed-size chunks
+(the first few chunks, every Nth chunk after that and the final chunk). It can
+be computed while an upload streams to disk (StreamingFingerprint) or later
+from a file on disk by seeking straight to the sampled chunks
+(fingerprint_file); both give the same result, and neither depends on the
+file name.
+
+Optionally, a decoded-frame signature (perceptual hashes of a few frames at
+fixed positions) can be computed as well, which also recognises the same clip
+after it has been re-encoded or re-muxed.
+"""
+
+import hashlib
+import os
+
+import cv2
+import imagehash
+from PIL import Image
+from dotenv import load_dotenv
+
+from database import (
+    find_video_by_fingerprint,
+    get_video_signatures,
+    get_detection_checkpoint,
+)
+
+load_dotenv()
+
+# --- Configuration ---
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+FINGERPRINT_HEAD_CHUNKS = 4  # Always hash the first chunks (container headers)
+FINGERPRINT_SAMPLE_EVERY = int(
+    os.getenv("FINGERPRINT_SAMPLE_EVERY", "16")
+)  # Then hash every Nth chunk
+VIDEO_FRAME_SIGNATURE = os.getenv("VIDEO_FRAME_SIGNATURE", "0") == "1"
+SIGNATURE_POSITIONS = (0.1, 0.3, 0.5, 0.7, 0.9)  # Fractions of the video length
+SIGNATURE_HASH_SIZE = 8
+SIGNATURE_MAX_DISTANCE = int(
+    os.getenv("SIGNATURE_MAX_DISTANCE", "40")
+)  # Total Hamming distance over all signature frames to call two videos the same
+
+
+def _is_sampled(chunk_index):
+    return (
+        chunk_index < FINGERPRINT_HEAD_CHUNKS
+        or chunk_index % FINGERPRINT_SAMPLE_EVERY == 0
+    )
+
+
+class StreamingFingerprint:
+    """Computes the fingerprint incrementally from data fed in any block size."""
+
+    def __init__(self):
+        self.size = 0
+        self._chunk_index = 0
+        self._buffer = bytearray()
+        self._sampled = hashlib.sha256()
+
+    def _add_chunk(self, index, chunk):
+        self._sampled.update(index.to_bytes(8, "big"))
+        self._sampled.update(hashlib.sha256(chunk).digest())
+
+    def update(self, data):
+        self.size += len(data)
+        self._buffer += data
+        # Keep the latest complete chunk buffered: it might be the final one
+        while len(self._buffer) > FINGERPRINT_CHUNK_SIZE:
+            chunk = bytes(self._buffer[:FINGERPRINT_CHUNK_SIZE])
+            del self._buffer[:FINGERPRINT_CHUNK_SIZE]
+            if _is_sampled(self._chunk_index):
+                self._add_chunk(self._chunk_index, chunk)
+            self._chunk_index += 1
+
+    def hexdigest(self):
+        digest = self._sampled.copy()
+        if self._buffer:
+            # The final (possibly partial) chunk is always part of the sample
+            digest.update(self._chunk_index.to_bytes(8, "big"))
+            digest.update(hashlib.sha256(bytes(self._buffer)).digest())
+        digest.update(self.size.to_bytes(8, "big"))
+        return digest.hexdigest()
+
+
+def save_stream_with_fingerprint(stream, path, block_size=FINGERPRINT_CHUNK_SIZE):
+    """
+    Copies a file-like upload stream to `path` while fingerprinting it.
+    Returns (fingerprint, size_in_bytes).
+    """
+    fingerprint = StreamingFingerprint()
+    with open(path, "wb") as f:
+        while True:
+            data = stream.read(block_size)
+            if not data:
+                break
+            f.write(data)
+            fingerprint.update(data)
+    return fingerprint.hexdigest(), fingerprint.size
+
+
+def fingerprint_file(path):
+    """Fingerprints a file on disk, reading only the sampled chunks."""
+    size = os.path.getsize(path)
+    chunk_count = (size + FINGERPRINT_CHUNK_SIZE - 1) // FINGERPRINT_CHUNK_SIZE
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for index in range(chunk_count):
+            if not (_is_sampled(index) or index == chunk_count - 1):
+                continue
+            f.seek(index * FINGERPRINT_CHUNK_SIZE)
+            chunk = f.read(FINGERPRINT_CHUNK_SIZE)
+            digest.update(index.to_bytes(8, "big"))
+            digest.update(hashlib.sha256(chunk).digest())
+    digest.update(size.to_bytes(8, "big"))
+    return digest.hexdigest(), size
+
+
+def frame_signature(path):
+    """
+    Returns perceptual hashes of frames at fixed positions of the video joined
+    with ':', or None if the video cannot be decoded.
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            return None
+
+        hashes = []
+        for position in SIGNATURE_POSITIONS:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(total_frames * position))
+            ret, frame = cap.read()
+            if not ret:
+                return None
+            pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            hashes.append(str(imagehash.phash(pil_image, hash_size=SIGNATURE_HASH_SIZE)))
+        return ":".join(hashes)
+    finally:
+        cap.release()
+
+
+def signature_distance(a, b):
+    """Total Hamming distance between two frame signatures (None if incomparable)."""
+    parts_a, parts_b = a.split(":"), b.split(":")
+    if len(parts_a) != len(parts_b):
+        return None
+    return sum(
+        imagehash.hex_to_hash(x) - imagehash.hex_to_hash(y)
+        for x, y in zip(parts_a, parts_b)
+    )
+
+
+def find_duplicate_video(fingerprint, signature=None):
+    """
+    Returns the filename of an already fully processed video with the same
+    content, or None. Matches on the fingerprint first and falls back to the
+    frame signature when one is available.
+    """
+    candidate = find_video_by_fingerprint(fingerprint)
+
+    if not candidate and signature:
+        best_distance = None
+        for video_filename, other_signature in get_video_signatures():
+            distance = signature_distance(signature, other_signature)
+            if distance is None or distance > SIGNATURE_MAX_DISTANCE:
+                continue
+            if best_distance is None or distance < best_distance:
+                candidate, best_distance = video_filename, distance
+
+    if not candidate:
+        return None
+
+    # Only link to results that are complete; otherwise process the upload normally
+    checkpoint = get_detection_checkpoint(candidate)
+    if checkpoint and checkpoint["completed"]:
+        return candidate
+    return None
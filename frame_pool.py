@@ -0,0 +1,137 @@
+"""
+Reusable frame buffers under a memory budget.
+
+A decoded 4K frame is about 25 MB. Instead of letting cv2 allocate a new
+array for every frame, the detection loops decode the frames they sample into
+buffers of a FramePool:
+
+- buffers are allocated once per frame size and reused; cap.retrieve(buffer)
+  decodes into them in place
+- crops are numpy views of the buffer until save_crop() encodes them, so a
+  buffer only goes back to the pool once its frame is fully processed
+- all buffers of a pool stay within FRAME_MEMORY_BUDGET_MB (but there is
+  always room for one). When the budget is used up, acquire() waits for a
+  buffer to be released, so decoding cannot run ahead of detection
+"""
+
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from metrics import increment
+
+load_dotenv()
+
+# --- Configuration ---
+FRAME_MEMORY_BUDGET_MB = float(
+    os.getenv("FRAME_MEMORY_BUDGET_MB", "128")
+)  # Decoded frames held per job (decoded ahead or being processed)
+
+
+def frame_shape(cap):
+    """Shape of the BGR frames a capture decodes, from its properties."""
+    return (
+        int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        3,
+    )
+
+
+class FramePool:
+    """
+    Frame buffers handed out by acquire() and returned by release().
+
+    Args:
+        budget_mb: Maximum size of all buffers (default FRAME_MEMORY_BUDGET_MB)
+    """
+
+    def __init__(self, budget_mb=None):
+        budget_mb = FRAME_MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.allocated_bytes = 0  # Buffers handed out or idle
+        self.peak_bytes = 0
+        self.waits = 0  # Times acquire() had to wait for a release
+        self._idle = []
+        self._condition = threading.Condition()
+
+    def _track(self, nbytes):
+        self.allocated_bytes += nbytes
+        self.peak_bytes = max(self.peak_bytes, self.allocated_bytes)
+
+    def acquire(self, shape, timeout=None):
+        """
+        Returns a uint8 buffer of `shape`, waiting while the budget is used
+        up. Returns None if no buffer became free within `timeout` seconds.
+        """
+        shape = tuple(shape)
+        nbytes = int(np.prod(shape))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            waited = False
+            while True:
+                for i, buffer in enumerate(self._idle):
+                    if buffer.shape == shape:
+                        return self._idle.pop(i)
+                # Idle buffers of another size (e.g. a reconnected stream) make room
+                while self._idle and self.allocated_bytes + nbytes > self.budget_bytes:
+                    self.allocated_bytes -= self._idle.pop().nbytes
+                if (
+                    self.allocated_bytes == 0
+                    or self.allocated_bytes + nbytes <= self.budget_bytes
+                ):
+                    self._track(nbytes)
+                    return np.empty(shape, dtype=np.uint8)
+
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                    increment("fish_frame_pool_waits_total")
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def release(self, buffer):
+        """Returns a buffer from acquire() (or retrieve()) for reuse."""
+        with self._condition:
+            self._idle.append(buffer)
+            self._condition.notify()
+
+    def replace(self, buffer, frame):
+        """
+        Accounts for `frame` instead of `buffer`: cv2 decodes into a new array
+        when a frame has another size than the buffer passed to it (e.g. when
+        the capture reported a wrong size).
+        """
+        if frame is buffer:
+            return
+        with self._condition:
+            self.allocated_bytes -= buffer.nbytes
+            self._track(frame.nbytes)
+
+    def retrieve(self, cap, shape, timeout=None):
+        """
+        Decodes the frame last grabbed by `cap` into a pool buffer. Returns
+        the frame (release() it when done), or None if the frame could not be
+        decoded or no buffer became free within `timeout` seconds.
+        """
+        buffer = self.acquire(shape, timeout)
+        if buffer is None:
+            return None
+        ret, frame = cap.retrieve(buffer)
+        if not ret:
+            self.release(buffer)
+            return None
+        self.replace(buffer, frame)
+        return frame
+
+    def clear(self):
+        """Frees the idle buffers."""
+        with self._condition:
+            for buffer in self._idle:
+                self.allocated_bytes -= buffer.nbytes
+            self._idle = []
@@ -0,0 +1,200 @@
+"""
+Global fish identity index shared by all videos.
+
+Dedup in add_or_update_fish() only looks within one video, so the same
+species (or individual) seen in many survey videos is otherwise characterized
+once per video. With GLOBAL_IDENTITY_INDEX=1, every new fish entry is matched
+against the identities seen so far:
+
+- a match needs a pHash within IDENTITY_HASH_THRESHOLD bits *and* a colour
+  embedding within IDENTITY_EMBEDDING_THRESHOLD cosine similarity (the pHash
+  is computed on grayscale, so the embedding tells apart similar shapes of
+  different colouring)
+- a matching fish becomes a sighting of that identity and takes over its
+  taxonomy (or receives it once the identity's first fish is characterized);
+  only fish without a match are sent to Gemini
+
+Identities are stored in the fish_identities table as soon as they are
+created. Each process keeps the hashes and embeddings in memory and only
+loads the rows added since its last lookup, so the index is never rebuilt
+and detection processes running side by side (ingest.py) see each other's
+identities.
+"""
+
+import os
+import threading
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from database import create_identity, get_identities_since, link_fish_to_identity
+from metrics import span, increment
+
+load_dotenv()
+
+# --- Configuration ---
+GLOBAL_IDENTITY_INDEX = os.getenv("GLOBAL_IDENTITY_INDEX", "0") == "1"
+IDENTITY_HASH_THRESHOLD = int(
+    os.getenv("IDENTITY_HASH_THRESHOLD", "10")
+)  # Max differing pHash bits for the same identity
+IDENTITY_EMBEDDING_THRESHOLD = float(
+    os.getenv("IDENTITY_EMBEDDING_THRESHOLD", "0.9")
+)  # Min cosine similarity of the colour embeddings for the same identity
+
+# Hue, saturation and value bins of the colour embedding
+EMBEDDING_BINS = (8, 4, 4)
+EMBEDDING_SIZE = EMBEDDING_BINS[0] * EMBEDDING_BINS[1] * EMBEDDING_BINS[2]
+
+
+def crop_embedding(crop):
+    """
+    Colour embedding of a BGR crop: the square root of its normalized HSV
+    histogram, which has unit length, so the dot product of two embeddings is
+    their cosine similarity.
+    """
+    if crop.ndim == 2:
+        crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
+    hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+    histogram = cv2.calcHist(
+        [hsv], [0, 1, 2], None, list(EMBEDDING_BINS), [0, 180, 0, 256, 0, 256]
+    ).ravel()
+    total = histogram.sum()
+    if total == 0:
+        return np.zeros(EMBEDDING_SIZE, dtype=np.float32)
+    return np.sqrt(histogram / total).astype(np.float32)
+
+
+def hash_bits(p_hash):
+    """The bits of a hex pHash string as a uint8 array."""
+    if len(p_hash) % 2:
+        p_hash = "0" + p_hash
+    return np.unpackbits(np.frombuffer(bytes.fromhex(p_hash), dtype=np.uint8))
+
+
+class IdentityIndex:
+    """In-memory copy of the fish_identities table for nearest-match lookups."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._size = 0
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._hash_lengths = np.zeros(0, dtype=np.int32)
+        self._bits = np.zeros((0, 0), dtype=np.uint8)
+        self._embeddings = np.zeros((0, EMBEDDING_SIZE), dtype=np.float32)
+
+    def __len__(self):
+        return self._size
+
+    def _append(self, identity_id, p_hash, embedding):
+        bits = hash_bits(p_hash)
+        if self._size == len(self._ids) or len(bits) > self._bits.shape[1]:
+            # Grow by doubling so that appending stays cheap
+            capacity = max(256, 2 * len(self._ids))
+            width = max(len(bits), self._bits.shape[1])
+            ids = np.zeros(capacity, dtype=np.int64)
+            hash_lengths = np.zeros(capacity, dtype=np.int32)
+            all_bits = np.zeros((capacity, width), dtype=np.uint8)
+            embeddings = np.zeros((capacity, EMBEDDING_SIZE), dtype=np.float32)
+            ids[: self._size] = self._ids[: self._size]
+            hash_lengths[: self._size] = self._hash_lengths[: self._size]
+            all_bits[: self._size, : self._bits.shape[1]] = self._bits[: self._size]
+            embeddings[: self._size] = self._embeddings[: self._size]
+            self._ids, self._hash_lengths = ids, hash_lengths
+            self._bits, self._embeddings = all_bits, embeddings
+
+        row = self._size
+        self._ids[row] = identity_id
+        self._hash_lengths[row] = len(p_hash)
+        self._bits[row, : len(bits)] = bits
+        self._embeddings[row] = embedding
+        self._size += 1
+
+    def sync(self):
+        """Loads the identities created since the last sync (by any process)."""
+        for row in get_identities_since(self._last_id):
+            self._append(
+                row["id"],
+                row["perceptual_hash"],
+                np.frombuffer(row["embedding"], dtype=np.float32),
+            )
+            self._last_id = row["id"]
+
+    def match(self, p_hash, embedding):
+        """Returns the ID of the closest matching identity, or None."""
+        if not self._size:
+            return None
+        size = self._size
+        bits = hash_bits(p_hash)
+        # Only hashes of the same size are comparable
+        candidates = self._hash_lengths[:size] == len(p_hash)
+        distances = np.count_nonzero(
+            self._bits[:size, : len(bits)] != bits, axis=1
+        )
+        candidates &= distances <= IDENTITY_HASH_THRESHOLD
+        if not candidates.any():
+            return None
+        rows = np.flatnonzero(candidates)
+        similarities = self._embeddings[rows] @ embedding
+        good = similarities >= IDENTITY_EMBEDDING_THRESHOLD
+        if not good.any():
+            return None
+        rows, similarities = rows[good], similarities[good]
+        # Fewest differing bits first, then the most similar colours
+        best = np.lexsort((-similarities, distances[rows]))[0]
+        return int(self._ids[rows[best]])
+
+    def assign(self, fish_id, p_hash, crop):
+        """
+        Links a new fish entry to its identity, creating one if nothing
+        matches. Returns True if the fish has to be characterized.
+        """
+        embedding = crop_embedding(crop)
+        with self._lock:
+            with span("identity_lookup"):
+                self.sync()
+                identity_id = self.match(p_hash, embedding)
+            if identity_id is None:
+                identity_id = create_identity(fish_id, p_hash, embedding.tobytes())
+                self.sync()
+                increment("fish_identities_total", outcome="new")
+                print(f"Fish ID {fish_id} is new global identity {identity_id}.")
+                return True
+
+        needs_characterization = link_fish_to_identity(fish_id, identity_id)
+        increment("fish_identities_total", outcome="matched")
+        print(f"Fish ID {fish_id} is a sighting of global identity {identity_id}.")
+        return needs_characterization
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Returns the process-wide identity index, loading it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = IdentityIndex()
+                index.sync()
+                print(f"Loaded global identity index with {len(index)} identities.")
+                _index = index
+    return _index
+
+
+def needs_characterization(fish_id, p_hash, crop):
+    """
+    Whether a new fish entry has to be sent to Gemini. Always True unless
+    GLOBAL_IDENTITY_INDEX is on, in which case only fish of identities that
+    are not (being) characterized yet are.
+    """
+    if not GLOBAL_IDENTITY_INDEX:
+        return True
+    try:
+        return get_index().assign(fish_id, p_hash, crop)
+    except Exception as e:
+        print(f"Error matching fish ID {fish_id} against the identity index: {e}")
+        return True
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Headless batch ingestion of directories of videos.
+
+Detection runs in a pool of worker processes (one video per process at a
+time, each with its own model unless MODEL_SERVER_ADDRESS points them at a
+shared model_server.py). Every new fish is put on one shared queue that a
+pool of characterization threads in this process drains with
+get_fish_taxonomy; the Gemini rate limit (GEMINI_RPM) is shared by all of
+them.
+
+Videos whose content was already fully processed (same fingerprint as a
+completed video) are skipped, and videos with an unfinished detection
+checkpoint are resumed. Fish left pending by an earlier run are queued again.
+
+    python ingest.py /data/dives --detection-workers 4 --llm-workers 8
+    python ingest.py "/data/dives/2024-*/*.mp4" --output ingest.json
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from database import (
+    get_detection_checkpoint,
+    get_pending_fish,
+    get_status_counts,
+    get_video,
+    link_video_alias,
+    register_video,
+)
+from fingerprint import (
+    fingerprint_file,
+    frame_signature,
+    find_duplicate_video,
+    VIDEO_FRAME_SIGNATURE,
+)
+
+load_dotenv()
+
+# --- Configuration ---
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".m4v", ".webm")
+INGEST_DETECTION_WORKERS = int(os.getenv("INGEST_DETECTION_WORKERS", "2"))
+INGEST_LLM_WORKERS = int(os.getenv("INGEST_LLM_WORKERS", "4"))
+
+# Set in each detection process by _init_detection_worker
+_worker_queue = None
+
+
+def find_videos(sources):
+    """Expands directories (recursively) and glob patterns into a sorted list of videos."""
+    videos = set()
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                for name in files:
+                    if name.lower().endswith(VIDEO_EXTENSIONS):
+                        videos.add(os.path.join(root, name))
+        else:
+            for path in glob.glob(source, recursive=True):
+                if os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS):
+                    videos.add(path)
+    return sorted(videos)
+
+
+def _init_detection_worker(detection_queue):
+    global _worker_queue
+    _worker_queue = detection_queue
+
+
+def _detect_video(video_path, video_filename, resume):
+    """Runs in a detection process: processes one video and returns its stats."""
+    # Imported here so that only detection processes load the detector
+    from detector import detect_and_extract_fish
+
+    errors = []
+
+    def progress(current, total, error):
+        if error:
+            errors.append((current, total))
+
+    # Checkpoint counts are cumulative, so only count what this run adds
+    before = get_detection_checkpoint(video_filename) if resume else None
+    start_time = time.time()
+    detect_and_extract_fish(
+        video_path, _worker_queue, progress, resume=resume, video_filename=video_filename
+    )
+    checkpoint = get_detection_checkpoint(video_filename)
+    frames = new_fish = 0
+    if checkpoint:
+        frames = checkpoint["processed_frame_count"]
+        new_fish = checkpoint["detected_count"]
+        if before:
+            frames -= before["processed_frame_count"]
+            new_fish -= before["detected_count"]
+    return {
+        "video": video_filename,
+        "seconds": round(time.time() - start_time, 3),
+        "frames": frames,
+        "new_fish": new_fish,
+        "completed": bool(checkpoint and checkpoint["completed"]),
+        "error": bool(errors),
+    }
+
+
+def video_filename_for(video_path, fingerprint, batch_fingerprints):
+    """
+    Name a video is stored under: its basename, unless other content already
+    uses that name (in this batch or in the database, e.g. the GOPR0001.MP4
+    of another dive folder). Then the start of its fingerprint is appended,
+    so reruns keep finding the same name.
+    """
+    video_filename = os.path.basename(video_path)
+    registered = get_video(video_filename)
+    taken = any(
+        name == video_filename and other != fingerprint
+        for other, name in batch_fingerprints.items()
+    ) or (
+        registered is not None
+        and registered["fingerprint"] is not None
+        and registered["fingerprint"] != fingerprint
+    )
+    if not taken:
+        return video_filename
+    stem, extension = os.path.splitext(video_filename)
+    return f"{stem}_{fingerprint[:12]}{extension}"
+
+
+def prepare_video(video_path, force=False, batch_fingerprints=None):
+    """
+    Registers a video and decides what to do with it.
+
+    Args:
+        video_path: Path to the video file
+        force: Process the video even if identical content was processed before
+        batch_fingerprints: Dict of fingerprint -> video filename of the videos
+            queued so far in this batch, so that copies are only processed once
+
+    Returns (action, duplicate_of, video_filename): ("skip", duplicate_of) for
+    content that was already fully processed, ("resume", None) for an
+    unfinished checkpoint, or ("new", None), and the name the video is
+    stored under (see video_filename_for).
+    """
+    fingerprint, size_bytes = fingerprint_file(video_path)
+    signature = frame_signature(video_path) if VIDEO_FRAME_SIGNATURE else None
+    if batch_fingerprints is None:
+        batch_fingerprints = {}
+    video_filename = video_filename_for(video_path, fingerprint, batch_fingerprints)
+
+    if not force:
+        duplicate_of = batch_fingerprints.get(fingerprint) or find_duplicate_video(
+            fingerprint, signature
+        )
+        if duplicate_of:
+            if duplicate_of != video_filename:
+                link_video_alias(video_filename, duplicate_of)
+            return "skip", duplicate_of, video_filename
+
+    register_video(video_filename, fingerprint, size_bytes, signature)
+    batch_fingerprints[fingerprint] = video_filename
+    checkpoint = get_detection_checkpoint(video_filename)
+    if checkpoint and not checkpoint["completed"] and not force:
+        return "resume", None, video_filename
+    return "new", None, video_filename
+
+
+class CharacterizationPool:
+    """Threads that characterize queued fish with get_fish_taxonomy."""
+
+    def __init__(self, detection_queue, workers):
+        self.detection_queue = detection_queue
+        self.workers = workers
+        self.detection_done = threading.Event()
+        self.characterized = 0
+        self._count_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"characterize-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        # Imported here so that detection processes never load the Gemini client
+        from llm_handler import get_fish_taxonomy
+
+        while True:
+            try:
+                task = self.detection_queue.get(timeout=1)
+            except queue.Empty:
+                if self.detection_done.is_set():
+                    break
+                continue
+            try:
+                get_fish_taxonomy(task["id"], task["filename"])
+            except Exception as e:
+                print(f"Error characterizing fish ID {task['id']}: {e}")
+            with self._count_lock:
+                self.characterized += 1
+
+    def join(self):
+        """Waits for the queue to drain once detection has finished."""
+        self.detection_done.set()
+        for thread in self._threads:
+            thread.join()
+
+
+def ingest(sources, detection_workers, llm_workers, force=False, skip_llm=False):
+    """
+    Processes every video found in `sources` and returns aggregate statistics.
+
+    Args:
+        sources: Directories and/or glob patterns of videos
+        detection_workers: Number of detection processes
+        llm_workers: Number of characterization threads
+        force: Reprocess videos even if identical content was processed before
+        skip_llm: Only run detection; fish stay pending for a later run
+    """
+    videos = find_videos(sources)
+    print(f"Found {len(videos)} videos.")
+    start_time = time.time()
+
+    # A manager queue can be shared with the pool processes, and every put()
+    # has arrived by the time the detection future completes
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    detection_queue = manager.Queue()
+
+    stats = {
+        "videos_found": len(videos),
+        "videos_processed": 0,
+        "videos_skipped": 0,
+        "videos_failed": 0,
+        "frames": 0,
+        "new_fish": 0,
+        "requeued_fish": 0,
+        "characterized": 0,
+        "videos": [],
+    }
+    jobs = []
+    batch_fingerprints = {}
+    video_filenames = []
+    for video_path in videos:
+        try:
+            action, duplicate_of, video_filename = prepare_video(
+                video_path, force, batch_fingerprints
+            )
+        except Exception as e:
+            print(f"Skipping {video_path}: {e}")
+            stats["videos_failed"] += 1
+            continue
+
+        video_filenames.append(video_filename)
+        if video_filename != os.path.basename(video_path):
+            print(f"Storing {video_path} as {video_filename} (another video has its name).")
+        if action == "skip":
+            print(f"Skipping {video_path}: already processed as {duplicate_of}.")
+            stats["videos_skipped"] += 1
+            video_filename = duplicate_of
+        else:
+            jobs.append((video_path, video_filename, action == "resume"))
+
+        if action != "new" and not skip_llm:
+            # Fish detected by an earlier run that never got characterized
+            for fish in get_pending_fish(video_filename):
+                detection_queue.put(
+                    {
+                        "id": fish["id"],
+                        "filename": fish["image_filename"],
+                        "video": fish["video_filename"],
+                    }
+                )
+                stats["requeued_fish"] += 1
+
+    pool = None
+    if not skip_llm:
+        pool = CharacterizationPool(detection_queue, llm_workers)
+        pool.start()
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=detection_workers,
+            mp_context=context,
+            initializer=_init_detection_worker,
+            initargs=(detection_queue,),
+        ) as executor:
+            futures = {
+                executor.submit(_detect_video, video_path, video_filename, resume): video_path
+                for video_path, video_filename, resume in jobs
+            }
+            for future in as_completed(futures):
+                video_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Detection failed for {video_path}: {e}")
+                    stats["videos_failed"] += 1
+                    continue
+                stats["videos"].append(result)
+                if result["error"] or not result["completed"]:
+                    stats["videos_failed"] += 1
+                else:
+                    stats["videos_processed"] += 1
+                stats["frames"] += result["frames"]
+                stats["new_fish"] += result["new_fish"]
+                print(
+                    f"Detection finished for {result['video']} in {result['seconds']}s: "
+                    f"{result['frames']} frames, {result['new_fish']} new fish "
+                    f"({len(stats['videos'])}/{len(jobs)} videos)."
+                )
+    except KeyboardInterrupt:
+        # Checkpoints are saved periodically, so the next run resumes these videos
+        print("Interrupted; unfinished videos will be resumed on the next run.")
+        raise
+    finally:
+        if pool:
+            pool.join()
+            stats["characterized"] = pool.characterized
+        manager.shutdown()
+
+    elapsed = time.time() - start_time
+    stats["seconds"] = round(elapsed, 3)
+    stats["frames_per_second"] = round(stats["frames"] / elapsed, 2) if elapsed else None
+    stats["fish_per_second"] = round(stats["new_fish"] / elapsed, 3) if elapsed else None
+    stats["videos_per_hour"] = (
+        round(stats["videos_processed"] / elapsed * 3600, 1) if elapsed else None
+    )
+    stats["status_counts"] = get_status_counts(video_filenames)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Detect and characterize fish in directories of videos."
+    )
+    parser.add_argument(
+        "sources", nargs="+", help="Video directories (searched recursively) or glob patterns"
+    )
+    parser.add_argument(
+        "--detection-workers",
+        type=int,
+        default=INGEST_DETECTION_WORKERS,
+        help="Detection processes (default INGEST_DETECTION_WORKERS)",
+    )
+    parser.add_argument(
+        "--llm-workers",
+        type=int,
+        default=INGEST_LLM_WORKERS,
+        help="Characterization threads sharing the Gemini rate limit (default INGEST_LLM_WORKERS)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Reprocess videos even if identical content was processed before",
+    )
+    parser.add_argument(
+        "--skip-llm", action="store_true", help="Only run detection"
+    )
+    parser.add_argument("--output", help="Also write the statistics to this JSON file")
+    args = parser.parse_args()
+
+    stats = ingest(
+        args.sources, args.detection_workers, args.llm_workers, args.force, args.skip_llm
+    )
+    print(
+        f"Processed {stats['videos_processed']} videos "
+        f"({stats['videos_skipped']} skipped, {stats['videos_failed']} failed) in {stats['seconds']}s: "
+        f"{stats['frames']} frames ({stats['frames_per_second']}/s), "
+        f"{stats['new_fish']} new fish ({stats['fish_per_second']}/s), "
+        f"{stats['characterized']} characterized, {stats['videos_per_hour']} videos/hour."
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(stats, f, indent=2)
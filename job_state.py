@@ -0,0 +1,306 @@
+"""
+Job and progress state shared by every process serving the app.
+
+Under gunicorn with several workers each request may land on another
+process, so the progress of the running job, the selected video and the
+order of the characterization queue live in a shared backend instead of
+module globals:
+
+- "sqlite" (default): the job_state table of FISH_DATABASE, plus the
+  job_commands change log through which any process sends commands (stop,
+  bump, ...) to the process that runs the job
+- "redis" (JOB_STATE_BACKEND=redis): the same in Redis at REDIS_URL; needs
+  the redis package
+
+Only one job runs at a time. The process that claims it (claim_job) runs the
+detection and LLM threads and keeps a heartbeat in the progress state. The
+job stays claimed after detection until the owner's LLM worker has drained
+its queue, as the fish in it only exist in that process; a job whose owner
+stopped sending heartbeats for JOB_STALE_SECONDS (e.g. a worker that was
+killed) no longer blocks new jobs.
+"""
+
+import copy
+import json
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from database import (
+    get_job_state,
+    set_job_state,
+    edit_job_state,
+    add_job_command,
+    take_job_commands,
+)
+
+load_dotenv()
+
+# --- Configuration ---
+JOB_STATE_BACKEND = os.getenv("JOB_STATE_BACKEND", "sqlite").lower()  # "sqlite" or "redis"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+JOB_STALE_SECONDS = float(
+    os.getenv("JOB_STALE_SECONDS", "60")
+)  # A running job without a heartbeat for this long is considered dead
+
+# Identifies this process as the owner of a job
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+DEFAULT_PROGRESS = {
+    "detection": {"current": 0, "total": 1, "error": False, "message": "Idle"},
+    "characterization": {"current": 0, "total": 0, "error": False, "message": "Idle"},
+    "processing_active": False,
+    "characterizing": False,  # Detection is over, the owner still drains its queue
+    "owner": None,  # PROCESS_ID of the process running the job
+    "heartbeat": 0,
+    "video": None,
+    "upload_id": None,
+}
+
+
+class SQLiteJobState:
+    """Shared state in the job_state and job_commands tables."""
+
+    def get(self, key):
+        return get_job_state(key)
+
+    def set(self, key, value):
+        set_job_state(key, value)
+
+    def edit(self, key, default):
+        return edit_job_state(key, default)
+
+    def send_command(self, target, command, args):
+        add_job_command(target, command, args)
+
+    def take_commands(self, target):
+        return take_job_commands(target)
+
+
+class RedisJobState:
+    """Shared state in Redis: one JSON string per key and a command list per process."""
+
+    def __init__(self, url, prefix="fish:"):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        value = self._redis.get(self._prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self._redis.set(self._prefix + key, json.dumps(value))
+
+    @contextmanager
+    def edit(self, key, default):
+        # A lock rather than WATCH/MULTI, so the block runs exactly once
+        with self._redis.lock(self._prefix + "lock:" + key, timeout=30):
+            value = self.get(key)
+            if value is None:
+                value = copy.deepcopy(default)
+            yield value
+            self.set(key, value)
+
+    def send_command(self, target, command, args):
+        commands_key = self._prefix + "commands:" + target
+        pipe = self._redis.pipeline()
+        pipe.rpush(commands_key, json.dumps([command, args or {}]))
+        pipe.expire(commands_key, 3600)  # Dropped if the target has exited
+        pipe.execute()
+
+    def take_commands(self, target):
+        commands_key = self._prefix + "commands:" + target
+        pipe = self._redis.pipeline()
+        pipe.lrange(commands_key, 0, -1)
+        pipe.delete(commands_key)
+        entries, _ = pipe.execute()
+        return [tuple(json.loads(entry)) for entry in entries]
+
+
+_backend = None
+
+
+def get_backend():
+    """Returns the configured backend, connecting on first use."""
+    global _backend
+    if _backend is None:
+        if JOB_STATE_BACKEND == "redis":
+            _backend = RedisJobState(REDIS_URL)
+            print(f"Sharing job state through Redis at {REDIS_URL}")
+        else:
+            _backend = SQLiteJobState()
+    return _backend
+
+
+class JobBusyError(RuntimeError):
+    """A new job could not be claimed because another one is running."""
+
+
+# --- Progress of the running job ---
+def get_progress():
+    """The progress of the current (or last) job."""
+    progress = get_backend().get("progress")
+    return progress if progress is not None else copy.deepcopy(DEFAULT_PROGRESS)
+
+
+def edit_progress():
+    """Context manager yielding the progress dict for an atomic update."""
+    return get_backend().edit("progress", DEFAULT_PROGRESS)
+
+
+@contextmanager
+def edit_own_progress():
+    """
+    Like edit_progress(), for the threads of a job: changes are only stored
+    while this process still owns the job, so a job that was stopped (and
+    replaced by another process's job) cannot overwrite its successor.
+    """
+    with edit_progress() as progress:
+        yield progress if owns_job(progress) else copy.deepcopy(progress)
+
+
+def is_busy(progress=None):
+    """Whether a job is running (detecting or characterizing) in any process."""
+    progress = progress if progress is not None else get_progress()
+    return (
+        (progress["processing_active"] or progress.get("characterizing", False))
+        and time.time() - progress.get("heartbeat", 0) < JOB_STALE_SECONDS
+    )
+
+
+def owns_job(progress=None):
+    """Whether this process runs the current (or last) job."""
+    progress = progress if progress is not None else get_progress()
+    return progress.get("owner") == PROCESS_ID
+
+
+def claim_job(video_filename=None, upload_id=None):
+    """
+    Makes this process the owner of a new job and resets the progress.
+    Returns False if another job is still running.
+
+    Args:
+        video_filename: Video the job processes (None for live streams)
+        upload_id: Chunked upload that is being detected on while it arrives
+    """
+    with edit_progress() as progress:
+        if is_busy(progress):
+            return False
+        progress["detection"] = {
+            "current": 0,
+            "total": 1,
+            "error": False,
+            "message": "Initializing...",
+        }
+        progress["characterization"] = {
+            "current": 0,
+            "total": 0,
+            "error": False,
+            "message": "Waiting for detection...",
+        }
+        progress["processing_active"] = True
+        progress["characterizing"] = False
+        progress["owner"] = PROCESS_ID
+        progress["heartbeat"] = time.time()
+        progress["video"] = video_filename
+        progress["upload_id"] = upload_id
+    return True
+
+
+def finish_job():
+    """
+    Marks the job of this process as no longer adding work. It stays claimed
+    until finish_characterization() is called once its queue has drained.
+    """
+    with edit_own_progress() as progress:
+        progress["processing_active"] = False
+        progress["characterizing"] = True
+        progress["upload_id"] = None
+
+
+def finish_characterization():
+    """Releases the job of this process once its LLM worker has no fish left."""
+    with edit_own_progress() as progress:
+        progress["characterizing"] = False
+
+
+def heartbeat():
+    """Records that the job of this process is still alive."""
+    with edit_own_progress() as progress:
+        progress["heartbeat"] = time.time()
+
+
+# --- Selected video and queue ---
+# This process's copy of the selected video, for readers that must not wait
+# on the backend (the queue orders fish under its lock)
+_selected_video = None
+
+
+def get_selected_video():
+    """
+    The video shown in the results view (its fish are characterized first).
+    Also refreshes the copy returned by cached_selected_video().
+    """
+    global _selected_video
+    _selected_video = get_backend().get("selected_video")
+    return _selected_video
+
+
+def cached_selected_video():
+    """The selected video as last read or set by this process."""
+    return _selected_video
+
+
+def set_selected_video(video_filename):
+    global _selected_video
+    get_backend().set("selected_video", video_filename)
+    _selected_video = video_filename
+
+
+def publish_queue(snapshot):
+    """Stores the owner's view of the characterization queue for other processes."""
+    get_backend().set("queue", dict(snapshot, published_at=time.time()))
+
+
+def get_queue_snapshot():
+    snapshot = get_backend().get("queue")
+    if snapshot is None:
+        return {"size": 0, "oldest_wait_seconds": 0, "tasks": []}
+    return snapshot
+
+
+def live_fish_waiting():
+    """
+    Whether fish of the current job wait for characterization (in whichever
+    process runs it). Reprocessing jobs (reprocess.py) wait for them.
+    """
+    snapshot = get_queue_snapshot()
+    # The owner publishes a waiting queue every second, unless it died
+    return (
+        snapshot["size"] > 0
+        and time.time() - snapshot.get("published_at", 0) < JOB_STALE_SECONDS
+    )
+
+
+# --- Commands for the job owner ---
+def send_command(command, **args):
+    """
+    Sends a command to the process running the current job. Returns False
+    if there is no such process.
+    """
+    owner = get_progress().get("owner")
+    if not owner:
+        return False
+    get_backend().send_command(owner, command, args)
+    return True
+
+
+def take_commands():
+    """The commands sent to this process since the last call, in order."""
+    return get_backend().take_commands(PROCESS_ID)
@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Live-stream ingestion for continuous camera feeds.
+
+detect_and_extract_fish() needs a finite file with a known frame count. For
+cameras (RTSP/HTTP URLs, device indexes, or a looped local file standing in
+for one), detect_stream() instead:
+
+- reads the source continuously in a reader thread and samples a frame every
+  SECONDS_BETWEEN_FRAMES of wall-clock time (frames in between are only
+  grabbed, not decoded into arrays)
+- hands sampled frames to the detector through a bounded buffer; when
+  detection falls behind, the oldest frames are dropped rather than letting
+  the backlog grow, and frames older than STREAM_MAX_FRAME_AGE are skipped.
+  Frames are decoded into reused buffers of a FramePool, so the buffered
+  frames also stay within FRAME_MEMORY_BUDGET_MB
+- writes detections into rolling segments of STREAM_SEGMENT_SECONDS, each
+  stored like a video of its own ("<stream>_<YYYYmmdd_HHMMSS>") with
+  timestamps relative to the segment start
+- reports progress as rates (frames/min, fish/min, dropped frames) instead of
+  a percentage
+
+    python live_stream.py rtsp://camera.local/reef --name reef1
+    python live_stream.py sample.mp4 --loop --segment-seconds 300
+"""
+
+import argparse
+import collections
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import cv2
+from dotenv import load_dotenv
+
+from batch_phash import phash_batch
+from crop_store import save_crop, CROP_STORAGE
+from database import (
+    add_or_update_fish,
+    save_detection_checkpoint,
+    record_detection_start,
+    record_detection_end,
+    IMAGE_DIR,
+)
+from identity_index import needs_characterization
+from detector import (
+    get_model,
+    get_video_dirname,
+    format_timestamp,
+    get_detection_config,
+    context_crop,
+    crop_quality,
+    filter_boxes,
+    format_rejections,
+    CONFIDENCE_THRESHOLD,
+    HASH_SIZE,
+    SECONDS_BETWEEN_FRAMES,
+)
+from frame_pool import FramePool, frame_shape
+from metrics import span, increment
+
+load_dotenv()
+
+# --- Configuration ---
+STREAM_BUFFER_FRAMES = int(
+    os.getenv("STREAM_BUFFER_FRAMES", "4")
+)  # Sampled frames waiting for detection; the oldest is dropped when full
+STREAM_MAX_FRAME_AGE = float(
+    os.getenv("STREAM_MAX_FRAME_AGE", "30")
+)  # Seconds after which a buffered frame is too stale to process
+STREAM_SEGMENT_SECONDS = float(
+    os.getenv("STREAM_SEGMENT_SECONDS", "600")
+)  # Length of the rolling segments detections are stored in
+STREAM_RECONNECT_SECONDS = 5.0  # Wait before reopening a stream that failed
+STREAM_RATE_WINDOW = 60.0  # Seconds over which rates are reported
+
+
+def parse_source(source):
+    """Camera indexes are given as digits ("0"); anything else is a path or URL."""
+    return int(source) if str(source).isdigit() else source
+
+
+def stream_name_for(source):
+    """Default stream name: the file/URL stem, or camera<N> for device indexes."""
+    source = parse_source(source)
+    if isinstance(source, int):
+        return f"camera{source}"
+    return get_video_dirname(str(source).rstrip("/")) or "stream"
+
+
+class FrameBuffer:
+    """
+    Thread-safe bounded FIFO of sampled frames that drops stale frames.
+    Dropped frames go back to `frame_pool` if given.
+    """
+
+    def __init__(
+        self, max_frames=STREAM_BUFFER_FRAMES, max_age=STREAM_MAX_FRAME_AGE, frame_pool=None
+    ):
+        self.max_frames = max(1, max_frames)
+        self.max_age = max_age
+        self.frame_pool = frame_pool
+        self.dropped = 0
+        self._frames = collections.deque()
+        self._condition = threading.Condition()
+
+    def _drop(self, frame):
+        self.dropped += 1
+        increment("fish_stream_frames_dropped_total")
+        if self.frame_pool is not None:
+            self.frame_pool.release(frame)
+
+    def put(self, frame, captured_at):
+        with self._condition:
+            if len(self._frames) >= self.max_frames:
+                self._drop(self._frames.popleft()[0])
+            self._frames.append((frame, captured_at, time.monotonic()))
+            self._condition.notify()
+
+    def drop_oldest(self):
+        """Drops the oldest frame (to free its buffer); False if there is none."""
+        with self._condition:
+            if not self._frames:
+                return False
+            self._drop(self._frames.popleft()[0])
+            return True
+
+    def get(self, timeout=1.0):
+        """Returns the oldest fresh (frame, captured_at), or None after `timeout`."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frames, timeout):
+                return None
+            while self._frames:
+                frame, captured_at, queued_at = self._frames.popleft()
+                if time.monotonic() - queued_at <= self.max_age:
+                    return frame, captured_at
+                self._drop(frame)
+            return None
+
+    def __len__(self):
+        with self._condition:
+            return len(self._frames)
+
+    def clear(self):
+        """Drops every waiting frame."""
+        with self._condition:
+            while self._frames:
+                frame = self._frames.popleft()[0]
+                if self.frame_pool is not None:
+                    self.frame_pool.release(frame)
+
+
+class StreamReader(threading.Thread):
+    """
+    Reads a capture source continuously and samples frames into a FrameBuffer,
+    decoding them into buffers of the FrameBuffer's frame pool.
+
+    Args:
+        source: Anything cv2.VideoCapture accepts (URL, path or device index)
+        frame_buffer: FrameBuffer (with a frame_pool) receiving the sampled frames
+        sample_interval: Wall-clock seconds between sampled frames
+        loop: For files: start over at the end instead of finishing
+    """
+
+    def __init__(self, source, frame_buffer, sample_interval=SECONDS_BETWEEN_FRAMES, loop=False):
+        super().__init__(name="stream-reader", daemon=True)
+        self.source = parse_source(source)
+        self.frame_buffer = frame_buffer
+        self.sample_interval = sample_interval
+        self.loop = loop
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        self.frames_read = 0
+        self.stop_event = threading.Event()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source)
+        if cap.isOpened():
+            print(f"Opened stream {self.source}")
+            return cap
+        cap.release()
+        print(f"Could not open stream {self.source}")
+        return None
+
+    def run(self):
+        cap = None
+        last_sample = -float("inf")
+        next_frame_time = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                if cap is None:
+                    cap = self._open()
+                    if cap is None:
+                        if self.is_file:
+                            break
+                        self.stop_event.wait(STREAM_RECONNECT_SECONDS)
+                        continue
+                    # A file stands in for a camera by being read at its own frame rate
+                    frame_interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 25.0)
+                    shape = frame_shape(cap)
+
+                # Keep grabbing every frame so a live source never lags behind
+                with span("decode"):
+                    grabbed = cap.grab()
+                if not grabbed:
+                    if self.is_file and self.loop:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    if self.is_file:
+                        print(f"End of {self.source}.")
+                        break
+                    print(f"Lost stream {self.source}; reconnecting...")
+                    cap.release()
+                    cap = None
+                    self.stop_event.wait(STREAM_RECONNECT_SECONDS)
+                    continue
+                self.frames_read += 1
+
+                if self.is_file:
+                    next_frame_time += frame_interval
+                    delay = next_frame_time - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_frame_time = time.monotonic()
+
+                now = time.monotonic()
+                if now - last_sample >= self.sample_interval:
+                    frame_pool = self.frame_buffer.frame_pool
+                    # Never wait for a buffer: when the waiting frames use up the
+                    # memory budget, the oldest one makes room
+                    buffer = frame_pool.acquire(shape, timeout=0)
+                    if buffer is None and self.frame_buffer.drop_oldest():
+                        buffer = frame_pool.acquire(shape, timeout=0)
+                    if buffer is None:
+                        continue  # Detection still holds every buffer
+                    with span("decode"):
+                        ret, frame = cap.retrieve(buffer)
+                    if ret:
+                        frame_pool.replace(buffer, frame)
+                        shape = frame.shape
+                        last_sample = now
+                        self.frame_buffer.put(frame, time.time())
+                    else:
+                        frame_pool.release(buffer)
+        finally:
+            if cap is not None:
+                cap.release()
+
+
+class StreamSegment:
+    """Detections of one rolling segment, stored under its own video name."""
+
+    def __init__(self, stream_name, started_at):
+        self.started_at = started_at
+        self.video_filename = (
+            f"{stream_name}_{datetime.fromtimestamp(started_at):%Y%m%d_%H%M%S}"
+        )
+        self.video_dirname = get_video_dirname(self.video_filename)
+        self.frames = 0
+        self.new_fish = 0
+        self.rejected = {}  # Boxes filtered out by filter_boxes(), per filter
+        self.last_offset = 0.0
+        if CROP_STORAGE != "pack":
+            os.makedirs(os.path.join(IMAGE_DIR, self.video_dirname), exist_ok=True)
+        record_detection_start(self.video_filename, None, None, get_detection_config())
+        print(f"Started stream segment {self.video_filename}")
+
+    def store(self, frame, results, captured_at, detection_queue):
+        """Crops, hashes and stores the detections of one frame; returns new fish count."""
+        self.frames += 1
+        self.last_offset = captured_at - self.started_at
+        timestamp_str = format_timestamp(self.last_offset)
+
+        crops = []
+        crop_boxes = []
+        crop_confidences = []
+        for result in results:
+            boxes = result.boxes
+            kept_boxes, kept_confidences = filter_boxes(
+                boxes.xyxy, boxes.conf, boxes.cls, rejected=self.rejected
+            )
+            for (x1, y1, x2, y2), box_confidence in zip(
+                kept_boxes.tolist(), kept_confidences.tolist()
+            ):
+                cropped_fish = frame[y1:y2, x1:x2]
+                if cropped_fish.size > 0:
+                    crops.append(cropped_fish)
+                    crop_boxes.append((x1, y1, x2, y2))
+                    crop_confidences.append(box_confidence)
+        with span("phash"):
+            p_hashes = phash_batch(crops, HASH_SIZE)
+
+        new_fish = 0
+        for cropped_fish, crop_box, confidence, p_hash in zip(
+            crops, crop_boxes, crop_confidences, p_hashes
+        ):
+            try:
+                image_filename = f"fish_{uuid.uuid4()}.png"
+                with span("imwrite"):
+                    rel_image_path = save_crop(
+                        self.video_dirname, image_filename, context_crop(frame, *crop_box)
+                    )
+                new_fish_id = add_or_update_fish(
+                    rel_image_path, self.video_filename, timestamp_str, p_hash
+                )
+                increment("fish_detections_total")
+                if new_fish_id:
+                    new_fish += 1
+                    if needs_characterization(new_fish_id, p_hash, cropped_fish):
+                        detection_queue.put(
+                            {
+                                "id": new_fish_id,
+                                "filename": rel_image_path,
+                                "video": self.video_filename,
+                                "quality": crop_quality(cropped_fish, confidence),
+                            }
+                        )
+            except Exception as e:
+                print(f"Error storing detection of {self.video_filename} at {timestamp_str}: {e}")
+        self.new_fish += new_fish
+        return new_fish
+
+    def finish(self, source):
+        """Records the segment as a completed detection run."""
+        config = get_detection_config()
+        config["stream_source"] = str(source)
+        save_detection_checkpoint(
+            self.video_filename,
+            self.last_offset,
+            self.frames,
+            self.frames,
+            self.new_fish,
+            config,
+            completed=True,
+        )
+        # Detection of a live segment takes as long as the segment
+        record_detection_end(self.video_filename, self.last_offset, completed=True)
+        print(
+            f"Finished stream segment {self.video_filename}: "
+            f"{self.frames} frames, {self.new_fish} new fish ({format_rejections(self.rejected)})."
+        )
+
+
+class RateTracker:
+    """Frames and fish per minute over the last STREAM_RATE_WINDOW seconds."""
+
+    def __init__(self, window=STREAM_RATE_WINDOW):
+        self.window = window
+        self._events = collections.deque()  # (monotonic time, new fish)
+        self._started = time.monotonic()
+
+    def add(self, new_fish):
+        now = time.monotonic()
+        self._events.append((now, new_fish))
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+
+    def rates(self):
+        span_seconds = min(self.window, max(time.monotonic() - self._started, 1e-6))
+        frames = len(self._events)
+        fish = sum(new_fish for _, new_fish in self._events)
+        return (
+            round(frames * 60.0 / span_seconds, 2),
+            round(fish * 60.0 / span_seconds, 2),
+        )
+
+
+def detect_stream(
+    source,
+    detection_queue,
+    progress_callback=None,
+    stop_event=None,
+    stream_name=None,
+    loop=False,
+    segment_seconds=STREAM_SEGMENT_SECONDS,
+):
+    """
+    Detects fish in a continuous stream until it ends or stop_event is set.
+
+    Args:
+        source: Stream URL, file path or camera index
+        detection_queue: Queue for adding detected fish
+        progress_callback: Optional callback receiving a dict of rates
+        stop_event: Optional threading.Event to signal stopping the process
+        stream_name: Prefix of the segment names (default derived from the source)
+        loop: Loop a file source forever, as a stand-in for a camera
+        segment_seconds: Length of the rolling segments
+
+    Returns a dict of totals, or None if the model is not available.
+    """
+    model = get_model()
+    if not model:
+        print("Stream detection cannot proceed: YOLO model not loaded.")
+        return None
+    if stop_event is None:
+        stop_event = threading.Event()
+    if progress_callback is None:
+        progress_callback = lambda stats: None  # noqa: E731
+    stream_name = stream_name or stream_name_for(source)
+
+    frame_pool = FramePool()
+    frame_buffer = FrameBuffer(frame_pool=frame_pool)
+    reader = StreamReader(source, frame_buffer, SECONDS_BETWEEN_FRAMES, loop)
+    rates = RateTracker()
+    totals = {"frames": 0, "new_fish": 0, "segments": []}
+    segment = None
+
+    print(
+        f"Streaming {source} as '{stream_name}': a frame every {SECONDS_BETWEEN_FRAMES}s, "
+        f"{segment_seconds}s segments, buffer of {frame_buffer.max_frames} frames"
+    )
+    reader.start()
+    try:
+        while not stop_event.is_set():
+            item = frame_buffer.get(timeout=1.0)
+            if item is None:
+                if not reader.is_alive() and not len(frame_buffer):
+                    break
+                continue
+            frame, captured_at = item
+
+            if segment is None or captured_at - segment.started_at >= segment_seconds:
+                if segment is not None:
+                    segment.finish(source)
+                segment = StreamSegment(stream_name, captured_at)
+                totals["segments"].append(segment.video_filename)
+
+            with span("predict"):
+                results = model.predict(frame, conf=CONFIDENCE_THRESHOLD, verbose=False)
+            increment("fish_frames_processed_total")
+            new_fish = segment.store(frame, results, captured_at, detection_queue)
+            # Crops are views of the frame, which are all encoded by now
+            frame_pool.release(frame)
+
+            totals["frames"] += 1
+            totals["new_fish"] += new_fish
+            rates.add(new_fish)
+            frames_per_minute, fish_per_minute = rates.rates()
+            progress_callback(
+                {
+                    "segment": segment.video_filename,
+                    "frames_processed": totals["frames"],
+                    "frames_dropped": frame_buffer.dropped,
+                    "new_fish": totals["new_fish"],
+                    "frames_per_minute": frames_per_minute,
+                    "fish_per_minute": fish_per_minute,
+                    "lag_seconds": round(time.time() - captured_at, 2),
+                }
+            )
+    finally:
+        reader.stop_event.set()
+        reader.join(timeout=STREAM_RECONNECT_SECONDS + 1)
+        frame_buffer.clear()
+        frame_pool.clear()
+        if segment is not None:
+            segment.finish(source)
+
+    totals["frames_dropped"] = frame_buffer.dropped
+    totals["frames_read"] = reader.frames_read
+    print(
+        f"Stream {stream_name} stopped: {totals['frames']} frames processed, "
+        f"{totals['frames_dropped']} dropped, {totals['new_fish']} new fish "
+        f"in {len(totals['segments'])} segments."
+    )
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect fish in a live video stream.")
+    parser.add_argument("source", help="Stream URL, video file or camera index")
+    parser.add_argument("--name", help="Prefix of the segment names")
+    parser.add_argument(
+        "--loop", action="store_true", help="Loop a video file as a stand-in camera"
+    )
+    parser.add_argument("--segment-seconds", type=float, default=STREAM_SEGMENT_SECONDS)
+    parser.add_argument("--skip-llm", action="store_true", help="Only run detection")
+    parser.add_argument(
+        "--llm-workers", type=int, default=1, help="Characterization threads"
+    )
+    args = parser.parse_args()
+
+    # Imported here so that the module can be used without the ingestion pool
+    from ingest import CharacterizationPool
+
+    detection_queue = queue.Queue()
+    pool = None
+    if not args.skip_llm:
+        pool = CharacterizationPool(detection_queue, args.llm_workers)
+        pool.start()
+
+    def print_rates(stats):
+        if stats["frames_processed"] % 10 == 0:
+            print(
+                f"[{stats['segment']}] {stats['frames_per_minute']} frames/min, "
+                f"{stats['fish_per_minute']} fish/min, {stats['frames_dropped']} dropped, "
+                f"lag {stats['lag_seconds']}s"
+            )
+
+    stop_event = threading.Event()
+    try:
+        detect_stream(
+            args.source,
+            detection_queue,
+            print_rates,
+            stop_event,
+            args.name,
+            args.loop,
+            args.segment_seconds,
+        )
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        if pool:
+            pool.join()
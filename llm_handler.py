@@ -1,28 +1,352 @@
-import google.generativeai as genai
 import os
 import time
+import heapq
 import json
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import io
 from database import update_fish_status, IMAGE_DIR
+from crop_store import read_packed_crop
+from metrics import span, observe, increment
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Configure Gemini model
-try:
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    # Using gemini-1.5-flash for potential better vision capabilities and speed
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    print("Gemini Model configured.")
-except Exception as e:
-    print(f"Error configuring Gemini: {e}")
-    model = None
+# --- Model cascade ---
+# With LLM_FIRST_PASS_MODEL set, every crop first goes to that cheaper model and
+# is only sent to LLM_MODEL when the answer is not good enough (too many
+# "Unknown" ranks or a low self-reported confidence). Without it, LLM_MODEL
+# characterizes every crop as before. Prices are USD per million input and
+# output tokens, used for the cost recorded with each taxonomy.
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash")
+LLM_MODEL_PRICE = os.getenv("LLM_MODEL_PRICE", "0.10,0.40")
+LLM_FIRST_PASS_MODEL = os.getenv("LLM_FIRST_PASS_MODEL", "")  # e.g. gemini-2.0-flash-lite
+LLM_FIRST_PASS_PRICE = os.getenv("LLM_FIRST_PASS_PRICE", "0.075,0.30")
+LLM_ESCALATE_UNKNOWN_RANKS = int(
+    os.getenv("LLM_ESCALATE_UNKNOWN_RANKS", "3")
+)  # Escalate first-pass answers with at least this many "Unknown" ranks
+LLM_ESCALATE_CONFIDENCE = float(
+    os.getenv("LLM_ESCALATE_CONFIDENCE", "0.6")
+)  # Escalate first-pass answers whose confidence is below this
+IMAGE_TOKENS = 258  # Tokens Gemini counts for a small image (used for estimates)
+
+TAXONOMY_RANKS = ("Kingdom", "Phylum", "Class", "Order", "Family", "Genus", "Species")
+
+# google.generativeai is slow to import, so it is imported together with the
+# model configuration on first use (thread-safe)
+genai = None
+_model = None
+_first_pass_model = None
+_model_lock = threading.Lock()
+
+
+def _create_model(model_name):
+    """Configures google.generativeai (once) and returns a model, or None on error."""
+    global genai
+    try:
+        if genai is None:
+            import google.generativeai
+
+            google.generativeai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            genai = google.generativeai
+        model = genai.GenerativeModel(model_name)
+        print(f"Gemini Model {model_name} configured.")
+        return model
+    except Exception as e:
+        print(f"Error configuring Gemini: {e}")
+        return None
+
+
+def get_model():
+    """Returns the shared Gemini model (LLM_MODEL), configuring it on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _create_model(LLM_MODEL)
+    return _model
+
+
+def get_first_pass_model():
+    """
+    Returns the model of the first characterization pass, or None if the
+    cascade is off (LLM_FIRST_PASS_MODEL not set).
+    """
+    global _first_pass_model
+    if _first_pass_model is None and LLM_FIRST_PASS_MODEL:
+        with _model_lock:
+            if _first_pass_model is None:
+                _first_pass_model = _create_model(LLM_FIRST_PASS_MODEL)
+    return _first_pass_model
+
+
+def _parse_price(price):
+    """"input,output" USD per million tokens -> (input, output)."""
+    input_price, _, output_price = price.partition(",")
+    return float(input_price or 0), float(output_price or 0)
 
 # Rate limiting (requests per minute)
 RPM = int(os.getenv("GEMINI_RPM", 60))  # Default to 60 RPM
 REQUEST_INTERVAL = 60.0 / RPM if RPM > 0 else 0
 
+# The rate limit is shared by every thread calling get_fish_taxonomy (e.g. the
+# characterization pool of ingest.py): each request reserves the next free slot
+_rate_limit_lock = threading.Lock()
+_next_request_time = 0.0
+
+
+def wait_for_request_slot():
+    """Blocks until the next Gemini request is allowed under GEMINI_RPM."""
+    global _next_request_time
+    if REQUEST_INTERVAL <= 0:
+        return
+    with _rate_limit_lock:
+        slot = max(time.monotonic(), _next_request_time)
+        _next_request_time = slot + REQUEST_INTERVAL
+    delay = slot - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+# Crops are downsized and re-encoded before they are sent to Gemini
+LLM_MAX_IMAGE_SIDE = int(
+    os.getenv("LLM_MAX_IMAGE_SIDE", "768")
+)  # Longest side in pixels sent to Gemini, 0 keeps the original size
+LLM_JPEG_QUALITY = int(os.getenv("LLM_JPEG_QUALITY", "85"))
+LLM_PREPROCESS_WORKERS = int(
+    os.getenv("LLM_PREPROCESS_WORKERS", "2")
+)  # Threads preparing images ahead of the API calls
+LLM_PREFETCH = int(
+    os.getenv("LLM_PREFETCH", "8")
+)  # Queued tasks whose images are prepared ahead
+
+# Characterization queue order (see CharacterizationQueue)
+QUEUE_AGING_SECONDS = float(
+    os.getenv("QUEUE_AGING_SECONDS", "60")
+)  # Waiting this long is worth as much as the best crop quality
+QUEUE_SELECTED_VIDEO_BOOST = float(
+    os.getenv("QUEUE_SELECTED_VIDEO_BOOST", "10")
+)  # Head start of the selected video's fish, in aging periods
+_BUMPED_SCORE = 1e9
+
+
+def _find_image(image_filename):
+    """Returns a path or file object for a crop, or None if it is missing."""
+    packed_bytes = read_packed_crop(image_filename)
+    if packed_bytes is not None:
+        # Crop lives in a per-video pack file rather than as a loose PNG
+        return io.BytesIO(packed_bytes)
+
+    image_path = os.path.join(IMAGE_DIR, image_filename)
+    if os.path.exists(image_path):
+        return image_path
+    print(f"⚠️ Image file not found at {image_path}")
+
+    # Try alternate path (for backward compatibility)
+    alternate_path = os.path.join(IMAGE_DIR, os.path.basename(image_filename))
+    if os.path.exists(alternate_path):
+        print(f"Found image at alternate path: {alternate_path}")
+        return alternate_path
+    return None
+
+
+def prepare_image(image_filename):
+    """
+    Loads a crop and re-encodes it as a JPEG no larger than LLM_MAX_IMAGE_SIDE.
+    Returns (image part for generate_content, original size in bytes), or
+    None if the crop cannot be found.
+    """
+    source = _find_image(image_filename)
+    if source is None:
+        return None
+    with span("llm_image_load"):
+        if isinstance(source, io.BytesIO):
+            original_bytes = len(source.getbuffer())
+        else:
+            original_bytes = os.path.getsize(source)
+        with Image.open(source) as img:
+            img = img.convert("RGB")
+        if LLM_MAX_IMAGE_SIDE > 0 and max(img.size) > LLM_MAX_IMAGE_SIDE:
+            img.thumbnail((LLM_MAX_IMAGE_SIDE, LLM_MAX_IMAGE_SIDE), Image.LANCZOS)
+        encoded = io.BytesIO()
+        img.save(encoded, format="JPEG", quality=LLM_JPEG_QUALITY)
+    return {"mime_type": "image/jpeg", "data": encoded.getvalue()}, original_bytes
+
+
+class ImagePrefetcher:
+    """
+    Prepares images in a thread pool ahead of the API calls, so that a
+    request can be sent the moment a rate-limit slot opens.
+    """
+
+    def __init__(self, workers, capacity):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="llm-preprocess"
+        )
+        self._capacity = max(1, capacity)
+        self._futures = OrderedDict()  # image_filename -> Future
+        self._lock = threading.Lock()
+
+    def prefetch(self, image_filename):
+        with self._lock:
+            if image_filename in self._futures:
+                return
+            # Forget the oldest preparations if their tasks never came (e.g.
+            # the queue was cleared)
+            while len(self._futures) >= 4 * self._capacity:
+                self._futures.popitem(last=False)
+            self._futures[image_filename] = self._executor.submit(
+                prepare_image, image_filename
+            )
+
+    def take(self, image_filename):
+        """Returns the prepared image (waiting for it if needed), or prepares it now."""
+        with self._lock:
+            future = self._futures.pop(image_filename, None)
+        if future is None:
+            return prepare_image(image_filename)
+        return future.result()
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """Returns the shared image prefetcher, starting its thread pool on first use."""
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = ImagePrefetcher(LLM_PREPROCESS_WORKERS, LLM_PREFETCH)
+    return _prefetcher
+
+
+class CharacterizationQueue(queue.Queue):
+    """
+    Priority queue of characterization tasks ({"id", "filename", "video",
+    "quality"}). get() returns the task with the highest score:
+
+    - bumped tasks (see bump()) come first
+    - tasks of the selected video get QUEUE_SELECTED_VIDEO_BOOST
+    - better crops (task["quality"], between 0 and 1) go earlier
+    - every QUEUE_AGING_SECONDS of waiting adds 1, so nothing starves
+
+    The selected video and the waiting times change all the time, so scores
+    are computed when a task is taken rather than when it is queued. The
+    images of the next LLM_PREFETCH tasks are prepared in the background.
+    """
+
+    def __init__(self, maxsize=0, selected_video=None):
+        self._selected_video = selected_video or (lambda: None)
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.queue = []
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _score(self, task, now, selected_video):
+        score = task.get("quality", 0.5) + (now - task["queued_at"]) / QUEUE_AGING_SECONDS
+        if task.get("bumped"):
+            score += _BUMPED_SCORE
+        elif selected_video and task.get("video") == selected_video:
+            score += QUEUE_SELECTED_VIDEO_BOOST
+        return score
+
+    def _ordered(self, limit=None):
+        now = time.time()
+        selected_video = self._selected_video()
+
+        def score(task):
+            return self._score(task, now, selected_video)
+
+        if limit is None:
+            # sorted() is stable, so equal scores keep their queueing order
+            return sorted(self.queue, key=score, reverse=True)
+        return heapq.nlargest(limit, self.queue, key=score)
+
+    def _put(self, item):
+        item.setdefault("queued_at", time.time())
+        self.queue.append(item)
+        if LLM_PREFETCH > 0 and len(self.queue) <= LLM_PREFETCH:
+            get_prefetcher().prefetch(item["filename"])
+
+    def _get(self):
+        now = time.time()
+        selected_video = self._selected_video()
+        # max() keeps the first (oldest) of equal scores
+        best = max(
+            range(len(self.queue)),
+            key=lambda i: self._score(self.queue[i], now, selected_video),
+        )
+        item = self.queue.pop(best)
+        if LLM_PREFETCH > 0 and self.queue:
+            for task in self._ordered(LLM_PREFETCH):
+                get_prefetcher().prefetch(task["filename"])
+        return item
+
+    def bump(self, fish_ids=None, video_filename=None):
+        """
+        Moves queued tasks to the front. Returns how many were bumped.
+
+        Args:
+            fish_ids: Bump the tasks of these fish
+            video_filename: Bump every task of this video
+        """
+        fish_ids = set(fish_ids or ())
+        bumped = 0
+        with self.mutex:
+            for task in self.queue:
+                if task["id"] in fish_ids or (
+                    video_filename is not None and task.get("video") == video_filename
+                ):
+                    task["bumped"] = True
+                    bumped += 1
+        return bumped
+
+    def clear(self):
+        """Drops every queued task; returns how many were dropped."""
+        with self.mutex:
+            dropped = len(self.queue)
+            self.queue.clear()
+            self.unfinished_tasks = max(0, self.unfinished_tasks - dropped)
+            if not self.unfinished_tasks:
+                self.all_tasks_done.notify_all()
+            self.not_full.notify_all()
+        return dropped
+
+    def snapshot(self, limit=100):
+        """
+        The next `limit` tasks in the order they will be taken, with how long
+        each has been waiting.
+        """
+        with self.mutex:
+            now = time.time()
+            size = len(self.queue)
+            oldest = max((now - task["queued_at"] for task in self.queue), default=0)
+            ordered = self._ordered(limit)
+        return {
+            "size": size,
+            "oldest_wait_seconds": round(oldest, 1),
+            "selected_video": self._selected_video(),
+            "tasks": [
+                {
+                    "position": position,
+                    "id": task["id"],
+                    "video_filename": task.get("video"),
+                    "quality": task.get("quality"),
+                    "bumped": bool(task.get("bumped")),
+                    "wait_seconds": round(now - task["queued_at"], 1),
+                }
+                for position, task in enumerate(ordered, start=1)
+            ],
+        }
+
 
 def extract_json_from_text(text):
     """Safely extracts JSON object from Gemini response text."""
@@ -58,42 +382,7 @@ def extract_json_from_text(text):
         return None
 
 
-def get_fish_taxonomy(fish_id, image_filename):
-    """Sends image to Gemini and updates database with taxonomy."""
-    if not model:
-        print("LLM Model not available.")
-        update_fish_status(fish_id, "error")
-        return
-
-    image_path = os.path.join(IMAGE_DIR, image_filename)
-    print(f"Characterizing fish ID {fish_id} from {image_path}...")
-    update_fish_status(fish_id, "characterizing")
-
-    try:
-        # Check if the image exists in the expected path
-        if not os.path.exists(image_path):
-            print(f"⚠️ Image file not found at {image_path}")
-
-            # Try alternate path (for backward compatibility)
-            alternate_path = os.path.join(IMAGE_DIR, os.path.basename(image_filename))
-            if os.path.exists(alternate_path):
-                print(f"Found image at alternate path: {alternate_path}")
-                image_path = alternate_path
-            else:
-                print(
-                    f"Image not found at alternate path either. Cannot characterize fish ID {fish_id}"
-                )
-                update_fish_status(fish_id, "error")
-                return
-
-        img = Image.open(image_path)
-
-        # Convert image to bytes if needed by the library/model version
-        # img_byte_arr = io.BytesIO()
-        # img.save(img_byte_arr, format='PNG') # Or JPEG
-        # img_bytes = img_byte_arr.getvalue()
-
-        prompt = """Identify the most likely species, genus, family, order, class, phylum, and kingdom of the animal in this image.
+TAXONOMY_PROMPT = """Identify the most likely species, genus, family, order, class, phylum, and kingdom of the animal in this image.
 Output the result *only* as a JSON object in the following format, with no other commentary, introductions, or explanations:
 
 {
@@ -103,52 +392,252 @@ Output the result *only* as a JSON object in the following format, with no other
   "Order": "...",
   "Family": "...",
   "Genus": "...",
-  "Species": "..."
+  "Species": "..."%s
 }
 
 If you cannot confidently identify the animal or its classifications, use "Unknown" for the respective fields.
 """
+# The first pass of the cascade also reports a confidence, which decides about escalation
+CONFIDENCE_FIELD = """,
+  "Confidence": 0.0 to 1.0 (how sure you are of the species)"""
+
+
+def count_unknown_ranks(taxonomy):
+    """Number of ranks that are missing or "Unknown"."""
+    return sum(
+        1
+        for rank in TAXONOMY_RANKS
+        if str(taxonomy.get(rank, "Unknown")).strip().lower() in ("", "unknown")
+    )
+
+
+def _confidence(taxonomy):
+    try:
+        return float(taxonomy.get("Confidence"))
+    except (TypeError, ValueError):
+        return None
+
+
+def escalation_reason(taxonomy):
+    """Why a first-pass answer goes to LLM_MODEL, or None if it is kept."""
+    if taxonomy is None:
+        return "failed"
+    if count_unknown_ranks(taxonomy) >= LLM_ESCALATE_UNKNOWN_RANKS:
+        return "unknown_ranks"
+    confidence = _confidence(taxonomy)
+    if confidence is not None and confidence < LLM_ESCALATE_CONFIDENCE:
+        return "low_confidence"
+    return None
+
+
+def request_taxonomy(model, tier, model_name, price, fish_id, prompt, image_part, original_bytes):
+    """
+    Sends one characterization request and returns (taxonomy dict or None,
+    accounting dict of the request).
+
+    Args:
+        model: Gemini model (or a stand-in with generate_content())
+        tier: "first_pass" or "main", for logs, metrics and the accounting
+        model_name: Model name recorded in the accounting
+        price: "input,output" USD per million tokens
+        fish_id: ID of the fish, for logs
+        prompt: Prompt text
+        image_part: Image part from prepare_image()
+        original_bytes: Size of the stored crop, for logs
+    """
+    sent_bytes = len(image_part["data"])
+    accounting = {"tier": tier, "model": model_name}
+    response = None
+    text = ""
 
-        # Note: Sending the PIL Image object directly is often supported.
-        # If not, uncomment the byte conversion above and send img_bytes.
+    wait_for_request_slot()
+    request_start = time.perf_counter()
+    try:
         response = model.generate_content(
-            [prompt, img], stream=False
+            [prompt, image_part], stream=False
         )  # Use stream=False for simpler response handling here
-
         # Make sure to handle potential safety blocks or empty responses
         if not response.parts:
             print(
                 f"⚠️ Gemini response for {fish_id} contained no parts (possibly blocked)."
             )
-            update_fish_status(fish_id, "error")
-            return
+            accounting["result"] = "blocked"
+        else:
+            text = response.text
+    except Exception as e:
+        # genai is only imported once a real model has been configured
+        if genai is not None and isinstance(e, genai.types.BlockedPromptException):
+            print(f"🚫 Gemini blocked the prompt or response for {fish_id}: {e}")
+            accounting["result"] = "blocked"
+        else:
+            print(f"❌ Error during Gemini API call for fish ID {fish_id}: {e}")
+            accounting["result"] = "error"
+    finally:
+        latency = time.perf_counter() - request_start
+        observe("fish_llm_request_seconds", latency, tier=tier)
+        observe(
+            "fish_llm_request_bytes",
+            sent_bytes,
+            buckets=(4096, 16384, 65536, 262144, 1048576, 4194304),
+        )
+        print(
+            f"Gemini request ({tier}) for fish ID {fish_id}: sent {sent_bytes} bytes "
+            f"(crop {original_bytes} bytes) in {latency:.2f}s"
+        )
 
-        text = response.text
-        # print(f"--- Gemini Raw Response for {fish_id} ---")
-        # print(text)
-        # print("--- End Gemini Raw Response ---")
+    # Token counts of the response, estimated if it has none (e.g. stand-ins)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and getattr(usage, "prompt_token_count", None):
+        input_tokens = usage.prompt_token_count
+        output_tokens = usage.candidates_token_count or 0
+    else:
+        input_tokens = IMAGE_TOKENS + len(prompt) // 4
+        output_tokens = len(text) // 4
+        accounting["estimated_tokens"] = True
+    input_price, output_price = _parse_price(price)
+    accounting.update(
+        latency_seconds=round(latency, 3),
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cost_usd=round((input_tokens * input_price + output_tokens * output_price) / 1e6, 8),
+    )
+    increment("fish_llm_cost_usd_total", accounting["cost_usd"], tier=tier)
 
-        json_data = extract_json_from_text(text)
+    taxonomy = None
+    if "result" not in accounting:
+        taxonomy = extract_json_from_text(text)
+        accounting["result"] = "success" if taxonomy else "parse_error"
+        if not taxonomy:
+            print(f"⚠️ Failed to extract JSON for fish ID {fish_id}.")
+    increment("fish_llm_requests_total", result=accounting["result"], tier=tier)
+    if taxonomy:
+        accounting["unknown_ranks"] = count_unknown_ranks(taxonomy)
+        if _confidence(taxonomy) is not None:
+            accounting["confidence"] = _confidence(taxonomy)
+    return taxonomy, accounting
 
-        if json_data:
-            print(
-                f"Successfully characterized fish ID {fish_id}: {json_data.get('Species', 'N/A')}"
-            )
-            update_fish_status(
-                fish_id, "characterized", taxonomy_json=json.dumps(json_data)
+
+def _characterization_failed(fish_id, recharacterizing):
+    # A fish that is characterized already keeps its status and taxonomy
+    if not recharacterizing:
+        update_fish_status(fish_id, "error")
+    return "error"
+
+
+def get_fish_taxonomy(fish_id, image_filename, previous_taxonomy_json=None):
+    """
+    Sends image to Gemini and updates database with taxonomy. With a first-pass
+    model configured, that model answers first and LLM_MODEL is only asked
+    when the answer is not good enough (see escalation_reason). The cost and
+    latency of every request are stored under "Characterization" in the
+    taxonomy JSON.
+
+    Returns "characterized" when a taxonomy was stored, "kept" when the
+    previous taxonomy was better and "error" when there is no answer.
+
+    Args:
+        fish_id: Fish to characterize
+        image_filename: Crop of the fish
+        previous_taxonomy_json: Taxonomy of a fish that is characterized
+            already. Its status is left alone while it is re-characterized,
+            a failure keeps it as it is and the new taxonomy only replaces
+            this one when it has fewer "Unknown" ranks.
+    """
+    recharacterizing = previous_taxonomy_json is not None
+    first_pass_model = get_first_pass_model()
+    model = get_model()
+    if not model and not first_pass_model:
+        print("LLM Model not available.")
+        return _characterization_failed(fish_id, recharacterizing)
+
+    print(f"Characterizing fish ID {fish_id} from {image_filename}...")
+    if not recharacterizing:
+        update_fish_status(fish_id, "characterizing")
+
+    try:
+        prepared = get_prefetcher().take(image_filename)
+        if prepared is None:
+            print(f"Image not found. Cannot characterize fish ID {fish_id}")
+            return _characterization_failed(fish_id, recharacterizing)
+        image_part, original_bytes = prepared
+
+        requests = []
+        taxonomy = None
+        kept_tier = None
+        reason = None
+        if first_pass_model:
+            prompt = TAXONOMY_PROMPT % CONFIDENCE_FIELD
+            taxonomy, accounting = request_taxonomy(
+                first_pass_model,
+                "first_pass",
+                LLM_FIRST_PASS_MODEL or "first_pass",
+                LLM_FIRST_PASS_PRICE,
+                fish_id,
+                prompt,
+                image_part,
+                original_bytes,
             )
+            requests.append(accounting)
+            kept_tier = "first_pass" if taxonomy else None
+            # A blocked image would only be blocked again
+            if accounting["result"] != "blocked":
+                reason = escalation_reason(taxonomy)
         else:
-            print(f"⚠️ Failed to extract JSON for fish ID {fish_id}. Marking as error.")
-            update_fish_status(fish_id, "error")
+            prompt = TAXONOMY_PROMPT % ""
 
-    except genai.types.BlockedPromptException as e:
-        print(f"🚫 Gemini blocked the prompt or response for {fish_id}: {e}")
-        update_fish_status(fish_id, "error")
-    except Exception as e:
-        print(f"❌ Error during Gemini API call for fish ID {fish_id}: {e}")
-        update_fish_status(fish_id, "error")
+        if model and (not first_pass_model or reason):
+            if reason:
+                print(f"Escalating fish ID {fish_id} to {LLM_MODEL} ({reason}).")
+                increment("fish_llm_escalations_total", reason=reason)
+            main_taxonomy, accounting = request_taxonomy(
+                model,
+                "main",
+                LLM_MODEL,
+                LLM_MODEL_PRICE,
+                fish_id,
+                prompt,
+                image_part,
+                original_bytes,
+            )
+            requests.append(accounting)
+            # The first-pass answer stays if the stronger model did no better
+            if main_taxonomy and (
+                taxonomy is None
+                or count_unknown_ranks(main_taxonomy) <= count_unknown_ranks(taxonomy)
+            ):
+                taxonomy = main_taxonomy
+                kept_tier = "main"
+
+        if not taxonomy:
+            print(f"⚠️ No taxonomy for fish ID {fish_id}. Marking as error.")
+            return _characterization_failed(fish_id, recharacterizing)
 
-    # Apply rate limiting delay AFTER the request
-    if REQUEST_INTERVAL > 0:
-        # print(f"Rate limiting: sleeping for {REQUEST_INTERVAL:.2f} seconds")
-        time.sleep(REQUEST_INTERVAL)
+        if recharacterizing:
+            try:
+                previous = json.loads(previous_taxonomy_json)
+            except ValueError:
+                previous = None
+            if isinstance(previous, dict) and count_unknown_ranks(
+                taxonomy
+            ) >= count_unknown_ranks(previous):
+                print(f"Keeping the previous taxonomy of fish ID {fish_id}, it is as good.")
+                return "kept"
+
+        taxonomy["Characterization"] = {
+            "tier": kept_tier,
+            "escalation_reason": reason,
+            "cost_usd": round(sum(r["cost_usd"] for r in requests), 8),
+            "latency_seconds": round(sum(r["latency_seconds"] for r in requests), 3),
+            "requests": requests,
+        }
+        print(
+            f"Successfully characterized fish ID {fish_id}: {taxonomy.get('Species', 'N/A')}"
+        )
+        update_fish_status(
+            fish_id, "characterized", taxonomy_json=json.dumps(taxonomy)
+        )
+        return "characterized"
+
+    except Exception as e:
+        print(f"❌ Error characterizing fish ID {fish_id}: {e}")
+        return _characterization_failed(fish_id, recharacterizing)
@@ -0,0 +1,258 @@
+"""
+Lightweight stage timing and counters for the processing pipeline.
+
+Set METRICS_ENABLED=1 to record metrics. When disabled, span() returns a shared
+no-op context manager and the record functions return immediately, so the
+instrumentation left in the hot paths costs next to nothing.
+
+Recorded values are exposed in Prometheus text format (see render_prometheus,
+served at /metrics) and summarised per job into a JSON file in METRICS_DIR.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR", "job_metrics")
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_HISTOGRAM = "fish_stage_seconds"
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> _Histogram
+_counters = {}  # (name, labels) -> float
+_gauges = {}  # (name, labels) -> callable returning the current value
+_help = {}  # name -> help text
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Records one observation in a histogram."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+def increment(name, amount=1, **labels):
+    """Increments a counter."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_gauge(name, callback, help_text=None, **labels):
+    """Registers a callable sampled whenever metrics are rendered (e.g. queue depth)."""
+    with _lock:
+        _gauges[(name, _labels_key(labels))] = callback
+        if help_text:
+            _help[name] = help_text
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(STAGE_HISTOGRAM, time.perf_counter() - self.start, stage=self.stage)
+        return False
+
+
+def span(stage):
+    """
+    Times a pipeline stage:
+
+        with span("predict"):
+            results = model.predict(...)
+    """
+    if not METRICS_ENABLED:
+        return _NULL_SPAN
+    return _Span(stage)
+
+
+# --- Export ---
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def render_prometheus():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            key: (h.buckets, list(h.bucket_counts), h.count, h.sum)
+            for key, h in _histograms.items()
+        }
+        gauges = dict(_gauges)
+
+    typed = set()
+
+    def type_line(name, metric_type):
+        if name not in typed:
+            typed.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+    for (name, labels), callback in sorted(gauges.items()):
+        try:
+            value = callback()
+        except Exception as e:
+            print(f"Error reading gauge {name}: {e}")
+            continue
+        type_line(name, "gauge")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), value in sorted(counters.items()):
+        type_line(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), (buckets, bucket_counts, count, total) in sorted(
+        histograms.items()
+    ):
+        type_line(name, "histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, bucket_counts):
+            cumulative += bucket_count
+            lines.append(
+                f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}"
+            )
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """Returns a plain-dict copy of the counters and histogram totals."""
+    with _lock:
+        return {
+            "counters": {key: value for key, value in _counters.items()},
+            "histograms": {
+                key: (h.count, h.sum) for key, h in _histograms.items()
+            },
+        }
+
+
+def begin_job(job_name):
+    """Marks the start of a job; pass the returned token to write_job_summary."""
+    return {
+        "job": job_name,
+        "started_at": datetime.now().isoformat(),
+        "start_time": time.time(),
+        "snapshot": snapshot(),
+    }
+
+
+def write_job_summary(job, extra=None):
+    """
+    Writes the metrics recorded since begin_job() to METRICS_DIR as JSON and
+    returns the path of the summary file (None when metrics are disabled).
+    """
+    if not METRICS_ENABLED or not job:
+        return None
+
+    before = job["snapshot"]
+    after = snapshot()
+
+    stages = {}
+    histograms = {}
+    for (name, labels), (count, total) in after["histograms"].items():
+        prev_count, prev_total = before["histograms"].get((name, labels), (0, 0.0))
+        count -= prev_count
+        total -= prev_total
+        if count <= 0:
+            continue
+        entry = {
+            "count": count,
+            "total_seconds": round(total, 6),
+            "mean_seconds": round(total / count, 6),
+        }
+        if name == STAGE_HISTOGRAM:
+            stages[dict(labels)["stage"]] = entry
+        else:
+            histograms[name + _format_labels(labels)] = entry
+
+    counters = {}
+    for (name, labels), value in after["counters"].items():
+        delta = value - before["counters"].get((name, labels), 0)
+        if delta:
+            counters[name + _format_labels(labels)] = delta
+
+    summary = {
+        "job": job["job"],
+        "started_at": job["started_at"],
+        "finished_at": datetime.now().isoformat(),
+        "elapsed_seconds": round(time.time() - job["start_time"], 3),
+        "stages": stages,
+        "histograms": histograms,
+        "counters": counters,
+    }
+    if extra:
+        summary.update(extra)
+
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in job["job"])
+    path = os.path.join(
+        METRICS_DIR, f"{safe_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"Wrote job metrics summary to {path}")
+    return path
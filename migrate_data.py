@@ -1,167 +1,428 @@
 #!/usr/bin/env python3
 """
-Migration script to move existing fish images into video-specific directories
-and update the database entries.
-Run this script once after upgrading to the new version with video-specific organization.
+Data migrations for fish images and their database entries.
+
+Each migration maps a detected_fish row to the new relative path of its image
+(or None to leave the row alone). The runner works through the rows in
+batches ordered by ID:
+
+- the files of a batch are moved by a thread pool, as hardlinks (default,
+  the original stays in place) or renames (--rename) when source and
+  destination are on the same filesystem, falling back to a copy otherwise
+- the batch's UPDATEs and the migration's checkpoint (the last migrated ID,
+  in the migration_checkpoints table) are committed together, so an
+  interrupted run continues after the last committed batch
+- rows whose file could not be moved (an error or a missing source) are
+  recorded in the migration_failures table in the same commit and retried
+  first by the next run
+- throughput is printed after every batch
+
+Run this script once after upgrading to the version with video-specific
+folders:
+    python migrate_data.py --yes
+    python migrate_data.py --dry-run            # Only report what would change
+    python migrate_data.py --yes --rename --workers 16
 """
 
+import argparse
+import errno
 import os
-import sqlite3
-import shutil
 import pathlib
-from database import DATABASE_NAME, IMAGE_DIR
+import shutil
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from dotenv import load_dotenv
 
-def migrate_images_to_video_folders():
-    """
-    Migrates existing fish images to video-specific folders and updates database records.
-    """
-    print("\n=== Fish Detection Data Migration Tool ===")
-    print(
-        "This tool will organize your existing detected fish images into video-specific folders."
-    )
-    print("Please make sure you have a backup of your data before proceeding.\n")
+from database import DATABASE_NAME, IMAGE_DIR, SQLITE_TIMEOUT
 
-    # Confirm with user
-    response = input("Do you want to proceed with the migration? (y/n): ")
-    if response.lower() != "y":
-        print("Migration cancelled.")
-        return
+load_dotenv()
 
-    conn = sqlite3.connect(DATABASE_NAME)
-    # Enable row_factory to get results as dictionaries
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+# --- Configuration ---
+MIGRATION_WORKERS = int(os.getenv("MIGRATION_WORKERS", "8"))  # File move threads
+MIGRATION_BATCH_SIZE = int(
+    os.getenv("MIGRATION_BATCH_SIZE", "1000")
+)  # Rows per committed batch
 
-    # Check if the database has the video_filename column
-    try:
-        cursor.execute("SELECT video_filename FROM detected_fish LIMIT 1")
-    except sqlite3.OperationalError:
-        print(
-            "The database doesn't have a video_filename column. Please run the app once to upgrade the database schema."
-        )
-        conn.close()
-        return
 
-    # Get all fish data
-    cursor.execute("SELECT id, image_filename, video_filename FROM detected_fish")
-    fish_records = cursor.fetchall()
+def video_folder_path(row):
+    """
+    New image path for the "video-folders" migration: crops stored directly in
+    IMAGE_DIR move into the directory of their video.
+    """
+    image_filename = row["image_filename"]
+    video_filename = row["video_filename"]
+    # Already migrated, or not attributable to a video
+    if os.path.dirname(image_filename) or video_filename == "unknown":
+        return None
+
+    video_dirname = pathlib.Path(video_filename).stem
+    video_dirname = "".join(
+        c if c.isalnum() or c in "-_" else "_" for c in video_dirname
+    )
+    return os.path.join(video_dirname, image_filename)
 
-    print(f"Found {len(fish_records)} fish records to process.")
 
-    # Get all unique video filenames
-    cursor.execute("SELECT DISTINCT video_filename FROM detected_fish")
-    videos = [row["video_filename"] for row in cursor.fetchall()]
+# Migration name -> function mapping a detected_fish row to its new image path
+MIGRATIONS = {
+    "video-folders": video_folder_path,
+}
 
-    print(f"Found {len(videos)} unique videos.")
+# Outcome of a row that could not be migrated -> total it is counted in
+FAILURE_TOTALS = {"missing": "skipped", "error": "errors"}
 
-    # Create video-specific directories
-    for video in videos:
-        if video == "unknown":
-            # Skip 'unknown' video entries for now
-            continue
 
-        # Create a safe directory name
-        video_dirname = pathlib.Path(video).stem
-        video_dirname = "".join(
-            c if c.isalnum() or c in "-_" else "_" for c in video_dirname
+def _connect():
+    conn = sqlite3.connect(DATABASE_NAME, timeout=SQLITE_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _ensure_checkpoint_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS migration_checkpoints (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            migrated INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0,
+            finished_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        video_dir = os.path.join(IMAGE_DIR, video_dirname)
-
-        # Create the directory if it doesn't exist
-        if not os.path.exists(video_dir):
-            os.makedirs(video_dir, exist_ok=True)
-            print(f"Created directory: {video_dir}")
-
-    # Move files and update database records
-    migrated_count = 0
-    skipped_count = 0
-    errors_count = 0
-
-    for fish in fish_records:
-        try:
-            fish_id = fish["id"]
-            image_filename = fish["image_filename"]
-            video_filename = fish["video_filename"]
-
-            # Skip if image_filename already contains a directory separator (already migrated)
-            if os.path.dirname(image_filename):
-                skipped_count += 1
-                continue
-
-            # Skip entries with unknown video
-            if video_filename == "unknown":
-                skipped_count += 1
-                continue
-
-            # Create the source and destination paths
-            src_path = os.path.join(IMAGE_DIR, image_filename)
-
-            # Create safe video directory name
-            video_dirname = pathlib.Path(video_filename).stem
-            video_dirname = "".join(
-                c if c.isalnum() or c in "-_" else "_" for c in video_dirname
-            )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS migration_failures (
+            name TEXT NOT NULL,
+            fish_id INTEGER NOT NULL,
+            outcome TEXT NOT NULL,  -- "missing" or "error"
+            PRIMARY KEY (name, fish_id)
+        )
+    """)
+    conn.commit()
 
-            # New relative path (for database)
-            new_rel_path = os.path.join(video_dirname, image_filename)
 
-            # Destination path (for file system)
-            dst_path = os.path.join(IMAGE_DIR, new_rel_path)
+def _get_checkpoint(conn, name):
+    try:
+        row = conn.execute(
+            "SELECT last_id, migrated, skipped, errors, finished_at "
+            "FROM migration_checkpoints WHERE name = ?",
+            (name,),
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # The table only exists once a migration has run
+        return None
+    return dict(row) if row else None
 
-            # Check if the source file exists
-            if not os.path.exists(src_path):
-                print(
-                    f"Warning: Source file not found: {src_path} (Fish ID: {fish_id})"
-                )
-                skipped_count += 1
-                continue
 
-            # Copy the file to the new location
-            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-            shutil.copy2(src_path, dst_path)
+def _get_failures(conn, name):
+    """Fish ID -> outcome of the rows a migration could not move so far."""
+    try:
+        rows = conn.execute(
+            "SELECT fish_id, outcome FROM migration_failures WHERE name = ?", (name,)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {row["fish_id"]: row["outcome"] for row in rows}
 
-            # Update the database with the new path
-            cursor.execute(
-                "UPDATE detected_fish SET image_filename = ? WHERE id = ?",
-                (new_rel_path, fish_id),
-            )
 
-            migrated_count += 1
+def move_file(src_path, dst_path, rename=False):
+    """
+    Moves one image, returning "moved", "done" (already at the destination,
+    e.g. from a batch that was interrupted before its commit) or "missing".
 
-            # Print progress every 10 files
-            if migrated_count % 10 == 0:
-                print(f"Migrated {migrated_count} files so far...")
+    Args:
+        src_path: Current path of the image
+        dst_path: New path of the image
+        rename: Rename instead of hardlinking (the original is not kept)
+    """
+    if os.path.exists(dst_path):
+        return "done"
+    if not os.path.exists(src_path):
+        return "missing"
 
-        except Exception as e:
-            print(f"Error processing fish ID {fish['id']}: {e}")
-            errors_count += 1
+    try:
+        if rename:
+            os.rename(src_path, dst_path)
+        else:
+            os.link(src_path, dst_path)
+    except OSError as e:
+        # Different filesystems (or no hardlink support): copy instead
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        if rename:
+            shutil.move(src_path, dst_path)
+        else:
+            shutil.copy2(src_path, dst_path)
+    return "moved"
 
-    # Commit changes to database
-    conn.commit()
-    conn.close()
 
-    print("\n=== Migration Summary ===")
-    print(f"Total records processed: {len(fish_records)}")
-    print(f"Successfully migrated: {migrated_count}")
-    print(f"Skipped (already migrated or unknown video): {skipped_count}")
-    print(f"Errors: {errors_count}")
+def run_migration(name, rename=False, dry_run=False, workers=None, batch_size=None):
+    """
+    Runs (or resumes) a migration and returns its totals.
+
+    Args:
+        name: Key of the migration in MIGRATIONS
+        rename: Rename files instead of hardlinking them
+        dry_run: Only count what would be migrated; nothing is changed
+        workers: Number of file move threads (default MIGRATION_WORKERS)
+        batch_size: Rows per committed batch (default MIGRATION_BATCH_SIZE)
+    """
+    new_path_for = MIGRATIONS[name]
+    workers = workers or MIGRATION_WORKERS
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
 
-    if migrated_count > 0:
-        print("\nMigration completed successfully!")
-        print("Note: The original files were not deleted to ensure data safety.")
+    conn = _connect()
+    # Check if the database has the video_filename column
+    try:
+        conn.execute("SELECT video_filename FROM detected_fish LIMIT 1")
+    except sqlite3.OperationalError:
         print(
-            "You can manually delete them from the main 'detected_fish' directory after verifying everything works."
+            "The database doesn't have a video_filename column. Please run the app once to upgrade the database schema."
         )
-    else:
+        conn.close()
+        return None
+
+    if not dry_run:
+        _ensure_checkpoint_table(conn)
+    checkpoint = _get_checkpoint(conn, name) or {
+        "last_id": 0,
+        "migrated": 0,
+        "skipped": 0,
+        "errors": 0,
+        "finished_at": None,
+    }
+    totals = {key: checkpoint[key] for key in ("migrated", "skipped", "errors")}
+    last_id = checkpoint["last_id"]
+
+    remaining = conn.execute(
+        "SELECT COUNT(*) FROM detected_fish WHERE id > ?", (last_id,)
+    ).fetchone()[0]
+    if last_id:
         print(
-            "\nNo files were migrated. Either all files were already migrated or there were errors."
+            f"Resuming migration '{name}' after fish ID {last_id} "
+            f"({totals['migrated']} already migrated, {remaining} rows left)."
         )
+    else:
+        print(f"Running migration '{name}' over {remaining} rows.")
+
+    failures = {} if dry_run else _get_failures(conn, name)
+    if failures:
+        print(f"Retrying {len(failures)} rows that could not be migrated before.")
+    elif dry_run and _get_failures(conn, name):
+        print("Rows that could not be migrated before are retried by the next real run.")
+
+    created_dirs = set()
+    processed = 0
+    started = time.time()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def _move(move):
+            fish_id, _, src_path, dst_path = move
+            try:
+                return move_file(src_path, dst_path, rename)
+            except OSError as e:
+                print(f"Error moving image of fish ID {fish_id}: {e}")
+                return "error"
+
+        def migrate_rows(rows, checkpoint_id):
+            """Moves the images of `rows` and commits their updates with the checkpoint."""
+            moves = []  # (fish_id, new_rel_path, src_path, dst_path)
+            outcomes = {}  # fish_id -> "skipped", "moved", "missing" or "error"
+            for row in rows:
+                new_rel_path = new_path_for(row)
+                if new_rel_path is None:
+                    outcomes[row["id"]] = "skipped"
+                    continue
+                moves.append(
+                    (
+                        row["id"],
+                        new_rel_path,
+                        os.path.join(IMAGE_DIR, row["image_filename"]),
+                        os.path.join(IMAGE_DIR, new_rel_path),
+                    )
+                )
 
-    print(
-        "\nIf you encounter any issues, please restore from your backup and try again."
-    )
+            if dry_run:
+                totals["skipped"] += len(outcomes)
+                totals["migrated"] += len(moves)
+                return
+
+            for _, _, _, dst_path in moves:
+                dst_dir = os.path.dirname(dst_path)
+                if dst_dir not in created_dirs:
+                    os.makedirs(dst_dir, exist_ok=True)
+                    created_dirs.add(dst_dir)
+
+            updates = []
+            for move, outcome in zip(moves, executor.map(_move, moves)):
+                fish_id, new_rel_path, src_path, _ = move
+                if outcome in ("moved", "done"):
+                    updates.append((new_rel_path, fish_id))
+                    outcome = "moved"
+                elif outcome == "missing":
+                    print(
+                        f"Warning: Source file not found: {src_path} (Fish ID: {fish_id})"
+                    )
+                outcomes[fish_id] = outcome
+
+            new_failures = []
+            resolved = []
+            for fish_id, outcome in outcomes.items():
+                # A retried row was counted by the run it failed in
+                previous = failures.pop(fish_id, None)
+                if previous:
+                    totals[FAILURE_TOTALS[previous]] -= 1
+                if outcome in FAILURE_TOTALS:
+                    totals[FAILURE_TOTALS[outcome]] += 1
+                    new_failures.append((name, fish_id, outcome))
+                else:
+                    totals["migrated" if outcome == "moved" else "skipped"] += 1
+                    if previous:
+                        resolved.append((name, fish_id))
+
+            # The updates, failures and checkpoint are committed together
+            conn.executemany(
+                "UPDATE detected_fish SET image_filename = ? WHERE id = ?", updates
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO migration_failures (name, fish_id, outcome) "
+                "VALUES (?, ?, ?)",
+                new_failures,
+            )
+            conn.executemany(
+                "DELETE FROM migration_failures WHERE name = ? AND fish_id = ?", resolved
+            )
+            conn.execute(
+                """
+                INSERT INTO migration_checkpoints (name, last_id, migrated, skipped, errors, updated_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(name) DO UPDATE SET
+                    last_id = excluded.last_id,
+                    migrated = excluded.migrated,
+                    skipped = excluded.skipped,
+                    errors = excluded.errors,
+                    updated_at = excluded.updated_at
+                """,
+                (name, checkpoint_id, totals["migrated"], totals["skipped"], totals["errors"]),
+            )
+            conn.commit()
+
+        # Rows that failed in an earlier run, before continuing after the checkpoint
+        retry_ids = sorted(failures)
+        for start in range(0, len(retry_ids), batch_size):
+            chunk = retry_ids[start : start + batch_size]
+            rows = conn.execute(
+                "SELECT id, image_filename, video_filename FROM detected_fish "
+                f"WHERE id IN ({','.join('?' * len(chunk))}) ORDER BY id",
+                chunk,
+            ).fetchall()
+            found = {row["id"] for row in rows}
+            for fish_id in chunk:
+                if fish_id not in found:
+                    # Deleted since; nothing left to migrate
+                    totals[FAILURE_TOTALS[failures.pop(fish_id)]] -= 1
+                    conn.execute(
+                        "DELETE FROM migration_failures WHERE name = ? AND fish_id = ?",
+                        (name, fish_id),
+                    )
+            migrate_rows(rows, last_id)
+            print(f"Retried {start + len(chunk)}/{len(retry_ids)} earlier failures.")
+
+        while True:
+            rows = conn.execute(
+                "SELECT id, image_filename, video_filename FROM detected_fish "
+                "WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            processed += len(rows)
+            migrate_rows(rows, last_id)
+
+            elapsed = time.time() - started
+            print(
+                f"Migrated {totals['migrated']} files so far "
+                f"({processed}/{remaining} rows, {processed / max(elapsed, 1e-6):.0f} rows/s)"
+            )
+
+    unresolved = 0
+    if not dry_run:
+        conn.execute(
+            "UPDATE migration_checkpoints SET finished_at = CURRENT_TIMESTAMP WHERE name = ?",
+            (name,),
+        )
+        conn.commit()
+        unresolved = len(_get_failures(conn, name))
+    conn.close()
+
+    elapsed = time.time() - started
+    print(f"\n=== Migration Summary ({'dry run' if dry_run else name}) ===")
+    print(f"Rows processed in this run: {processed} in {elapsed:.1f}s")
+    print(f"{'Would migrate' if dry_run else 'Successfully migrated'}: {totals['migrated']}")
+    print(f"Skipped (already migrated, unknown video or missing file): {totals['skipped']}")
+    print(f"Errors: {totals['errors']}")
+    if unresolved:
+        print(f"{unresolved} rows could not be migrated; run the migration again to retry them.")
+    if not dry_run and totals["migrated"] and not rename:
+        print(
+            "\nThe original files are kept as hardlinks (or copies); you can delete "
+            f"them from the main '{IMAGE_DIR}' directory after verifying everything works."
+        )
+    return totals
 
 
 if __name__ == "__main__":
-    migrate_images_to_video_folders()
+    parser = argparse.ArgumentParser(
+        description="Migrate fish images and their database entries."
+    )
+    parser.add_argument(
+        "--migration",
+        choices=sorted(MIGRATIONS),
+        default="video-folders",
+        help="Migration to run (default video-folders)",
+    )
+    parser.add_argument(
+        "--yes", action="store_true", help="Run without asking for confirmation"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only report what would be migrated"
+    )
+    parser.add_argument(
+        "--rename",
+        action="store_true",
+        help="Rename files instead of hardlinking them (the originals are not kept)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=MIGRATION_WORKERS,
+        help="File move threads (default MIGRATION_WORKERS)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=MIGRATION_BATCH_SIZE,
+        help="Rows per committed batch (default MIGRATION_BATCH_SIZE)",
+    )
+    args = parser.parse_args()
+
+    if not args.yes and not args.dry_run:
+        if not sys.stdin.isatty():
+            parser.error("pass --yes (or --dry-run) when not running interactively")
+        print("Please make sure you have a backup of your data before proceeding.")
+        response = input("Do you want to proceed with the migration? (y/n): ")
+        if response.lower() != "y":
+            print("Migration cancelled.")
+            sys.exit(0)
+
+    run_migration(
+        args.migration,
+        rename=args.rename,
+        dry_run=args.dry_run,
+        workers=args.workers,
+        batch_size=args.batch_size,
+    )
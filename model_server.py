@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Shared YOLO inference server.
+
+Every Flask/gunicorn worker that imports detector.py would normally load its own
+copy of the YOLO model. Instead, start a single server process:
+
+    python model_server.py
+
+and point the workers at it with MODEL_SERVER_ADDRESS=127.0.0.1:6010. Workers
+then send frames to this process over a local socket and receive the detected
+boxes back, so the model is held in memory (and on the GPU) exactly once.
+
+Connections are authenticated with MODEL_SERVER_AUTHKEY. The built-in default
+key is public, so the server refuses to listen on anything but a loopback
+address unless MODEL_SERVER_AUTHKEY is set (to the same value in the workers).
+"""
+
+import ipaddress
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+DEFAULT_ADDRESS = "127.0.0.1:6010"
+DEFAULT_AUTHKEY = "fish-model-server"  # Public, so only accepted on loopback addresses
+AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", DEFAULT_AUTHKEY).encode()
+
+
+def parse_address(address):
+    """Turns 'host:port' into the (host, port) tuple used by multiprocessing."""
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def is_loopback(host):
+    """Whether `host` can only be reached from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _to_numpy(values):
+    """Converts torch tensors (or anything array-like) into numpy arrays."""
+    if hasattr(values, "cpu"):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+# --- Client side ---
+class RemoteBoxes:
+    """Mimics the parts of ultralytics' Boxes used by the detector."""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.xyxy)
+
+
+class RemoteResult:
+    """Mimics the parts of an ultralytics Results object used by the detector."""
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class RemoteModel:
+    """
+    Drop-in replacement for a YOLO model whose predict() runs in model_server.py.
+    Each thread gets its own connection because connections are not thread-safe.
+    """
+
+    def __init__(self, address):
+        self.address = parse_address(address)
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, authkey=AUTHKEY)
+            self._local.conn = conn
+        return conn
+
+    def predict(self, frame, conf=0.25, verbose=False, **kwargs):
+        conn = self._connection()
+        try:
+            conn.send(("predict", frame, dict(conf=conf, **kwargs)))
+            status, payload = conn.recv()
+        except (EOFError, OSError):
+            # Server restarted or connection dropped; reconnect on next call
+            self._local.conn = None
+            raise
+        if status != "ok":
+            raise RuntimeError(f"Model server error: {payload}")
+        return [
+            RemoteResult(RemoteBoxes(item["xyxy"], item["conf"], item["cls"]))
+            for item in payload
+        ]
+
+
+# --- Server side ---
+def _serve_connection(conn, model, predict_lock):
+    """Handles requests from one worker connection until it closes."""
+    try:
+        while True:
+            try:
+                command, frame, kwargs = conn.recv()
+            except EOFError:
+                break
+
+            if command != "predict":
+                conn.send(("error", f"Unknown command {command!r}"))
+                continue
+
+            try:
+                # One inference at a time; the model is not shared across threads safely
+                with predict_lock:
+                    results = model.predict(frame, verbose=False, **kwargs)
+                payload = [
+                    {
+                        "xyxy": _to_numpy(result.boxes.xyxy),
+                        "conf": _to_numpy(result.boxes.conf),
+                        "cls": _to_numpy(result.boxes.cls),
+                    }
+                    for result in results
+                ]
+                conn.send(("ok", payload))
+            except Exception as e:
+                print(f"Error during inference: {e}")
+                conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+
+def serve(address=None):
+    """Loads the model once and serves inference requests forever."""
+    address = parse_address(address or os.getenv("MODEL_SERVER_ADDRESS", DEFAULT_ADDRESS))
+    # Connections unpickle what clients send, so the key is all that keeps
+    # other machines from running code in this process
+    if AUTHKEY == DEFAULT_AUTHKEY.encode() and not is_loopback(address[0]):
+        print(
+            f"Model server cannot start: set MODEL_SERVER_AUTHKEY to listen on "
+            f"{address[0]}, the default key is only accepted on a loopback address."
+        )
+        return
+
+    # Imported here so that detector's own MODEL_SERVER_ADDRESS is ignored in the server
+    import detector
+
+    detector.MODEL_SERVER_ADDRESS = None
+    if not detector.warm_up():
+        print("Model server cannot start: YOLO model not loaded.")
+        return
+
+    model = detector.get_model()
+    predict_lock = threading.Lock()
+
+    with Listener(address, authkey=AUTHKEY) as listener:
+        print(f"Model server listening on {address[0]}:{address[1]}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Error accepting connection: {e}")
+                time.sleep(0.1)
+                continue
+            print(f"Worker connected from {listener.last_accepted}")
+            threading.Thread(
+                target=_serve_connection, args=(conn, model, predict_lock), daemon=True
+            ).start()
+
+
+if __name__ == "__main__":
+    serve()
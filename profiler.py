@@ -0,0 +1,209 @@
+"""
+On-demand sampling profiles of running jobs.
+
+capture() starts a thread that, for a given number of seconds, reads the
+stacks of the job threads (detection, the frame-reader and stream-reader
+threads that decode its frames, the LLM worker and its preprocessing pool,
+selected by thread name) PROFILE_SAMPLE_HZ times per second with
+sys._current_frames(). The samples are written to PROFILE_DIR as:
+
+- collapsed stacks ("thread;outer;...;inner count" per distinct stack), the
+  input of flamegraph.pl and many other flame graph tools
+- or a speedscope file (https://www.speedscope.app), one profile per thread
+
+Frames are named "function (file:line of its def)", so the samples of one
+function are merged whichever line it was on. Nothing is hooked into the
+profiled code and no thread runs between captures, so profiling costs
+nothing until it is asked for.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_HZ = float(os.getenv("PROFILE_SAMPLE_HZ", "100"))
+PROFILE_MAX_SECONDS = float(
+    os.getenv("PROFILE_MAX_SECONDS", "300")
+)  # Longest capture that can be requested
+PROFILE_THREADS = [
+    prefix.strip()
+    for prefix in os.getenv("PROFILE_THREADS", "detection,llm,frame-reader,stream-reader").split(",")
+    if prefix.strip()
+]  # Name prefixes of the sampled threads
+
+FORMATS = {"collapsed": ".collapsed", "speedscope": ".speedscope.json"}
+
+_capture_lock = threading.Lock()
+_capture_thread = None
+
+
+def profile_filename(job_name, fmt="collapsed"):
+    """File name in PROFILE_DIR for a capture of `job_name` (in format `fmt`) started now."""
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in job_name or "job")
+    return f"{safe_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{FORMATS[fmt]}"
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample(thread_prefixes, own_ident, frame_names):
+    """
+    The current stack of every selected thread, as (thread name, frames
+    root first). `frame_names` caches the frame name of each code object.
+    """
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = []
+    for ident, frame in sys._current_frames().items():
+        name = names.get(ident)
+        if ident == own_ident or not name or not name.startswith(thread_prefixes):
+            continue
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frame_name = frame_names.get(code)
+            if frame_name is None:
+                frame_name = frame_names[code] = _frame_name(code)
+            frames.append(frame_name)
+            frame = frame.f_back
+        frames.reverse()
+        stacks.append((name, tuple(frames)))
+    return stacks
+
+
+def _write_collapsed(path, counts):
+    with open(path, "w") as f:
+        for (thread_name, frames), count in sorted(counts.items()):
+            f.write(";".join((thread_name,) + frames) + f" {count}\n")
+
+
+def _write_speedscope(path, counts, job_name, interval):
+    frame_index = {}
+    profiles = {}
+    for (thread_name, frames), count in sorted(counts.items()):
+        profile = profiles.setdefault(
+            thread_name,
+            {
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": 0,
+                "samples": [],
+                "weights": [],
+            },
+        )
+        profile["samples"].append(
+            [frame_index.setdefault(frame, len(frame_index)) for frame in frames]
+        )
+        profile["weights"].append(count * interval)
+        profile["endValue"] += count * interval
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "$schema": "https://www.speedscope.app/file-format-schema.json",
+                "name": job_name,
+                "exporter": "fish-identifier-app profiler",
+                "shared": {"frames": [{"name": name} for name in frame_index]},
+                "profiles": list(profiles.values()),
+            },
+            f,
+        )
+
+
+def _run_capture(path, job_name, fmt, seconds, thread_prefixes):
+    interval = 1.0 / PROFILE_SAMPLE_HZ
+    own_ident = threading.get_ident()
+    counts = {}  # (thread name, frames) -> samples
+    frame_names = {}
+    thread_prefixes = tuple(thread_prefixes)
+    samples = 0
+    deadline = time.monotonic() + seconds
+    next_sample = time.monotonic()
+    while next_sample < deadline:
+        for stack in _sample(thread_prefixes, own_ident, frame_names):
+            counts[stack] = counts.get(stack, 0) + 1
+        samples += 1
+        next_sample += interval
+        time.sleep(max(0.0, next_sample - time.monotonic()))
+
+    # Written under a temporary name so list_profiles() only shows finished files
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    partial_path = path + ".part"
+    if fmt == "speedscope":
+        _write_speedscope(partial_path, counts, job_name, interval)
+    else:
+        _write_collapsed(partial_path, counts)
+    os.replace(partial_path, path)
+    threads = len({thread_name for thread_name, _ in counts})
+    print(f"Wrote profile of {job_name} ({samples} samples of {threads} threads) to {path}")
+
+
+def capture(job_name, seconds, fmt="collapsed", filename=None, thread_prefixes=None):
+    """
+    Starts sampling the job threads in the background and returns the name
+    of the file (in PROFILE_DIR) the profile will be written to when done.
+    Raises RuntimeError if a capture is already running in this process and
+    ValueError for an invalid duration or format.
+
+    Args:
+        job_name: Job the profile is named after
+        seconds: Capture duration, at most PROFILE_MAX_SECONDS
+        fmt: "collapsed" or "speedscope"
+        filename: File name to use instead of profile_filename()
+        thread_prefixes: Name prefixes of the sampled threads (default PROFILE_THREADS)
+    """
+    global _capture_thread
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError(f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown profile format: {fmt}, use one of {', '.join(FORMATS)}")
+    filename = os.path.basename(filename or profile_filename(job_name, fmt))
+    if not filename.endswith(FORMATS[fmt]):
+        raise ValueError(f"A {fmt} profile must be named *{FORMATS[fmt]}")
+    with _capture_lock:
+        if _capture_thread is not None and _capture_thread.is_alive():
+            raise RuntimeError("A profile is already being captured.")
+        _capture_thread = threading.Thread(
+            target=_run_capture,
+            args=(
+                os.path.join(PROFILE_DIR, filename),
+                job_name,
+                fmt,
+                seconds,
+                thread_prefixes or PROFILE_THREADS,
+            ),
+            name="profiler",
+            daemon=True,
+        )
+        _capture_thread.start()
+    return filename
+
+
+def list_profiles():
+    """The finished profiles in PROFILE_DIR, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in os.listdir(PROFILE_DIR):
+        if not filename.endswith(tuple(FORMATS.values())):
+            continue
+        stat = os.stat(os.path.join(PROFILE_DIR, filename))
+        profiles.append(
+            {
+                "filename": filename,
+                "size_bytes": stat.st_size,
+                "created_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            }
+        )
+    return sorted(profiles, key=lambda profile: profile["created_at"], reverse=True)
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Offline re-characterization and re-clustering of fish that were already
+detected, without running detection again.
+
+A job selects detected_fish rows by video, status and/or taxonomy (e.g. every
+fish marked "error", or with at least 4 "Unknown" ranks) and is one of:
+
+- "characterize": sends the selected fish through get_fish_taxonomy again,
+  under the same GEMINI_RPM rate limit as everything else. Fish of a running
+  video job go first: while its queue has fish waiting, the job waits. A fish
+  that is characterized already keeps its taxonomy unless the new one has
+  fewer "Unknown" ranks, and keeps it when the request fails
+- "recluster": groups the fish of each video whose perceptual hashes are
+  within --hash-threshold differing bits (detection only merges identical
+  hashes) and merges each group into one entry with all their timestamps,
+  keeping a characterized entry where there is one
+
+Jobs are stored in the reprocess_jobs table and checkpoint after every batch
+of fish (characterize) or every video (recluster), so a stopped, paused or
+interrupted job continues where it left off. They run in the app (POST
+/reprocess) or from the command line:
+
+    python reprocess.py characterize --status error
+    python reprocess.py characterize --video dive1.mp4 --min-unknown-ranks 4
+    python reprocess.py characterize --taxon Species=Unknown --llm-workers 2 --rpm 20
+    python reprocess.py recluster --hash-threshold 8 --dry-run
+    python reprocess.py resume 3
+    python reprocess.py list
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from crop_store import delete_crop
+from database import (
+    TAXONOMY_RANKS,
+    claim_reprocess_job,
+    count_selected_fish,
+    create_reprocess_job,
+    get_processed_videos,
+    get_reprocess_job,
+    get_reprocess_jobs,
+    merge_fish,
+    select_fish,
+    update_reprocess_job,
+)
+from identity_index import hash_bits
+from job_state import JOB_STALE_SECONDS, PROCESS_ID, live_fish_waiting
+
+load_dotenv()
+
+# --- Configuration ---
+REPROCESS_BATCH_SIZE = int(
+    os.getenv("REPROCESS_BATCH_SIZE", "20")
+)  # Fish re-characterized per checkpoint
+RECLUSTER_HASH_THRESHOLD = int(
+    os.getenv("RECLUSTER_HASH_THRESHOLD", "5")
+)  # Max differing pHash bits for fish merged by a recluster job
+REPROCESS_RPM = int(
+    os.getenv("REPROCESS_RPM", "0")
+)  # Gemini requests per minute of the command line, 0 uses GEMINI_RPM
+
+JOB_KINDS = ("characterize", "recluster")
+FISH_STATUSES = ("pending_characterization", "characterizing", "characterized", "error")
+# Seconds between checks whether a job was paused from another process
+CONTROL_INTERVAL = 5.0
+
+
+def create_job(
+    kind,
+    video_filename=None,
+    statuses=None,
+    taxon=None,
+    min_unknown_ranks=None,
+    hash_threshold=None,
+    dry_run=False,
+):
+    """
+    Validates and stores a new job; returns its ID. Raises ValueError for an
+    invalid selection.
+
+    Args:
+        kind: "characterize" or "recluster"
+        video_filename: Only fish of this video
+        statuses: Only fish with one of these statuses (characterize jobs
+            otherwise skip fish that are queued or being characterized)
+        taxon: Only fish with these ranks, e.g. {"Species": "Unknown"}
+        min_unknown_ranks: Only fish with at least this many "Unknown" ranks
+            (fish without a taxonomy have all of them)
+        hash_threshold: Max differing pHash bits (recluster, default
+            RECLUSTER_HASH_THRESHOLD)
+        dry_run: Only count the fish a recluster job would merge
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(JOB_KINDS)}")
+    statuses = list(statuses or [])
+    unknown_statuses = set(statuses) - set(FISH_STATUSES)
+    if unknown_statuses:
+        raise ValueError(f"Unknown status: {', '.join(sorted(unknown_statuses))}")
+    taxon = dict(taxon or {})
+    for rank in taxon:
+        if rank not in TAXONOMY_RANKS:
+            raise ValueError(f"Unknown taxonomy rank: {rank}")
+    if min_unknown_ranks is not None and not 0 < int(min_unknown_ranks) <= len(TAXONOMY_RANKS):
+        raise ValueError(f"min_unknown_ranks must be between 1 and {len(TAXONOMY_RANKS)}")
+    if kind == "characterize" and not (statuses or taxon or min_unknown_ranks):
+        # Re-characterizing every fish is a costly mistake to make by accident
+        raise ValueError("Give statuses, taxon or min_unknown_ranks to select fish")
+
+    selection = {
+        key: value
+        for key, value in (
+            ("video_filename", video_filename),
+            ("statuses", statuses),
+            ("taxon", taxon),
+            ("min_unknown_ranks", min_unknown_ranks and int(min_unknown_ranks)),
+        )
+        if value
+    }
+    options = {}
+    if kind == "recluster":
+        options["hash_threshold"] = int(
+            RECLUSTER_HASH_THRESHOLD if hash_threshold is None else hash_threshold
+        )
+        options["dry_run"] = bool(dry_run)
+    return create_reprocess_job(kind, selection, options)
+
+
+def pause_job(job_id):
+    """
+    Pauses a queued or running job; the process running it stops after the
+    fish it is working on. Returns False if the job is not active.
+    """
+    job = get_reprocess_job(job_id)
+    if not job or job["status"] not in ("queued", "running"):
+        return False
+    return update_reprocess_job(job_id, status="paused")
+
+
+def cluster_hashes(p_hashes, threshold):
+    """
+    Groups perceptual hashes (hex strings): in order, every hash not grouped
+    yet starts a group of the later hashes within `threshold` differing bits
+    of it. Returns the groups of two or more as lists of indexes.
+    """
+    by_length = {}
+    for i, p_hash in enumerate(p_hashes):
+        # Only hashes of the same size are comparable
+        by_length.setdefault(len(p_hash), []).append(i)
+
+    clusters = []
+    for indexes in by_length.values():
+        bits = np.stack([hash_bits(p_hashes[i]) for i in indexes])
+        ungrouped = np.ones(len(indexes), dtype=bool)
+        for row in range(len(indexes)):
+            if not ungrouped[row]:
+                continue
+            ungrouped[row] = False
+            distances = np.count_nonzero(bits != bits[row], axis=1)
+            group = np.flatnonzero(ungrouped & (distances <= threshold))
+            if len(group):
+                ungrouped[group] = False
+                clusters.append([indexes[row]] + [indexes[i] for i in group])
+    return clusters
+
+
+class _Control:
+    """Tells a running job to stop: on `stop_event`, or once it is paused or taken over."""
+
+    def __init__(self, job_id, stop_event):
+        self.job_id = job_id
+        self.stop_event = stop_event
+        self.paused = False
+        self._checked_at = time.monotonic()
+
+    def halted(self):
+        if self.stop_event.is_set() or self.paused:
+            return True
+        if time.monotonic() - self._checked_at >= CONTROL_INTERVAL:
+            self._checked_at = time.monotonic()
+            job = get_reprocess_job(self.job_id)
+            self.paused = not job or job["status"] != "running" or job["owner"] != PROCESS_ID
+        return self.paused
+
+    def checkpoint(self, **fields):
+        """Saves the job's progress; False if the job was paused or taken over meanwhile."""
+        if not update_reprocess_job(self.job_id, owner=PROCESS_ID, **fields):
+            self.paused = True
+        return not self.paused
+
+
+def _run_characterize(job, control, workers, yield_to):
+    """Re-characterizes the selected fish in batches; returns True once all are done."""
+    # Imported here so that recluster jobs never load the Gemini client
+    from llm_handler import get_fish_taxonomy
+
+    selection = dict(job["selection"], idle_only=True)
+    stats = job["stats"]
+    for key in ("processed", "characterized", "errors", "improved"):
+        stats.setdefault(key, 0)
+    stats.setdefault("selected", count_selected_fish(selection, job["last_id"]))
+    last_id = job["last_id"]
+
+    def characterize(fish):
+        # Fish of a running video job go first
+        while yield_to and yield_to():
+            if control.halted():
+                return None
+            control.stop_event.wait(1)
+        if control.halted():
+            return None
+        # Characterized fish stay in the rollup and only take a better answer
+        previous = fish["taxonomy_json"] if fish["status"] == "characterized" else None
+        return get_fish_taxonomy(fish["id"], fish["image_filename"], previous or None)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while True:
+            batch = select_fish(selection, last_id, REPROCESS_BATCH_SIZE)
+            if not batch:
+                return True
+            # map() yields in order, so the checkpoint covers the fish done
+            # before the first one that was skipped
+            done = []
+            for fish, outcome in zip(batch, executor.map(characterize, batch)):
+                if outcome is None:
+                    break
+                done.append(fish)
+                stats["processed"] += 1
+                if outcome == "error":
+                    stats["errors"] += 1
+                else:
+                    stats["characterized"] += 1
+                    # "kept" means the new answer was no better
+                    if outcome == "characterized":
+                        stats["improved"] += 1
+            if done:
+                last_id = done[-1]["id"]
+            print(
+                f"Reprocess job {job['id']}: re-characterized {stats['processed']}/"
+                f"{stats['selected']} fish ({stats['improved']} improved, {stats['errors']} errors)."
+            )
+            if not control.checkpoint(last_id=last_id, stats=stats) or len(done) < len(batch):
+                return False
+
+
+def _run_recluster(job, control, skip_video, on_merged):
+    """Merges near-duplicate fish video by video; returns True once all videos are done."""
+    threshold = job["options"].get("hash_threshold", RECLUSTER_HASH_THRESHOLD)
+    dry_run = job["options"].get("dry_run", False)
+    selection = job["selection"]
+    stats = job["stats"]
+    for key in ("videos", "groups", "merged"):
+        stats.setdefault(key, 0)
+    stats.setdefault("skipped_videos", [])
+
+    if selection.get("video_filename"):
+        videos = [selection["video_filename"]]
+    else:
+        videos = get_processed_videos()  # Sorted by name, like the checkpoint
+    if job["last_video"] is not None:
+        videos = [video for video in videos if video > job["last_video"]]
+
+    for video_filename in videos:
+        if control.halted():
+            return False
+        if skip_video and skip_video() == video_filename:
+            # Detection of this video is still adding fish
+            print(f"Reprocess job {job['id']}: skipping {video_filename}, it is being processed.")
+            stats["skipped_videos"].append(video_filename)
+        else:
+            fish = select_fish(dict(selection, video_filename=video_filename))
+            groups = cluster_hashes([f["perceptual_hash"] for f in fish], threshold)
+            merged_here = 0
+            for group in groups:
+                members = sorted(
+                    (fish[i] for i in group),
+                    key=lambda f: (f["status"] != "characterized", f["id"]),
+                )
+                merged_ids = [f["id"] for f in members[1:]]
+                merged_here += len(merged_ids)
+                if dry_run:
+                    continue
+                image_filenames = merge_fish(members[0]["id"], merged_ids)
+                if on_merged:
+                    on_merged(merged_ids)
+                for image_filename in image_filenames:
+                    try:
+                        delete_crop(image_filename)
+                    except OSError as e:
+                        print(f"Error deleting merged crop {image_filename}: {e}")
+            stats["videos"] += 1
+            stats["groups"] += len(groups)
+            stats["merged"] += merged_here
+            print(
+                f"Reprocess job {job['id']}: {video_filename}: "
+                f"{'would merge' if dry_run else 'merged'} {merged_here} of {len(fish)} fish "
+                f"into {len(groups)} entries."
+            )
+        if not control.checkpoint(last_video=video_filename, stats=stats):
+            return False
+    return True
+
+
+def run_job(job_id, workers=1, stop_event=None, yield_to=live_fish_waiting, skip_video=None, on_merged=None):
+    """
+    Runs (or resumes) a job in this process until it is finished, paused or
+    `stop_event` is set, and returns it. Raises RuntimeError if the job is
+    finished or running in another (live) process.
+
+    Args:
+        job_id: ID of the job
+        workers: Characterization threads (characterize jobs)
+        stop_event: Event that pauses the job when set
+        yield_to: Function returning True while other fish go first
+            (default: while the current video job has fish waiting)
+        skip_video: Function returning a video recluster jobs must leave
+            alone (e.g. the one being detected on)
+        on_merged: Called with the IDs of the fish entries merged away
+    """
+    if not claim_reprocess_job(job_id, PROCESS_ID, time.time() - JOB_STALE_SECONDS):
+        raise RuntimeError(f"Reprocess job {job_id} is finished or running elsewhere")
+    job = get_reprocess_job(job_id)
+    control = _Control(job_id, stop_event or threading.Event())
+    print(f"Reprocess job {job_id} ({job['kind']}) started with selection {job['selection']}.")
+
+    try:
+        if job["kind"] == "characterize":
+            finished = _run_characterize(job, control, workers, yield_to)
+        else:
+            finished = _run_recluster(job, control, skip_video, on_merged)
+    except Exception as e:
+        print(f"❌ Error in reprocess job {job_id}: {e}")
+        job["stats"]["error"] = str(e)
+        update_reprocess_job(job_id, owner=PROCESS_ID, status="error", stats=job["stats"])
+        return get_reprocess_job(job_id)
+
+    if finished:
+        update_reprocess_job(
+            job_id, owner=PROCESS_ID, status="finished", finished=True, stats=job["stats"]
+        )
+        print(f"Reprocess job {job_id} finished: {job['stats']}")
+    else:
+        # Unless another process paused it already
+        update_reprocess_job(job_id, owner=PROCESS_ID, status="paused")
+        print(f"Reprocess job {job_id} paused; resume it with: python reprocess.py resume {job_id}")
+    return get_reprocess_job(job_id)
+
+
+def _parse_taxon(values):
+    """["Species=Unknown", ...] -> {"Species": "Unknown", ...}"""
+    taxon = {}
+    for value in values or []:
+        rank, sep, name = value.partition("=")
+        if not sep:
+            raise ValueError(f"--taxon needs RANK=NAME, got {value!r}")
+        taxon[rank.strip().capitalize()] = name.strip()
+    return taxon
+
+
+def _run_in_foreground(job_id, workers):
+    """Runs a job until it ends; Ctrl+C pauses it after the fish in flight."""
+    stop_event = threading.Event()
+    result = {}
+    def run():
+        try:
+            result["job"] = run_job(job_id, workers, stop_event)
+        except RuntimeError as e:
+            print(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(0.5)
+    except KeyboardInterrupt:
+        print("Interrupted; pausing after the fish in flight...")
+        stop_event.set()
+        thread.join()
+    return result.get("job")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-characterize or re-cluster fish that were already detected."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    for kind in JOB_KINDS:
+        command = commands.add_parser(kind)
+        command.add_argument("--video", help="Only fish of this video")
+        command.add_argument(
+            "--status",
+            action="append",
+            choices=FISH_STATUSES,
+            help="Only fish with this status (repeatable)",
+        )
+        command.add_argument(
+            "--taxon",
+            action="append",
+            metavar="RANK=NAME",
+            help="Only fish with this taxon, e.g. Species=Unknown (repeatable)",
+        )
+        command.add_argument(
+            "--min-unknown-ranks",
+            type=int,
+            help='Only fish with at least this many "Unknown" ranks',
+        )
+    commands.choices["recluster"].add_argument(
+        "--hash-threshold",
+        type=int,
+        default=RECLUSTER_HASH_THRESHOLD,
+        help="Max differing pHash bits of merged fish (default RECLUSTER_HASH_THRESHOLD)",
+    )
+    commands.choices["recluster"].add_argument(
+        "--dry-run", action="store_true", help="Only count what would be merged"
+    )
+    resume = commands.add_parser("resume")
+    resume.add_argument("job_id", type=int)
+    commands.add_parser("list")
+    for command in (commands.choices["characterize"], resume):
+        command.add_argument(
+            "--llm-workers", type=int, default=1, help="Characterization threads"
+        )
+        command.add_argument(
+            "--rpm",
+            type=int,
+            default=REPROCESS_RPM,
+            help="Gemini requests per minute of this process (default REPROCESS_RPM, 0 uses GEMINI_RPM)",
+        )
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for job in get_reprocess_jobs():
+            print(
+                f"{job['id']:>5}  {job['kind']:<12} {job['status']:<9} "
+                f"{json.dumps(job['selection'])}  {json.dumps(job['stats'])}"
+            )
+        raise SystemExit(0)
+
+    if args.command == "resume":
+        job_id = args.job_id
+    else:
+        try:
+            job_id = create_job(
+                args.command,
+                video_filename=args.video,
+                statuses=args.status,
+                taxon=_parse_taxon(args.taxon),
+                min_unknown_ranks=args.min_unknown_ranks,
+                hash_threshold=getattr(args, "hash_threshold", None),
+                dry_run=getattr(args, "dry_run", False),
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Created reprocess job {job_id}.")
+
+    if getattr(args, "rpm", 0) > 0:
+        import llm_handler
+
+        llm_handler.REQUEST_INTERVAL = 60.0 / args.rpm
+    # Leave the CPU to detection running on the same machine
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+    job = _run_in_foreground(job_id, getattr(args, "llm_workers", 1))
+    if job:
+        print(f"Job {job['id']} is {job['status']}: {json.dumps(job['stats'])}")
@@ -0,0 +1,146 @@
+"""
+Tests of the characterization cascade (llm_handler.get_fish_taxonomy) with
+the stub Gemini models of bench/stubs.py, so no API key or network is needed.
+
+    python -m unittest discover tests
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "bench"))
+
+# The app modules read their configuration when they are imported
+WORKDIR = tempfile.mkdtemp(prefix="fish_tests_")
+os.environ["FISH_DATABASE"] = os.path.join(WORKDIR, "fish.db")
+os.environ["FISH_IMAGE_DIR"] = os.path.join(WORKDIR, "detected_fish")
+os.environ["LLM_FIRST_PASS_MODEL"] = "fake-first-pass"
+os.environ["LLM_FIRST_PASS_PRICE"] = "0.075,0.30"
+os.environ["LLM_MODEL_PRICE"] = "0.10,0.40"
+os.environ["LLM_ESCALATE_UNKNOWN_RANKS"] = "3"
+os.environ["LLM_ESCALATE_CONFIDENCE"] = "0.6"
+
+import numpy as np  # noqa: E402
+import cv2  # noqa: E402
+
+import database  # noqa: E402
+import llm_handler  # noqa: E402
+from stubs import FakeGeminiModel  # noqa: E402
+
+FIRST_PASS_LATENCY = 0.02
+MAIN_LATENCY = 0.05
+
+
+def tearDownModule():
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+class ModelCascadeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        database.init_db()
+        llm_handler.REQUEST_INTERVAL = 0
+
+    def tearDown(self):
+        llm_handler._first_pass_model = None
+        llm_handler._model = None
+
+    def characterize(self, first_pass, main):
+        """Characterizes a new fish with the given stub models; returns its taxonomy."""
+        llm_handler._first_pass_model = first_pass
+        llm_handler._model = main
+        image_filename = os.path.join("test_video", f"fish_{self.id().split('.')[-1]}.png")
+        image_path = os.path.join(database.IMAGE_DIR, image_filename)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        cv2.imwrite(image_path, np.full((32, 48, 3), 128, dtype=np.uint8))
+        # A hash of its own, so every test adds a new fish
+        p_hash = hashlib.md5(image_filename.encode()).hexdigest()[:16]
+        fish_id = database.add_or_update_fish(image_filename, "test_video.mp4", "00:00:01", p_hash)
+
+        self.assertEqual(llm_handler.get_fish_taxonomy(fish_id, image_filename), "characterized")
+        fish = database.get_fish_by_ids([fish_id])[fish_id]
+        self.assertEqual(fish["status"], "characterized")
+        return json.loads(fish["taxonomy_json"])
+
+    def test_accepted_first_pass(self):
+        first_pass = FakeGeminiModel(latency=FIRST_PASS_LATENCY, confidence=0.9)
+        main = FakeGeminiModel(latency=MAIN_LATENCY)
+        taxonomy = self.characterize(first_pass, main)
+
+        characterization = taxonomy["Characterization"]
+        self.assertEqual(characterization["tier"], "first_pass")
+        self.assertIsNone(characterization["escalation_reason"])
+        self.assertEqual([r["tier"] for r in characterization["requests"]], ["first_pass"])
+        self.assertEqual(first_pass.calls, 1)
+        self.assertEqual(main.calls, 0)
+        self.assertEqual(taxonomy["Species"], "Thalassoma lunare")
+
+    def test_escalates_mostly_unknown_answers(self):
+        first_pass = FakeGeminiModel(latency=FIRST_PASS_LATENCY, accuracy=0.0, confidence=0.9)
+        main = FakeGeminiModel(latency=MAIN_LATENCY)
+        taxonomy = self.characterize(first_pass, main)
+
+        characterization = taxonomy["Characterization"]
+        self.assertEqual(characterization["escalation_reason"], "unknown_ranks")
+        self.assertEqual(characterization["tier"], "main")
+        self.assertEqual(main.calls, 1)
+        self.assertEqual(taxonomy["Species"], "Thalassoma lunare")
+
+    def test_escalates_low_confidence_answers(self):
+        first_pass = FakeGeminiModel(latency=FIRST_PASS_LATENCY, confidence=0.3)
+        main = FakeGeminiModel(latency=MAIN_LATENCY)
+        characterization = self.characterize(first_pass, main)["Characterization"]
+
+        self.assertEqual(characterization["escalation_reason"], "low_confidence")
+        self.assertEqual(characterization["tier"], "main")
+        self.assertEqual(main.calls, 1)
+
+    def test_keeps_first_pass_when_main_model_is_worse(self):
+        first_pass = FakeGeminiModel(latency=FIRST_PASS_LATENCY, confidence=0.3)
+        main = FakeGeminiModel(latency=MAIN_LATENCY, accuracy=0.0)
+        taxonomy = self.characterize(first_pass, main)
+
+        self.assertEqual(taxonomy["Characterization"]["tier"], "first_pass")
+        self.assertEqual(taxonomy["Species"], "Thalassoma lunare")
+
+    def test_records_cost_and_latency_per_tier(self):
+        first_pass = FakeGeminiModel(latency=FIRST_PASS_LATENCY, accuracy=0.0)
+        main = FakeGeminiModel(latency=MAIN_LATENCY)
+        characterization = self.characterize(first_pass, main)["Characterization"]
+
+        requests = {r["tier"]: r for r in characterization["requests"]}
+        self.assertEqual(set(requests), {"first_pass", "main"})
+        self.assertEqual(requests["first_pass"]["model"], "fake-first-pass")
+        self.assertGreaterEqual(requests["first_pass"]["latency_seconds"], FIRST_PASS_LATENCY)
+        self.assertGreaterEqual(requests["main"]["latency_seconds"], MAIN_LATENCY)
+        for tier, (input_price, output_price) in (
+            ("first_pass", (0.075, 0.30)),
+            ("main", (0.10, 0.40)),
+        ):
+            request = requests[tier]
+            expected = (
+                request["input_tokens"] * input_price + request["output_tokens"] * output_price
+            ) / 1e6
+            self.assertGreater(request["cost_usd"], 0)
+            self.assertAlmostEqual(request["cost_usd"], expected, places=8)
+        self.assertAlmostEqual(
+            characterization["cost_usd"],
+            requests["first_pass"]["cost_usd"] + requests["main"]["cost_usd"],
+            places=8,
+        )
+        self.assertAlmostEqual(
+            characterization["latency_seconds"],
+            requests["first_pass"]["latency_seconds"] + requests["main"]["latency_seconds"],
+            places=3,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+"""
+Chunked, resumable uploads.
+
+Protocol (see the /uploads routes in app.py):
+
+1. POST /uploads with {"filename", "size"} starts an upload, or returns the
+   unfinished upload of the same file so the client can continue it.
+2. PUT /uploads/<upload_id>?offset=N with the next chunk as the request body.
+   The offset must equal the number of bytes received so far; otherwise the
+   server answers 409 with the offset to continue from.
+3. GET /uploads/<upload_id> returns the current offset (e.g. after a dropped
+   connection).
+
+Chunks are appended to uploads/.partial/<upload_id>/<filename>, so the size of
+that file is always the number of bytes received, and the file already has
+the final name that results are stored under. Only a chunk has to fit into
+MAX_CONTENT_LENGTH; the video itself has no size limit.
+
+Containers whose frames can be decoded from a prefix of the file (Matroska,
+WebM, MPEG-TS, and MP4/MOV with the moov atom before the media data) can be
+detected on while the rest is still uploading; see is_streamable().
+"""
+
+import os
+import shutil
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+from dotenv import load_dotenv
+
+from database import create_upload, find_unfinished_upload
+
+load_dotenv()
+
+# --- Configuration ---
+UPLOAD_CHUNK_SIZE = int(
+    os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024))
+)  # Chunk size suggested to clients
+EARLY_DETECTION = os.getenv("EARLY_DETECTION", "1") == "1"
+EARLY_DETECTION_MIN_BYTES = int(
+    os.getenv("EARLY_DETECTION_MIN_BYTES", str(16 * 1024 * 1024))
+)  # Received bytes before detection may start on a partial upload
+EARLY_DETECTION_STEP_BYTES = int(
+    os.getenv("EARLY_DETECTION_STEP_BYTES", str(64 * 1024 * 1024))
+)  # New bytes needed before detection continues on the partial file
+EARLY_DETECTION_IDLE_SECONDS = float(
+    os.getenv("EARLY_DETECTION_IDLE_SECONDS", "300")
+)  # Early detection pauses (until the upload completes) if no data arrives for this long
+PARTIAL_DIRNAME = ".partial"
+
+STREAMABLE_EXTENSIONS = (".mkv", ".webm", ".ts", ".mts", ".m2ts")
+ISO_BMFF_EXTENSIONS = (".mp4", ".m4v", ".mov")
+
+_write_locks = {}
+_write_locks_lock = threading.Lock()
+
+
+class UploadOffsetError(Exception):
+    """A chunk did not start where the received data ends."""
+
+    def __init__(self, expected_offset):
+        super().__init__(f"Expected a chunk at offset {expected_offset}")
+        self.expected_offset = expected_offset
+
+
+def partial_upload_path(upload_folder, upload):
+    """Where the chunks of an upload are collected."""
+    return os.path.join(
+        upload_folder, PARTIAL_DIRNAME, upload["upload_id"], upload["video_filename"]
+    )
+
+
+def received_bytes(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def start_upload(upload_folder, video_filename, size_bytes, options):
+    """
+    Starts a chunked upload, or returns the unfinished upload of the same
+    file name and size so that it can be resumed.
+    """
+    upload = find_unfinished_upload(video_filename, size_bytes)
+    if upload and os.path.exists(partial_upload_path(upload_folder, upload)):
+        return upload
+
+    upload_id = uuid.uuid4().hex
+    create_upload(upload_id, video_filename, size_bytes, options)
+    upload = {
+        "upload_id": upload_id,
+        "video_filename": video_filename,
+        "size_bytes": size_bytes,
+        "options": options,
+        "status": "uploading",
+    }
+    path = partial_upload_path(upload_folder, upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+    return upload
+
+
+def append_chunk(upload, path, offset, stream, block_size=1024 * 1024):
+    """
+    Appends the data of `stream` at `offset` and returns the new offset.
+
+    Raises UploadOffsetError if `offset` is not the number of bytes received
+    so far, and ValueError if the data runs past the declared size.
+    """
+    with _write_locks_lock:
+        lock = _write_locks.setdefault(upload["upload_id"], threading.Lock())
+    with lock, open(path, "ab") as f:
+        # Chunks of one upload may arrive at different app processes
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        received = received_bytes(path)
+        if offset != received:
+            raise UploadOffsetError(received)
+
+        remaining = upload["size_bytes"] - received
+        while True:
+            data = stream.read(block_size)
+            if not data:
+                break
+            if len(data) > remaining:
+                raise ValueError("Chunk runs past the declared upload size")
+            f.write(data)
+            remaining -= len(data)
+        return upload["size_bytes"] - remaining
+
+
+def discard_partial_upload(upload_folder, upload):
+    """Removes the partial directory of an upload once its file has been moved."""
+    path = partial_upload_path(upload_folder, upload)
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    with _write_locks_lock:
+        _write_locks.pop(upload["upload_id"], None)
+
+
+def is_streamable(path):
+    """
+    Whether frames can be decoded from what has been received of `path` so far:
+    True, False, or None if that is not known yet (too little data).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in STREAMABLE_EXTENSIONS:
+        return True
+    if extension not in ISO_BMFF_EXTENSIONS:
+        return False
+
+    # Walk the top-level boxes: the moov box (sample tables) must come before
+    # mdat and be fully received
+    available = received_bytes(path)
+    offset = 0
+    with open(path, "rb") as f:
+        while True:
+            f.seek(offset)
+            header = f.read(16)
+            if len(header) < 8:
+                return None
+            box_size = int.from_bytes(header[:4], "big")
+            box_type = header[4:8]
+            if box_size == 1:  # 64-bit size
+                if len(header) < 16:
+                    return None
+                box_size = int.from_bytes(header[8:16], "big")
+            elif box_size == 0:  # Box runs to the end of the file
+                return False
+            if box_size < 8:
+                return False
+            if box_type == b"mdat":
+                return False
+            if box_type == b"moov":
+                return True if offset + box_size <= available else None
+            offset += box_size